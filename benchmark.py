@@ -0,0 +1,676 @@
+#!/usr/bin/env python3
+"""
+Benchmarks for the payslip pipeline
+
+    python3 benchmark.py parse --payslips 2000 --noise-lines 200
+    python3 benchmark.py preprocess ./images --max-side 2000 1600 1200 --autocrop
+    python3 benchmark.py images ./synthetic --images 200
+    python3 benchmark.py pipeline --images 50 --ocr easyocr tesseract
+
+`parse` times PayslipExtractor.parse_payslip on synthetic OCR text dumps,
+next to a frozen copy of the parser before the rule table, so parsing
+changes can be compared without running OCR.
+
+`images` renders synthetic payslip images with Pillow, in the printed
+layout of the real payslips, plus a JSON file with their ground truth.
+
+`pipeline` runs synthetic images through the whole pipeline (OCR, parse,
+consolidated workbook) for each OCR engine, then each stage on its own,
+and reports images/sec, latency percentiles and field accuracy against
+the ground truth.
+
+`preprocess` OCRs real payslip images at full resolution and after each
+preprocessing setting, and reports the OCR time per image and how many
+parsed fields still agree with the full-resolution result.
+"""
+
+import json
+import os
+import random
+import re
+import statistics
+import tempfile
+import time
+from typing import Dict, List, Tuple
+
+from PIL import Image, ImageDraw, ImageFilter, ImageFont
+
+from metrics import MetricsCollector, percentile
+from payslip_processor import ExcelWriter, PayslipExtractor, find_images, write_consolidated
+from preprocess import Preprocessor
+
+
+FIRST_NAMES = ['KYAW', 'KHIN', 'ZAW', 'TIN', 'MOHAMMAD', 'MD', 'THEIN', 'WIN', 'AUNG', 'NUR']
+LAST_NAMES = ['SWAR HTET', 'YU MAW', 'LIN OO', 'MOE KHAING', 'ABDUL KARIM', 'ZAW OO', 'HLAING MIN', 'KO KO']
+NOISE_WORDS = ['CATEGORY', 'DW', 'PH', 'AL', 'RATE', 'HRS', 'DAYS', 'AMOUNT', 'SIGNATURE', 'REMARK', 'TOTAL']
+
+
+def make_payslip(rng: random.Random) -> Tuple[Dict[str, any], Dict[str, any]]:
+    """
+    Random payslip figures and the fields parse_payslip should recover from them
+
+    Returns:
+        (figures used to render the payslip, expected parsed fields)
+    """
+    basic_rate = rng.choice([1500.0, 1650.0, 1700.0, 1800.0])
+    ot_rate = round(basic_rate / 26 / 8 * 1.5, 4)
+    ot_hours = float(rng.randint(0, 60))
+    ot_amount = round(ot_rate * ot_hours, 2)
+    allowance = float(rng.choice([0, 100, 150, 230]))
+    gross = round(basic_rate + ot_amount + allowance, 2)
+    socso = round(gross * 0.005, 2)
+    figures = {
+        'employee_no': f"Y{rng.randint(1, 9999):04d}",
+        'employee_name': f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}",
+        'ic_no': f"MD{rng.randint(100000, 999999)}",
+        'basic_rate': basic_rate,
+        'working_days': 26.0,
+        'basic_pay': basic_rate,
+        'ot_rate': ot_rate,
+        'ot_hours': ot_hours,
+        'ot_amount': ot_amount,
+        'allowance': allowance,
+        'monthly_gross': gross,
+        'socso_employer': round(gross * 0.0175, 2),
+        'socso_employee': socso,
+        'nett_pay': round(gross - socso, 2),
+    }
+    expected = {
+        'employee_no': figures['employee_no'],
+        'employee_name': figures['employee_name'],
+        'ic_no': figures['ic_no'],
+        'basic_rate': basic_rate,
+        'working_days': 26.0,
+        'basic_pay': basic_rate,
+        'monthly_gross': gross,
+        'socso_employer': figures['socso_employer'],
+        'socso_employee': socso,
+        'nett_pay': figures['nett_pay'],
+    }
+    return figures, expected
+
+
+def render_text(figures: Dict[str, any], rng: random.Random, noise_lines: int = 0) -> str:
+    """Render payslip figures as OCR output lines, one detection per line"""
+    lines = [
+        'APEXJAYA INDUSTRIES SDN BHD',
+        '2ND HALF PAYROLL - SEPTEMBER 2024',
+        'MONTHLY / BANK 30/09/2024',
+        f"EMPLOYEE / LINE NO. {figures['employee_no']}",
+        f"NAME {figures['employee_name']}",
+        f"I/C NO. {figures['ic_no']}",
+        f"BASIC RATE {figures['basic_rate']:.2f}",
+        f"WORKING DAYS {figures['working_days']:.2f}",
+        f"LEADER ALLW. {figures['allowance']:.2f}",
+        f"BASIC PAY {figures['basic_pay']:.2f}",
+        'OVERTIME RATE HRS / DAYS AMOUNT',
+        f"1.5 TIMES {figures['ot_rate']} {figures['ot_hours']:.2f} HRS {figures['ot_amount']:.2f}",
+        f"MONTHLY GROSS {figures['monthly_gross']:.2f}",
+        "EPF ' YER 0.00",
+        f"SOCSO ' YER {figures['socso_employer']:.2f}",
+        "EIS ' YER 0.00",
+        'YTD AL 3.00 DAYS [ 13.00]',
+        'YTD MC 0.00 DAYS [ 18.00]',
+    ]
+    # OCR picks up stray text (stamps, handwriting, background) between the real lines
+    for _ in range(noise_lines):
+        noise = ' '.join(rng.choice(NOISE_WORDS) for _ in range(rng.randint(1, 4)))
+        if rng.random() < 0.5:
+            noise += f" {rng.uniform(0, 100):.2f}"
+        lines.insert(rng.randint(1, len(lines)), noise)
+    lines += [
+        'BASIC PAY DIRECTOR FEE OVERTIME ALLOWANCE GROSS PAY DEDUCTION EPF SOCSO EIS NETT',
+        f"{figures['basic_pay']:.2f} 0.00 {figures['ot_amount']:.2f} {figures['allowance']:.2f} "
+        f"{figures['monthly_gross']:.2f} 0.00 0.00 {figures['socso_employee']:.2f} 0.00 "
+        f"{figures['nett_pay']:.2f}",
+    ]
+    return '\n'.join(lines)
+
+
+# Summary table of the payslip: heading, x position, figure printed under it
+SUMMARY_TABLE = [
+    ('BASIC PAY', 195, 'basic_pay'), ('DIRECTOR FEE', 308, None), ('OVERTIME', 433, 'ot_amount'),
+    ('ALLOWANCE', 529, 'allowance'), ('GROSS PAY', 639, 'monthly_gross'), ('DEDUCTION', 741, None),
+    ('EPF', 850, None), ('SOCSO', 932, 'socso_employee'), ('EIS', 1004, None), ('NETT', 1048, 'nett_pay'),
+]
+
+
+def render_image(figures: Dict[str, any], rng: random.Random, width: int = 1440,
+                 photo: bool = True) -> Image.Image:
+    """
+    Render payslip figures as an image in the layout of the printed payslips
+
+    Positions follow the sample photo (1440 x 810) and are scaled to width.
+
+    Args:
+        figures: Figures from make_payslip
+        rng: Random source for the photo effects
+        width: Image width in pixels
+        photo: Add a slight tilt, blur and uneven lighting like a phone photo
+    """
+    scale = width / 1440
+    img = Image.new('RGB', (width, round(810 * scale)), (250, 250, 246))
+    draw = ImageDraw.Draw(img)
+    font = ImageFont.load_default(size=max(8, round(15 * scale)))
+    bold = ImageFont.load_default(size=max(8, round(18 * scale)))
+
+    def put(x, y, text, anchor='ls', f=font):
+        draw.text((x * scale, y * scale), text, fill=(25, 25, 25), font=f, anchor=anchor)
+
+    def amount(x, y, value):
+        put(x, y, f"{value:.2f}", anchor='rs')
+
+    put(170, 95, 'APEXJAYA INDUSTRIES SDN BHD', f=bold)
+    put(562, 120, '2ND HALF PAYROLL - SEPTEMBER 2024', f=bold)
+    put(1327, 75, 'MONTHLY / BANK', anchor='rs', f=bold)
+    put(1327, 95, '30/09/2024', anchor='rs')
+
+    put(172, 147, 'EMPLOYEE / LINE NO.')
+    put(395, 147, figures['employee_no'])
+    put(172, 170, 'CATEGORY')
+    put(782, 140, 'NAME')
+    put(927, 133, figures['employee_name'])
+    put(782, 162, 'I/C NO.')
+    put(927, 157, figures['ic_no'])
+
+    put(180, 208, 'BASIC RATE')
+    amount(670, 203, figures['basic_rate'])
+    put(180, 230, 'WORKING DAYS')
+    amount(670, 224, figures['working_days'])
+    put(188, 346, 'BASIC PAY')
+    amount(673, 338, figures['basic_pay'])
+
+    put(784, 189, 'ALLOWANCE')
+    put(784, 218, 'LEADER ALLW.')
+    amount(1035, 213, figures['allowance'])
+
+    put(194, 488, 'OVERTIME')
+    put(387, 484, 'RATE')
+    put(469, 482, 'HRS / DAYS')
+    put(608, 481, 'AMOUNT')
+    draw.line([(193 * scale, 497 * scale), (675 * scale, 493 * scale)], fill=(40, 40, 40), width=2)
+    put(194, 545, '1.5 TIMES')
+    put(430, 541, f"{figures['ot_rate']}", anchor='rs')
+    put(461, 539, f"{figures['ot_hours']:.2f} HRS")
+    amount(676, 537, figures['ot_amount'])
+
+    put(790, 510, 'MONTHLY GROSS')
+    amount(1045, 509, figures['monthly_gross'])
+    put(790, 532, "EPF ' YER")
+    amount(1045, 530, 0.0)
+    put(792, 554, "SOCSO ' YER")
+    amount(1045, 552, figures['socso_employer'])
+    put(792, 577, "EIS ' YER")
+    put(792, 598, 'YTD AL')
+    put(1015, 597, '3.00')
+    put(1077, 596, 'DAYS [ 13.00]')
+    put(792, 621, 'YTD MC')
+    put(1015, 619, '0.00')
+    put(1077, 618, 'DAYS [ 18.00]')
+
+    for heading, x, key in SUMMARY_TABLE:
+        put(x, 668, heading)
+        value = figures[key] if key else 0.0
+        put(x + 60, 705, f"{value:.2f}", anchor='rs')
+    draw.line([(195 * scale, 680 * scale), (1100 * scale, 676 * scale)], fill=(40, 40, 40), width=2)
+    put(1145, 688, "EMPLOYEE'S SIGNATURE")
+
+    if photo:
+        img = img.rotate(rng.uniform(-1.5, 1.5), resample=Image.BICUBIC, expand=False,
+                         fillcolor=(40, 60, 120))
+        img = img.filter(ImageFilter.GaussianBlur(rng.uniform(0.3, 0.8)))
+        # Darker towards the lower right, like the shadow of the phone
+        gradient = Image.linear_gradient('L')
+        shade = Image.blend(gradient, gradient.transpose(Image.Transpose.ROTATE_90), 0.5).resize(img.size)
+        img = Image.composite(img, img.point(lambda v: v * 0.55), shade.point(lambda v: 255 - v // 2))
+    return img
+
+
+def generate_images(image_dir: str, count: int, seed: int, width: int = 1440,
+                    photo: bool = True) -> Dict[str, Dict[str, any]]:
+    """
+    Render count synthetic payslips into image_dir
+
+    Returns:
+        image path -> expected parsed fields (also saved as ground_truth.json)
+    """
+    os.makedirs(image_dir, exist_ok=True)
+    rng = random.Random(seed)
+    truth = {}
+    for index in range(count):
+        figures, expected = make_payslip(rng)
+        path = os.path.join(image_dir, f"synthetic_{index:05d}.jpg")
+        render_image(figures, rng, width, photo).save(path, quality=88)
+        truth[path] = expected
+    with open(os.path.join(image_dir, 'ground_truth.json'), 'w', encoding='utf-8') as f:
+        json.dump({os.path.basename(path): expected for path, expected in truth.items()}, f, indent=2)
+    return truth
+
+
+def field_accuracy(parsed: Dict[str, any], expected: Dict[str, any]) -> Tuple[int, int]:
+    """Count (correct, total) expected fields in a parsed record"""
+    correct = 0
+    for field, value in expected.items():
+        got = parsed.get(field)
+        if isinstance(value, float):
+            correct += isinstance(got, float) and abs(got - value) < 0.005
+        else:
+            correct += got == value
+    return correct, len(expected)
+
+
+def baseline_parse_payslip(text: str) -> Dict[str, any]:
+    """
+    Frozen copy of parse_payslip before the PAYSLIP_RULES table
+
+    bench_parse times it next to the current parser. Kept as it was, bugs
+    included, so the numbers stay comparable.
+    """
+
+    data = {
+        'company_name': '',
+        'employee_no': '',
+        'employee_name': '',
+        'ic_no': '',
+        'period': '',
+        'date': '',
+        'basic_rate': 0.0,
+        'working_days': 0.0,
+        'basic_pay': 0.0,
+        'allowances': {},
+        'overtime': [],
+        'monthly_gross': 0.0,
+        'epf_employer': 0.0,
+        'socso_employer': 0.0,
+        'eis_employer': 0.0,
+        'ytd_al': 0.0,
+        'ytd_mc': 0.0,
+        'deduction': 0.0,
+        'epf_employee': 0.0,
+        'socso_employee': 0.0,
+        'eis_employee': 0.0,
+        'nett_pay': 0.0
+    }
+
+    lines = text.split('\n')
+
+    # Extract company name
+    for line in lines:
+        if 'INDUSTRIES' in line or 'SDN BHD' in line:
+            data['company_name'] = line.strip()
+            break
+
+    # Extract employee information
+    for i, line in enumerate(lines):
+        # Employee number
+        if 'EMPLOYEE' in line and 'LINE NO' in line:
+            # Look for Y#### pattern
+            match = re.search(r'Y\d+', line)
+            if match:
+                data['employee_no'] = match.group()
+
+        # Employee name and IC
+        if 'NAME' in line:
+            # Look in nearby lines for name
+            for j in range(max(0, i-2), min(len(lines), i+3)):
+                name_match = re.search(r'KYAW\s+\w+\s+\w+|[A-Z]{2,}\s+[A-Z]{2,}\s+[A-Z]{2,}', lines[j])
+                if name_match:
+                    data['employee_name'] = name_match.group().strip()
+
+        if 'I/C NO' in line or 'IC NO' in line:
+            match = re.search(r'MD\d+|[A-Z]{2}\d+', line)
+            if match:
+                data['ic_no'] = match.group()
+
+        # Period and date
+        if 'PAYROLL' in line and ('SEPTEMBER' in line or re.search(r'\w+\s+\d{4}', line)):
+            data['period'] = line.strip()
+
+        if 'MONTHLY' in line and 'BANK' in line:
+            date_match = re.search(r'\d{2}/\d{2}/\d{4}', line)
+            if date_match:
+                data['date'] = date_match.group()
+
+        # Basic rate and working days
+        if 'BASIC RATE' in line:
+            match = re.search(r'(\d+\.?\d*)', line)
+            if match:
+                data['basic_rate'] = float(match.group(1))
+
+        if 'WORKING DAYS' in line:
+            match = re.search(r'(\d+\.?\d*)', line)
+            if match:
+                data['working_days'] = float(match.group(1))
+
+        # Basic pay
+        if 'BASIC PAY' in line and 'DIRECTOR' not in line:
+            match = re.search(r'(\d+\.?\d*)', line)
+            if match:
+                data['basic_pay'] = float(match.group(1))
+
+        # Allowances
+        if 'LEADER ALLW' in line or 'ALLOWANCE' in line:
+            match = re.search(r'(\d+\.?\d*)', line)
+            if match and 'LEADER' in line:
+                data['allowances']['LEADER_ALLW'] = float(match.group(1))
+
+        # Monthly gross
+        if 'MONTHLY GROSS' in line:
+            match = re.search(r'(\d+\.?\d*)', line)
+            if match:
+                data['monthly_gross'] = float(match.group(1))
+
+        # EPF, SOCSO, EIS
+        if "EPF" in line and "YER" in line:
+            match = re.search(r'(\d+\.?\d*)', line)
+            if match:
+                data['epf_employer'] = float(match.group(1))
+
+        if "SOCSO" in line and "YER" in line:
+            match = re.search(r'(\d+\.?\d*)', line)
+            if match:
+                data['socso_employer'] = float(match.group(1))
+
+        if "EIS" in line and "YER" in line:
+            match = re.search(r'(\d+\.?\d*)', line)
+            if match:
+                data['eis_employer'] = float(match.group(1))
+
+        # YTD AL and MC
+        if 'YTD AL' in line:
+            match = re.search(r'(\d+\.?\d*)', line)
+            if match:
+                data['ytd_al'] = float(match.group(1))
+
+        if 'YTD MC' in line:
+            match = re.search(r'(\d+\.?\d*)', line)
+            if match:
+                data['ytd_mc'] = float(match.group(1))
+
+        # Overtime
+        if '1.5 TIMES' in line or 'OVERTIME' in line:
+            # Try to extract overtime details
+            numbers = re.findall(r'\d+\.?\d*', line)
+            if len(numbers) >= 3:
+                data['overtime'].append({
+                    'type': '1.5 TIMES',
+                    'rate': float(numbers[0]) if numbers else 0,
+                    'hours': float(numbers[1]) if len(numbers) > 1 else 0,
+                    'amount': float(numbers[2]) if len(numbers) > 2 else 0
+                })
+
+    # Try to extract summary line (last line with all values)
+    for line in reversed(lines):
+        if 'NETT' in line or re.findall(r'\d+\.?\d*', line):
+            numbers = re.findall(r'\d+\.?\d*', line)
+            if len(numbers) >= 8:
+                try:
+                    data['basic_pay'] = float(numbers[0])
+                    # numbers[1] is director fee
+                    data['overtime_total'] = float(numbers[2]) if len(numbers) > 2 else 0
+                    data['allowance_total'] = float(numbers[3]) if len(numbers) > 3 else 0
+                    data['monthly_gross'] = float(numbers[4]) if len(numbers) > 4 else 0
+                    data['deduction'] = float(numbers[5]) if len(numbers) > 5 else 0
+                    data['epf_employee'] = float(numbers[6]) if len(numbers) > 6 else 0
+                    data['socso_employee'] = float(numbers[7]) if len(numbers) > 7 else 0
+                    if len(numbers) > 8:
+                        data['eis_employee'] = float(numbers[8])
+                    if len(numbers) > 9:
+                        data['nett_pay'] = float(numbers[9])
+                    break
+                except (ValueError, IndexError):
+                    pass
+
+    return data
+
+
+def bench_parse(payslips: int, noise_lines: int, repeat: int, seed: int):
+    """Time parse_payslip on synthetic OCR dumps, against baseline_parse_payslip"""
+    rng = random.Random(seed)
+    dumps = []
+    for _ in range(payslips):
+        figures, expected = make_payslip(rng)
+        dumps.append((render_text(figures, rng, noise_lines), expected))
+
+    # parse_payslip does not touch the OCR engine, so skip loading one
+    extractor = PayslipExtractor.__new__(PayslipExtractor)
+    parsers = [('baseline', baseline_parse_payslip), ('parse_payslip', extractor.parse_payslip)]
+
+    timings = {label: [] for label, _ in parsers}
+    accuracy = {label: [0, 0] for label, _ in parsers}
+    # The parsers take turns, so both see the same machine load
+    for run in range(repeat):
+        for label, parse in parsers:
+            for text, expected in dumps:
+                start = time.perf_counter()
+                parsed = parse(text)
+                timings[label].append(time.perf_counter() - start)
+                if run == 0:
+                    c, t = field_accuracy(parsed, expected)
+                    accuracy[label][0] += c
+                    accuracy[label][1] += t
+
+    lines = sum(text.count('\n') + 1 for text, _ in dumps) / len(dumps)
+    print(f"{payslips} payslips x {repeat} runs, {lines:.0f} OCR lines each")
+    for label, _ in parsers:
+        correct, total = accuracy[label]
+        print(f"{label}:")
+        print(f"  mean {statistics.mean(timings[label]) * 1e6:.1f} us, p50 {percentile(timings[label], 50) * 1e6:.1f} us, "
+              f"p95 {percentile(timings[label], 95) * 1e6:.1f} us per payslip")
+        print(f"  {len(timings[label]) / sum(timings[label]):.0f} payslips/sec")
+        print(f"  field accuracy {correct}/{total} ({100 * correct / total:.1f}%)")
+    speedup = statistics.median(timings['baseline']) / statistics.median(timings['parse_payslip'])
+    print(f"parse_payslip vs baseline: {speedup:.2f}x (p50)")
+
+
+def _latency(label: str, timings: List[float]):
+    """Print throughput and latency percentiles of one measurement"""
+    print(f"  {label:<22}{len(timings) / sum(timings):>9.2f}/s  p50 {percentile(timings, 50) * 1000:>8.1f} ms  "
+          f"p95 {percentile(timings, 95) * 1000:>8.1f} ms  max {max(timings) * 1000:>8.1f} ms")
+
+
+def bench_pipeline(count: int, engines: List[str], template_path: str, seed: int, width: int,
+                   photo: bool, image_dir: str = None, ocr_batch_sizes: List[int] = ()):
+    """
+    Run synthetic payslips through the full pipeline and each stage on its own
+
+    End to end means OCR + parse for every image and one consolidated
+    workbook for the batch, as `--batch --consolidate` does. OCR cache and
+    preprocessing stay off. Each of ocr_batch_sizes adds a run of batched OCR
+    (PayslipExtractor.extract_detections_batch) to compare with one image per call.
+    """
+    workdir = image_dir or tempfile.mkdtemp(prefix='payslip_bench_')
+    truth = generate_images(workdir, count, seed, width, photo)
+    images = sorted(truth)
+    print(f"{count} synthetic payslips ({width}px wide) in {workdir}")
+
+    for engine in engines:
+        print(f"\n{'='*60}\n{engine}\n{'='*60}")
+        try:
+            extractor = PayslipExtractor(ocr_engine=engine)
+            if engine in ('tesseract', 'cascade'):
+                # pytesseract imports fine without the tesseract binary
+                extractor.pytesseract.get_tesseract_version()
+        except Exception as e:
+            print(f"  skipped: {e}")
+            continue
+
+        # End to end, with the stage breakdown of every image
+        metrics = MetricsCollector(track_memory=False)
+        results = []
+        correct = total = 0
+        start = time.perf_counter()
+        for path in images:
+            with metrics.measure(path) as record:
+                data = extractor.extract(path)
+            metrics.add(record)
+            results.append(data)
+            c, t = field_accuracy(data, truth[path])
+            correct += c
+            total += t
+        output_path = os.path.join(workdir, f"consolidated_{engine}.xlsx")
+        write_start = time.perf_counter()
+        write_consolidated(results, template_path, output_path)
+        write_seconds = time.perf_counter() - write_start
+        wall = time.perf_counter() - start
+
+        print(f"\nEnd to end: {count / wall:.2f} images/sec ({wall:.1f}s, startup "
+              f"{extractor.startup_time:.1f}s not included, workbook write {write_seconds:.2f}s)")
+        _latency('per image', [record['seconds'] for record in metrics.records])
+        metrics.print_report()
+        print(f"  field accuracy {correct}/{total} ({100 * correct / total:.1f}%)")
+
+        # Each stage on its own
+        print("\nStages on their own:")
+        timings = []
+        for path in images:
+            stage_start = time.perf_counter()
+            Image.open(path).load()
+            timings.append(time.perf_counter() - stage_start)
+        _latency('image decode', timings)
+
+        timings = []
+        texts = []
+        for path in images:
+            stage_start = time.perf_counter()
+            texts.append(extractor.extract_text(path))
+            timings.append(time.perf_counter() - stage_start)
+        _latency('OCR', timings)
+        print(f"    {count / sum(timings):.2f} images/sec one image per call")
+        for batch_size in ocr_batch_sizes:
+            stage_start = time.perf_counter()
+            extractor.extract_detections_batch(images, batch_size)
+            seconds = time.perf_counter() - stage_start
+            print(f"    {count / seconds:.2f} images/sec in batches of {batch_size}")
+
+        timings = []
+        for text in texts:
+            stage_start = time.perf_counter()
+            extractor.parse_payslip(text)
+            timings.append(time.perf_counter() - stage_start)
+        _latency('parse', timings)
+
+        stage_start = time.perf_counter()
+        writer = ExcelWriter(template_path)
+        load_seconds = time.perf_counter() - stage_start
+        timings = []
+        for data in results:
+            stage_start = time.perf_counter()
+            try:
+                writer.add_employee(data)
+            except ValueError:
+                continue
+            timings.append(time.perf_counter() - stage_start)
+        if timings:
+            _latency('employee row write', timings)
+        stage_start = time.perf_counter()
+        writer.save(os.path.join(workdir, f"stages_{engine}.xlsx"))
+        writer.close()
+        print(f"  template load {load_seconds:.2f}s, workbook save {time.perf_counter() - stage_start:.2f}s")
+
+
+# Fields compared between preprocessing settings
+COMPARED_FIELDS = ['employee_no', 'employee_name', 'ic_no', 'basic_rate', 'working_days', 'basic_pay',
+                   'monthly_gross', 'epf_employer', 'socso_employer', 'eis_employer', 'deduction',
+                   'epf_employee', 'socso_employee', 'eis_employee', 'nett_pay']
+
+
+def bench_preprocess(image_dir: str, ocr_engine: str, max_sides: List[int], options: Dict[str, any]):
+    """OCR time and field agreement of each max_side setting vs full resolution"""
+    image_files = find_images(image_dir)
+    if not image_files:
+        print(f"No images found in {image_dir}")
+        return
+
+    # The OCR cache stays off so every setting really runs OCR
+    extractor = PayslipExtractor(ocr_engine=ocr_engine)
+
+    def run(preprocessor):
+        extractor.preprocessor = preprocessor
+        timings, parsed = [], []
+        for image_path in image_files:
+            start = time.perf_counter()
+            data = extractor.extract(image_path)
+            timings.append(time.perf_counter() - start)
+            parsed.append(data)
+        return timings, parsed
+
+    base_timings, reference = run(None)
+    print(f"{len(image_files)} images, {ocr_engine}")
+    print(f"  {'setting':<24}{'mean s':>8}{'p95 s':>8}{'speed-up':>10}{'fields agree':>14}")
+    print(f"  {'full resolution':<24}{statistics.mean(base_timings):>8.2f}{percentile(base_timings, 95):>8.2f}"
+          f"{1.0:>9.2f}x{'100.0%':>14}")
+
+    for max_side in max_sides:
+        preprocessor = Preprocessor(max_side=max_side, **options)
+        timings, parsed = run(preprocessor)
+        correct = total = 0
+        for data, ref in zip(parsed, reference):
+            c, t = field_accuracy(data, {field: ref[field] for field in COMPARED_FIELDS})
+            correct += c
+            total += t
+        label = f"max side {max_side}"
+        print(f"  {label:<24}{statistics.mean(timings):>8.2f}{percentile(timings, 95):>8.2f}"
+              f"{statistics.mean(base_timings) / statistics.mean(timings):>9.2f}x"
+              f"{100 * correct / total:>13.1f}%")
+        preprocessor.print_report()
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Payslip pipeline benchmarks')
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    parse_cmd = sub.add_parser('parse', help='Time parse_payslip on synthetic OCR text')
+    parse_cmd.add_argument('--payslips', type=int, default=1000, help='Number of synthetic payslips')
+    parse_cmd.add_argument('--noise-lines', type=int, default=100,
+                           help='Stray OCR lines mixed into each payslip')
+    parse_cmd.add_argument('--repeat', type=int, default=3, help='Timing runs over the same payslips')
+    parse_cmd.add_argument('--seed', type=int, default=0, help='Random seed')
+
+    pre_cmd = sub.add_parser('preprocess', help='OCR time and accuracy of image preprocessing settings')
+    pre_cmd.add_argument('images', help='Directory of payslip images')
+    pre_cmd.add_argument('--ocr', choices=['easyocr', 'tesseract'], default='easyocr', help='OCR engine')
+    pre_cmd.add_argument('--max-side', type=int, nargs='+', default=[2000, 1600, 1200, 1000],
+                         help='Longer-side limits to compare with full resolution')
+    pre_cmd.add_argument('--exif-rotate', action='store_true', help='Also apply the EXIF orientation')
+    pre_cmd.add_argument('--autocrop', action='store_true', help='Also crop to the paper')
+    pre_cmd.add_argument('--grayscale', action='store_true', help='Also convert to grayscale')
+    pre_cmd.add_argument('--deskew', action='store_true', help='Also straighten tilted text')
+    pre_cmd.add_argument('--binarize', action='store_true', help='Also convert to black and white')
+
+    images_cmd = sub.add_parser('images', help='Render synthetic payslip images with ground truth')
+    images_cmd.add_argument('output', help='Directory for the images and ground_truth.json')
+    images_cmd.add_argument('--images', type=int, default=100, help='Number of images')
+    images_cmd.add_argument('--width', type=int, default=1440, help='Image width in pixels')
+    images_cmd.add_argument('--clean', action='store_true', help='No photo effects (tilt, blur, shadow)')
+    images_cmd.add_argument('--seed', type=int, default=0, help='Random seed')
+
+    pipe_cmd = sub.add_parser('pipeline', help='Full pipeline and per-stage throughput on synthetic images')
+    pipe_cmd.add_argument('--images', type=int, default=20, help='Number of synthetic payslips')
+    pipe_cmd.add_argument('--ocr', choices=['easyocr', 'tesseract', 'cascade'], nargs='+',
+                          default=['easyocr', 'tesseract'], help='OCR engines to compare')
+    pipe_cmd.add_argument('--template', default='SA - Empty.xlsx', help='Excel template')
+    pipe_cmd.add_argument('--width', type=int, default=1440, help='Image width in pixels')
+    pipe_cmd.add_argument('--clean', action='store_true', help='No photo effects (tilt, blur, shadow)')
+    pipe_cmd.add_argument('--keep', metavar='DIR', help='Render the images into DIR instead of a temp directory')
+    pipe_cmd.add_argument('--seed', type=int, default=0, help='Random seed')
+    pipe_cmd.add_argument('--ocr-batch-size', type=int, nargs='+', default=[], metavar='N',
+                          help='Also time batched OCR with these batch sizes')
+
+    args = parser.parse_args()
+
+    if args.command == 'parse':
+        bench_parse(args.payslips, args.noise_lines, args.repeat, args.seed)
+    elif args.command == 'images':
+        generate_images(args.output, args.images, args.seed, args.width, photo=not args.clean)
+        print(f"Wrote {args.images} images and ground_truth.json to {args.output}")
+    elif args.command == 'pipeline':
+        bench_pipeline(args.images, args.ocr, args.template, args.seed, args.width, not args.clean, args.keep,
+                       args.ocr_batch_size)
+    elif args.command == 'preprocess':
+        bench_preprocess(args.images, args.ocr, args.max_side, {
+            'exif_rotate': args.exif_rotate, 'autocrop': args.autocrop, 'grayscale': args.grayscale,
+            'deskew': args.deskew, 'binarize': args.binarize,
+        })
@@ -1,29 +1,26 @@
 #!/usr/bin/env python3
 """Script to check Excel template structure"""
 
+import sys
+
 import openpyxl
 
+from manifest import file_sha256
+from template_schema import TemplateSchema, analyse_template
+
+template_path = sys.argv[1] if len(sys.argv) > 1 else 'SA - Empty.xlsx'
+
 # Load the Excel template
-wb = openpyxl.load_workbook('SA - Empty.xlsx')
+wb = openpyxl.load_workbook(template_path)
 
 # Print all sheet names
 print("Sheet names:")
 for sheet_name in wb.sheetnames:
     print(f"  - {sheet_name}")
 
-# For each sheet, print its structure
-for sheet_name in wb.sheetnames:
-    sheet = wb[sheet_name]
-    print(f"\n=== Sheet: {sheet_name} ===")
-    print(f"Max row: {sheet.max_row}, Max column: {sheet.max_column}")
-
-    # Print first 30 rows with content
-    print("\nContent (first 30 rows):")
-    for row_idx, row in enumerate(sheet.iter_rows(min_row=1, max_row=30, values_only=False), 1):
-        row_values = [cell.value for cell in row if cell.value is not None]
-        if row_values:
-            # Also show cell coordinates
-            cells_info = [(cell.coordinate, cell.value) for cell in row if cell.value is not None]
-            print(f"Row {row_idx}: {cells_info}")
+# Header rows, column groups and sections as the writers see them
+# (always analysed afresh here, bypassing the schema cache)
+print(f"\n=== Schema of {template_path} ===")
+TemplateSchema(analyse_template(wb.active, file_sha256(template_path))).print_report()
 
 wb.close()
@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+"""
+OCR confidence of payslip values: which detections to re-read, and per-field confidence
+
+EasyOCR gives every detection a confidence. A misread amount usually comes
+with a low one, so instead of re-running whole pages at a higher
+resolution, only the weak detections that hold a number are cropped and
+recognised again (see PayslipExtractor._reocr_weak).
+
+After parsing, each field is traced back to the detection its value came
+from to report how confident the OCR was about that field.
+"""
+
+import re
+from typing import Dict, List, Optional, Tuple
+
+# Characters a numeric payslip value can contain (amounts, hours, dates)
+NUMERIC_CHARS = '0123456789.,-/'
+
+# Letters OCR commonly reads in place of digits
+_DIGIT_LOOKALIKES = str.maketrans('OoDQIl|SsBZz', '000011155822')
+_NUMERIC_TEXT = re.compile(r'[\d.,/\-\s]*\d[\d.,/\-\s]*')
+_NUMBER = re.compile(r'\d+\.?\d*')
+
+
+def numeric_text(text: str) -> bool:
+    """Whether a detection is a number, allowing for letters misread in place of digits"""
+    text = (text or '').strip()
+    if text.upper().startswith('RM'):
+        text = text[2:]
+    return bool(_NUMERIC_TEXT.fullmatch(text.translate(_DIGIT_LOOKALIKES)))
+
+
+def box_bounds(bbox, width: int, height: int, padding: int = 4) -> Tuple[int, int, int, int]:
+    """Pixel bounds (x0, y0, x1, y1) of a detection's polygon, padded and clipped to the image"""
+    xs = [point[0] for point in bbox]
+    ys = [point[1] for point in bbox]
+    return (max(0, int(min(xs)) - padding), max(0, int(min(ys)) - padding),
+            min(width, int(max(xs)) + padding), min(height, int(max(ys)) + padding))
+
+
+def _numbers(text: str) -> List[float]:
+    return [float(number) for number in _NUMBER.findall((text or '').replace(',', ''))]
+
+
+def field_confidences(data: Dict[str, any], detections: List[list]) -> Dict[str, float]:
+    """
+    Confidence of each parsed field, from the detection its value was read from
+
+    A number is traced to the detections containing it, text to the
+    detections containing it; with several candidates the most confident
+    one counts. Fields that cannot be traced, and detections without a
+    confidence (Tesseract), are left out.
+
+    Args:
+        data: Parsed payslip
+        detections: [bbox, text, confidence] the payslip was parsed from
+
+    Returns:
+        field -> confidence; allowances as 'allowances.<KEY>', overtime as
+        'overtime' (its least confident line)
+    """
+    scored = [(text or '', _numbers(text), confidence) for _, text, confidence in detections
+              if confidence is not None]
+    if not scored:
+        return {}
+
+    def best(value) -> Optional[float]:
+        if isinstance(value, float):
+            matches = [confidence for _, numbers, confidence in scored
+                       if any(abs(number - value) < 0.005 for number in numbers)]
+        else:
+            value = value.strip().upper()
+            matches = [confidence for text, _, confidence in scored if value in text.upper()]
+        return max(matches) if matches else None
+
+    values = {}
+    for field, value in data.items():
+        if isinstance(value, (float, str)) and value:
+            values[field] = value
+    for key, value in (data.get('allowances') or {}).items():
+        values[f'allowances.{key}'] = value
+
+    confidences = {}
+    for field, value in values.items():
+        confidence = best(value)
+        if confidence is not None:
+            confidences[field] = round(float(confidence), 4)
+
+    overtime = [best(entry['amount']) for entry in data.get('overtime') or []]
+    if overtime and None not in overtime:
+        confidences['overtime'] = round(float(min(overtime)), 4)
+    return confidences
@@ -0,0 +1,253 @@
+#!/usr/bin/env python3
+"""
+Duplicate and near-duplicate payslip photos, found before OCR
+
+    python3 dedup.py images/ --distance 12
+
+The same photo is often sent twice, or retaken, and OCR is by far the
+most expensive step, so the photos of a batch are grouped before OCR and
+only one photo of each group is OCR'd; the others are skipped.
+
+Files with the same SHA-256 are always grouped. Photos that merely look
+alike are grouped only with max_distance > 0 (off by default). The
+perceptual hash is a difference hash (dHash): each photo is decoded at a
+reduced size, shrunk to a HASH_SIZE x HASH_SIZE grid, and every bit
+records whether a cell is brighter than its right and its lower
+neighbour. A resized or recompressed copy or a burst shot keeps nearly
+all of the bits, but so does another employee's payslip scanned in the
+same framing: all payslips share one layout, and two employees can be a
+few bits apart. So the distance must be set from a look at the batch
+(dedup.py prints the groups and distances without OCR), and groups are
+complete: a photo joins a group only if it is within max_distance of
+every photo already in it, so A near B and B near C does not put A and C
+together. The photo of a group with the best quality (sharpness, with
+photos below QUALITY_SIDE pixels on the long side marked down in
+proportion) is the one OCR'd.
+"""
+
+import hashlib
+import io
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+from PIL import Image, ImageFilter, ImageOps, ImageStat
+
+from manifest import file_sha256
+from pages import is_reference, read_reference
+
+
+# Grid side of the difference hash; the hash has 2 * HASH_SIZE ** 2 bits
+HASH_SIZE = 16
+
+# Largest number of differing hash bits of the near-duplicates grouped (0: exact copies only)
+DEFAULT_DISTANCE = 0
+
+# Long side (pixels) at which sharpness is measured; smaller photos score lower
+QUALITY_SIDE = 1024
+
+
+def perceptual_hash(img: Image.Image, size: int = HASH_SIZE) -> int:
+    """
+    Difference hash of an image, rows then columns
+
+    Args:
+        img: Image (any mode)
+        size: Grid side; the hash has 2 * size ** 2 bits
+
+    Returns:
+        The hash as an integer
+    """
+    gray = img.convert('L').resize((size + 1, size + 1), Image.BILINEAR)
+    pixels = gray.tobytes()
+    width = size + 1
+    bits = 0
+    for y in range(size):
+        for x in range(size):
+            cell = pixels[y * width + x]
+            bits = (bits << 2) | ((cell > pixels[y * width + x + 1]) << 1) | (cell > pixels[(y + 1) * width + x])
+    return bits
+
+
+def sharpness(img: Image.Image) -> float:
+    """Spread of the edge response: higher for sharper, better exposed text"""
+    return ImageStat.Stat(img.convert('L').filter(ImageFilter.FIND_EDGES)).stddev[0]
+
+
+def image_signature(image_path: str) -> Dict[str, any]:
+    """
+    Content hash, perceptual hash and quality of one image (or page or block reference)
+
+    JPEGs are decoded at a reduced size (a fraction of the full decode);
+    the EXIF orientation is applied so that a copy re-exported without
+    EXIF still matches its original.
+
+    Returns:
+        {'sha256', 'phash', 'quality', 'size'}
+    """
+    if is_reference(image_path):
+        content = read_reference(image_path)
+        sha256 = hashlib.sha256(content).hexdigest()
+        source = io.BytesIO(content)
+    else:
+        sha256 = file_sha256(image_path)
+        source = image_path
+    with Image.open(source) as img:
+        size = img.size
+        img.draft('RGB', (QUALITY_SIDE, QUALITY_SIDE))
+        img = ImageOps.exif_transpose(img.convert('RGB'))
+    img.thumbnail((QUALITY_SIDE, QUALITY_SIDE))
+    quality = sharpness(img) * min(1.0, max(size) / QUALITY_SIDE)
+    return {'sha256': sha256, 'phash': perceptual_hash(img), 'quality': round(quality, 3), 'size': size}
+
+
+def hamming(a: int, b: int) -> int:
+    """Number of differing bits of two hashes"""
+    return bin(a ^ b).count('1')
+
+
+def _similar_pairs(hashes: List[int], max_distance: int, bits: int) -> List[Tuple[int, int, int]]:
+    # Split every hash into max_distance + 1 bands: two hashes within
+    # max_distance bits agree completely on at least one band, so only
+    # hashes sharing a band are compared instead of every pair
+    bands = max_distance + 1
+    width = -(-bits // bands)
+    buckets = {}
+    for i, value in enumerate(hashes):
+        for band in range(bands):
+            key = (band, (value >> (band * width)) & ((1 << width) - 1))
+            buckets.setdefault(key, []).append(i)
+
+    pairs = {}
+    for members in buckets.values():
+        for position, i in enumerate(members):
+            for j in members[position + 1:]:
+                if (i, j) not in pairs:
+                    pairs[(i, j)] = hamming(hashes[i], hashes[j])
+    return [(i, j, distance) for (i, j), distance in pairs.items() if distance <= max_distance]
+
+
+def _complete_groups(members: List[int], distances: Dict[Tuple[int, int], int]) -> List[List[int]]:
+    """
+    Group photos (in order) whose every pair is within the distance
+
+    Each photo joins the earlier group it is closest to (by its largest
+    distance to a member), or starts its own.
+    """
+    groups = []
+    for i in members:
+        best, best_distance = None, None
+        for group in groups:
+            farthest = 0
+            for j in group:
+                distance = distances.get((j, i))
+                if distance is None:
+                    break
+                farthest = max(farthest, distance)
+            else:
+                if best is None or farthest < best_distance:
+                    best, best_distance = group, farthest
+        if best is None:
+            groups.append([i])
+        else:
+            best.append(i)
+    return groups
+
+
+def find_duplicates(image_files: List[str], max_distance: int = DEFAULT_DISTANCE, threads: int = 4
+                    ) -> Tuple[List[str], List[Dict[str, any]]]:
+    """
+    Group exact copies (and with max_distance > 0 near-duplicates) and choose the photo to OCR in each group
+
+    Images that cannot be read are kept, so that OCR reports their error.
+
+    Args:
+        image_files: Images of the batch
+        max_distance: Largest perceptual hash distance of the near-duplicates grouped (0: exact copies only)
+        threads: Images hashed in parallel (decoding releases the GIL)
+
+    Returns:
+        (images to OCR, in their original order; groups of more than one
+        photo, each {'keep': path, 'quality': quality of the kept photo,
+        'duplicates': [{'path', 'match' ('exact' or 'similar'), 'distance', 'quality'}]})
+    """
+    def signature(image_path):
+        try:
+            return image_signature(image_path)
+        except Exception as e:
+            print(f"Dedup: cannot read {image_path} ({e}), keeping it")
+            return None
+
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        signatures = list(pool.map(signature, image_files))
+
+    # First file of each content -> its later copies
+    copies = {}
+    first_copy = {}
+    for i, sig in enumerate(signatures):
+        if sig is None:
+            continue
+        first = first_copy.setdefault(sig['sha256'], i)
+        copies.setdefault(first, [])
+        if first != i:
+            copies[first].append(i)
+
+    unique = sorted(copies)
+    distances = {}
+    if max_distance > 0:
+        hashes = [signatures[i]['phash'] for i in unique]
+        for a, b, distance in _similar_pairs(hashes, max_distance, 2 * HASH_SIZE ** 2):
+            distances[tuple(sorted((unique[a], unique[b])))] = distance
+    groups = _complete_groups(unique, distances) if distances else [[i] for i in unique]
+
+    skipped = set()
+    report = []
+    for group in groups:
+        # Best quality first; the earlier photo on a tie
+        keep = max(group, key=lambda i: (signatures[i]['quality'], -i))
+        duplicates = []
+        for i in sorted(group):
+            # A photo and its copies are skipped in favour of the kept photo
+            same = [] if i == keep else [i]
+            for j in sorted(same + copies[i]):
+                duplicates.append({'path': image_files[j], 'match': 'exact' if i == keep else 'similar',
+                                   'distance': distances.get(tuple(sorted((i, keep))), 0),
+                                   'quality': signatures[j]['quality']})
+                skipped.add(j)
+        if duplicates:
+            report.append({'keep': image_files[keep], 'quality': signatures[keep]['quality'],
+                           'duplicates': duplicates})
+
+    keep_files = [path for i, path in enumerate(image_files) if i not in skipped]
+    return keep_files, report
+
+
+def print_report(groups: List[Dict[str, any]], image_count: Optional[int] = None):
+    """Print the groups of duplicates and the photo kept in each"""
+    skipped = sum(len(group['duplicates']) for group in groups)
+    total = f" of {image_count}" if image_count is not None else ""
+    print(f"\n=== Duplicates: {skipped}{total} images skipped in {len(groups)} groups ===")
+    for group in groups:
+        print(f"  keep {os.path.basename(group['keep'])} (quality {group['quality']})")
+        for duplicate in group['duplicates']:
+            if duplicate['match'] == 'exact':
+                reason = 'exact copy'
+            else:
+                reason = f"similar, distance {duplicate['distance']}, quality {duplicate['quality']}"
+            print(f"    skip {os.path.basename(duplicate['path'])}: {reason}")
+
+
+if __name__ == '__main__':
+    import argparse
+
+    from payslip_processor import find_images
+
+    parser = argparse.ArgumentParser(description='Find duplicate payslip photos without OCR')
+    parser.add_argument('image_dir', help='Directory of payslip images')
+    parser.add_argument('--distance', type=int, default=12,
+                        help='Largest perceptual hash distance of the near-duplicates grouped (default: 12)')
+    args = parser.parse_args()
+
+    image_files = find_images(args.image_dir)
+    _, groups = find_duplicates(image_files, args.distance)
+    print_report(groups, len(image_files))
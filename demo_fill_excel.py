@@ -8,13 +8,109 @@ import openpyxl
 from openpyxl.styles import Font, Alignment
 import copy
 
+from sheet_index import SheetIndex
+from template_schema import DEFAULT_COLUMNS, load_template_schema
 
-def find_next_empty_row(sheet, start_row=30):
-    """Find the next empty row in the worksheet"""
-    for row in range(start_row, sheet.max_row + 10):
-        if sheet[f'B{row}'].value is None or sheet[f'B{row}'].value == '':
-            return row
-    return start_row
+
+# employee_data keys of the allowances named in the first staff block
+ALLOWANCE_FIELDS = {
+    'child_care': 'CHILD_CARE',
+    'incentive': 'INCENTIVE',
+    'cond_incent': 'COND_INCENT',
+    'car_transp': 'CAR_TRANSP',
+    'travelling_allw': 'TRAVELLING_ALLW',
+}
+
+# Column for an allowance the section has no column of its own for
+ALLOWANCE_FALLBACKS = {
+    'LEADER_ALLW': 'TRAVELLING_ALLW',
+}
+
+
+def write_employee_row(sheet, target_row, employee_no, employee_data, columns=None):
+    """
+    Write one employee's payslip figures into a template row
+
+    Args:
+        sheet: Worksheet to write to
+        target_row: Row number to fill
+        employee_no: Running number for column A
+        employee_data: Dictionary containing employee payslip data
+        columns: Column layout of the row's section (TemplateSchema.columns_for);
+            the layout of the template's first staff block if None
+    """
+    if columns is None:
+        columns = DEFAULT_COLUMNS
+
+    ot_15_amount = employee_data.get('ot_15_amount', 0)
+    epf_employer = employee_data.get('epf_employer', 0)
+    epf_employee = employee_data.get('epf_employee', 0)
+    socso_employer = employee_data.get('socso_employer', 0)
+    socso_employee = employee_data.get('socso_employee', 0)
+    eis_employer = employee_data.get('eis_employer', 0)
+    eis_employee = employee_data.get('eis_employee', 0)
+
+    values = {
+        # Basic information
+        'no': employee_no,
+        'employee_code': employee_data.get('employee_code', ''),
+        'employee_name': employee_data.get('employee_name', ''),
+        'nric': employee_data.get('nric', ''),
+        'basic_pay': employee_data.get('basic_pay', 0),
+
+        # Overtime: only 1.5 times is on the payslips, the other OT columns are 0
+        'ot_10_hours': 0,
+        'ot_10_amount': 0,
+        'ot_15_hours': employee_data.get('ot_15_hours', 0),
+        'ot_15_amount': ot_15_amount,
+        'ot_20_hours': 0,
+        'ot_20_amount': 0,
+        'ot_30_hours': 0,
+        'ot_30_amount': 0,
+        'rest_day_hours': 0,
+        'rest_day_amount': 0,
+        'public_holiday_hours': 0,
+        'public_holiday_amount': 0,
+        'ot_total': ot_15_amount,
+
+        # Total Payable (Basic Pay + OT + Allowances)
+        'total_payable': employee_data.get('monthly_gross', 0),
+
+        # EPF, SOCSO, EIS
+        'epf_employer': epf_employer,
+        'epf_employee': epf_employee,
+        'epf_total': epf_employer + epf_employee,
+        'socso_employer': socso_employer,
+        'socso_employee': socso_employee,
+        'socso_total': socso_employer + socso_employee,
+        'eis_employer': eis_employer,
+        'eis_employee': eis_employee,
+        'eis_total': eis_employer + eis_employee,
+
+        # Deductions
+        'staff_loan': employee_data.get('staff_loan', 0),
+        'advance': employee_data.get('advance', 0),
+        'pcb': employee_data.get('pcb', 0),
+
+        # Nett Payable
+        'nett_pay': employee_data.get('nett_pay', 0),
+    }
+    for field, value in values.items():
+        if field in columns['fields']:
+            sheet[f"{columns['fields'][field]}{target_row}"] = value
+
+    # Allowances go to the column with the same label; sections differ in
+    # which allowance columns they have
+    allowance_columns = columns['allowances']
+    for column in allowance_columns.values():
+        sheet[f'{column}{target_row}'] = 0
+    allowances = {key: employee_data[field] for field, key in ALLOWANCE_FIELDS.items() if field in employee_data}
+    allowances.update(employee_data.get('allowances', {}))
+    for key, value in allowances.items():
+        if key not in allowance_columns:
+            key = ALLOWANCE_FALLBACKS.get(key)
+        if key in allowance_columns:
+            sheet[f'{allowance_columns[key]}{target_row}'] = value
 
 
 def add_employee_to_excel(template_path, output_path, employee_data):
@@ -29,100 +125,22 @@ def add_employee_to_excel(template_path, output_path, employee_data):
     print(f"Loading template: {template_path}")
     wb = openpyxl.load_workbook(template_path)
     sheet = wb.active
+    schema = load_template_schema(template_path, wb)
 
     print(f"Template sheet: {sheet.title}")
 
-    # Find the next empty row (after existing employees)
-    # Based on the template structure, we'll add to "Factory - Office & Admin" section
-    # which starts at row 30. Let's find the first empty row after that.
-
-    # For demo, let's add to row 31 (right after the section header at row 30)
-    target_row = 31
-
-    # Check if row 31 already has data, if so find next empty
-    if sheet[f'B{target_row}'].value:
-        target_row = find_next_empty_row(sheet, target_row)
+    # The employee's existing row (same code or NRIC), or a new row at the end of
+    # the section for its code prefix
+    index = SheetIndex(sheet, schema)
+    target_row, employee_no = index.upsert(employee_data.get('employee_code', ''),
+                                           employee_data.get('nric', ''))
 
     print(f"Adding employee data to row {target_row}")
 
-    # Get the last number used
-    last_no = 8  # Based on the template, last number is 8
-    for row in range(11, target_row):
-        cell_value = sheet[f'A{row}'].value
-        if cell_value and isinstance(cell_value, int):
-            last_no = max(last_no, cell_value)
-
-    employee_no = last_no + 1
-
-    # Fill basic information
-    sheet[f'A{target_row}'] = employee_no
-    sheet[f'B{target_row}'] = employee_data.get('employee_code', '')
-    sheet[f'C{target_row}'] = employee_data.get('employee_name', '')
-    sheet[f'D{target_row}'] = employee_data.get('nric', '')
-    sheet[f'E{target_row}'] = employee_data.get('basic_pay', 0)
-
-    # Overtime data
-    # 1.5 times overtime
-    ot_15_hours = employee_data.get('ot_15_hours', 0)
+    write_employee_row(sheet, target_row, employee_no, employee_data, index.columns_at(target_row))
     ot_15_amount = employee_data.get('ot_15_amount', 0)
-    sheet[f'H{target_row}'] = ot_15_hours
-    sheet[f'I{target_row}'] = ot_15_amount
-
-    # Initialize other OT columns to 0
-    sheet[f'F{target_row}'] = 0  # 1.0 Hrs
-    sheet[f'G{target_row}'] = 0  # 1.0 Amount
-    sheet[f'J{target_row}'] = 0  # 2.0 Hrs
-    sheet[f'K{target_row}'] = 0  # 2.0 Amount
-    sheet[f'L{target_row}'] = 0  # 3.0 Hrs
-    sheet[f'M{target_row}'] = 0  # 3.0 Amount
-    sheet[f'N{target_row}'] = 0  # Rest Day
-    sheet[f'O{target_row}'] = 0  # Rest Day Amount
-    sheet[f'P{target_row}'] = 0  # P. Holiday
-    sheet[f'Q{target_row}'] = 0  # P. Holiday Amount
-
-    # Total OT
-    sheet[f'R{target_row}'] = ot_15_amount
-
-    # Allowances
-    sheet[f'S{target_row}'] = employee_data.get('child_care', 0)
-    sheet[f'T{target_row}'] = employee_data.get('incentive', 0)
-    sheet[f'U{target_row}'] = employee_data.get('cond_incent', 0)
-    sheet[f'V{target_row}'] = employee_data.get('car_transp', 0)
-    sheet[f'W{target_row}'] = employee_data.get('travelling_allw', 0)
-
-    # Total Payable (Basic Pay + OT + Allowances)
     total_payable = employee_data.get('monthly_gross', 0)
-    sheet[f'X{target_row}'] = total_payable
-
-    # EPF
-    epf_employer = employee_data.get('epf_employer', 0)
-    epf_employee = employee_data.get('epf_employee', 0)
-    sheet[f'Y{target_row}'] = epf_employer
-    sheet[f'Z{target_row}'] = epf_employee
-    sheet[f'AA{target_row}'] = epf_employer + epf_employee
-
-    # SOCSO
-    socso_employer = employee_data.get('socso_employer', 0)
-    socso_employee = employee_data.get('socso_employee', 0)
-    sheet[f'AB{target_row}'] = socso_employer
-    sheet[f'AC{target_row}'] = socso_employee
-    sheet[f'AD{target_row}'] = socso_employer + socso_employee
-
-    # EIS
-    eis_employer = employee_data.get('eis_employer', 0)
-    eis_employee = employee_data.get('eis_employee', 0)
-    sheet[f'AE{target_row}'] = eis_employer
-    sheet[f'AF{target_row}'] = eis_employee
-    sheet[f'AG{target_row}'] = eis_employer + eis_employee
-
-    # Deductions
-    sheet[f'AH{target_row}'] = employee_data.get('staff_loan', 0)
-    sheet[f'AI{target_row}'] = employee_data.get('advance', 0)
-    sheet[f'AJ{target_row}'] = employee_data.get('pcb', 0)
-
-    # Nett Payable
     nett_payable = employee_data.get('nett_pay', 0)
-    sheet[f'AK{target_row}'] = nett_payable
 
     print(f"\nEmployee data added successfully!")
     print(f"  Employee No: {employee_no}")
@@ -160,7 +178,7 @@ def main():
         'incentive': 0,
         'cond_incent': 0,
         'car_transp': 0,
-        'travelling_allw': 230.00,  # LEADER ALLW
+        'allowances': {'LEADER_ALLW': 230.00},
 
         # Totals
         'monthly_gross': 2273.17,
@@ -0,0 +1,344 @@
+#!/usr/bin/env python3
+"""
+Shared job queue for batches processed by several machines
+
+    python3 payslip_processor.py --batch /shared/october --queue /shared/october.sqlite --workers 4
+    python3 payslip_processor.py --queue /shared/october.sqlite --merge --consolidate october.xlsx
+    python3 jobqueue.py /shared/october.sqlite
+
+The queue is one SQLite file on storage every node can reach, with one
+row per image (or page, or block; see pages.py). Every node runs the same
+command: adding the images of a folder is idempotent, so nobody splits the
+folder up, and a node that joins late simply claims what is left. A
+worker claims one job at a time in a write transaction, so no two workers
+get the same job, and holds it under a lease that a background thread
+renews while the image is processed. A worker that crashes or loses its
+machine stops renewing; once the lease runs out the job is claimed again
+by someone else, and after MAX_ATTEMPTS expired leases it is marked
+failed instead of taking down worker after worker.
+
+The parsed payslip is written back to the job, so when the queue is
+drained the consolidated workbook is built from the queue alone (--merge),
+on any node.
+
+Job states: 'pending', 'running' (claimed, lease held), 'done' (parsed
+data stored) and 'failed' (error stored). Adding an image whose file has
+changed since it was added (size or modification time) puts it back to
+pending; failed jobs are only put back on request.
+
+The file is opened with SQLite's default rollback journal rather than WAL,
+which needs shared memory and does not work across machines. The share
+must support file locking (NFSv4, SMB); a local path works the same way
+for several processes on one machine. Leases use each machine's clock, so
+the nodes' clocks should be synchronised (NTP) to well within the lease.
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from pages import split_page_ref
+
+
+# Seconds a claimed job stays reserved without a renewal
+DEFAULT_LEASE = 300
+
+# Expired leases after which a job is failed rather than claimed again
+MAX_ATTEMPTS = 3
+
+STATUSES = ('pending', 'running', 'done', 'failed')
+
+
+def input_signature(image_path: str) -> str:
+    """Size and modification time of the file an input is read from (cheap to take on every node)"""
+    stat = os.stat(split_page_ref(image_path)[0])
+    return f"{stat.st_size}:{stat.st_mtime_ns}"
+
+
+class JobQueue:
+    """Images of a batch, claimed and completed by any number of workers"""
+
+    def __init__(self, path: str, timeout: float = 60):
+        """
+        Open (or create) the queue
+
+        Args:
+            path: SQLite file of the queue
+            timeout: Seconds to wait for another worker's write transaction
+        """
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.path = path
+        # Autocommit; every write takes the lock with an explicit BEGIN IMMEDIATE
+        self.conn = sqlite3.connect(path, timeout=timeout, isolation_level=None)
+        self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS jobs (
+                image TEXT PRIMARY KEY,
+                signature TEXT NOT NULL,
+                status TEXT NOT NULL,
+                worker TEXT,
+                lease_until REAL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                seconds REAL,
+                data TEXT,
+                error TEXT,
+                updated REAL NOT NULL
+            )
+        ''')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status, lease_until)')
+
+    def _write(self, action):
+        """Run action(conn) in one write transaction"""
+        self.conn.execute('BEGIN IMMEDIATE')
+        try:
+            result = action(self.conn)
+        except BaseException:
+            self.conn.execute('ROLLBACK')
+            raise
+        self.conn.execute('COMMIT')
+        return result
+
+    def add(self, image_files: Iterable[str], retry_failed: bool = False) -> Dict[str, int]:
+        """
+        Add the inputs of a batch; inputs already queued are left as they are
+
+        An input whose file changed since it was queued goes back to
+        pending unless a worker holds it. The given inputs of a file replace
+        the ones queued for it before, so a rescanned file that now has
+        fewer pages (or a sheet split differently) leaves no stale jobs.
+
+        Args:
+            image_files: Images, page or block references
+            retry_failed: Also put every failed job back to pending
+
+        Returns:
+            {'added', 'changed', 'removed', 'retried', 'queued'}: counts of new,
+            changed, replaced and retried inputs, and of all inputs given
+        """
+        rows = [(os.path.abspath(path), input_signature(path)) for path in image_files]
+        now = time.time()
+
+        def add(conn):
+            known = {image: (signature, status)
+                     for image, signature, status in conn.execute('SELECT image, signature, status FROM jobs')}
+            counts = {'added': 0, 'changed': 0, 'removed': 0, 'retried': 0, 'queued': len(rows)}
+            given = {image for image, _ in rows}
+            sources = {split_page_ref(image)[0] for image in given}
+            for image in known:
+                if image not in given and split_page_ref(image)[0] in sources:
+                    counts['removed'] += 1
+                    conn.execute('DELETE FROM jobs WHERE image = ?', (image,))
+            for image, signature in rows:
+                if image not in known:
+                    counts['added'] += 1
+                    conn.execute('INSERT INTO jobs (image, signature, status, updated) VALUES (?, ?, ?, ?)',
+                                 (image, signature, 'pending', now))
+                    continue
+                old_signature, status = known[image]
+                if status == 'running':
+                    continue
+                if old_signature != signature:
+                    counts['changed'] += 1
+                    conn.execute('''UPDATE jobs SET signature = ?, status = 'pending', worker = NULL,
+                                    lease_until = NULL, attempts = 0, data = NULL, error = NULL, updated = ?
+                                    WHERE image = ?''', (signature, now, image))
+            if retry_failed:
+                counts['retried'] = conn.execute('''UPDATE jobs SET status = 'pending', worker = NULL,
+                                                  attempts = 0, error = NULL, updated = ?
+                                                  WHERE status = 'failed' ''', (now,)).rowcount
+            return counts
+
+        return self._write(add)
+
+    def sources(self) -> Dict[str, str]:
+        """Signature of every file with queued inputs, by absolute path"""
+        return {split_page_ref(image)[0]: signature
+                for image, signature in self.conn.execute('SELECT image, signature FROM jobs')}
+
+    def claim(self, worker: str, lease_seconds: float = DEFAULT_LEASE) -> Optional[str]:
+        """
+        Reserve the next job for a worker
+
+        Pending jobs and running jobs whose lease has expired are claimed
+        in the order they were added. A job whose lease already expired
+        MAX_ATTEMPTS times is failed instead.
+
+        Returns:
+            The image to process, or None when no job is available now
+        """
+        def claim(conn):
+            now = time.time()
+            while True:
+                row = conn.execute('''SELECT image, status, attempts, worker FROM jobs
+                                      WHERE status = 'pending' OR (status = 'running' AND lease_until < ?)
+                                      ORDER BY rowid LIMIT 1''', (now,)).fetchone()
+                if row is None:
+                    return None
+                image, status, attempts, previous = row
+                if status == 'running' and attempts >= MAX_ATTEMPTS:
+                    conn.execute('''UPDATE jobs SET status = 'failed', lease_until = NULL, updated = ?,
+                                    error = ? WHERE image = ?''',
+                                 (now, f"lease expired {attempts} times (last worker: {previous})", image))
+                    continue
+                conn.execute('''UPDATE jobs SET status = 'running', worker = ?, lease_until = ?,
+                                attempts = attempts + 1, updated = ? WHERE image = ?''',
+                             (worker, now + lease_seconds, now, image))
+                return image
+
+        return self._write(claim)
+
+    def renew(self, worker: str, images: List[str], lease_seconds: float = DEFAULT_LEASE) -> List[str]:
+        """
+        Extend the leases a worker holds
+
+        Returns:
+            The images the worker still holds (a job whose lease expired and
+            was claimed by another worker is lost)
+        """
+        def renew(conn):
+            held = []
+            for image in images:
+                cursor = conn.execute('''UPDATE jobs SET lease_until = ? WHERE image = ? AND worker = ?
+                                         AND status = 'running' ''', (time.time() + lease_seconds, image, worker))
+                if cursor.rowcount:
+                    held.append(image)
+            return held
+
+        return self._write(renew)
+
+    def _finish(self, image: str, worker: str, status: str, seconds: float,
+                data: Optional[Dict[str, any]] = None, error: Optional[str] = None) -> bool:
+        cursor = self._write(lambda conn: conn.execute(
+            '''UPDATE jobs SET status = ?, lease_until = NULL, seconds = ?, data = ?, error = ?, updated = ?
+               WHERE image = ? AND worker = ? AND status = 'running' ''',
+            (status, round(seconds, 4), json.dumps(data) if data is not None else None, error,
+             time.time(), image, worker)))
+        return cursor.rowcount == 1
+
+    def complete(self, image: str, worker: str, data: Dict[str, any], seconds: float) -> bool:
+        """
+        Store the parsed payslip of a job the worker holds
+
+        Returns:
+            False if the worker no longer held the job (its result is dropped)
+        """
+        return self._finish(image, worker, 'done', seconds, data=data)
+
+    def fail(self, image: str, worker: str, error: str, seconds: float) -> bool:
+        """Record the error of a job the worker holds; False if it no longer held it"""
+        return self._finish(image, worker, 'failed', seconds, error=error)
+
+    def release(self, image: str, worker: str) -> bool:
+        """Put a job the worker holds back to pending without counting an attempt (the worker is stopping)"""
+        cursor = self._write(lambda conn: conn.execute(
+            '''UPDATE jobs SET status = 'pending', worker = NULL, lease_until = NULL,
+               attempts = attempts - 1, updated = ? WHERE image = ? AND worker = ? AND status = 'running' ''',
+            (time.time(), image, worker)))
+        return cursor.rowcount == 1
+
+    def counts(self) -> Dict[str, int]:
+        """Number of jobs in each state"""
+        counts = dict.fromkeys(STATUSES, 0)
+        counts.update(self.conn.execute('SELECT status, COUNT(*) FROM jobs GROUP BY status').fetchall())
+        return counts
+
+    def unfinished(self) -> int:
+        """Number of jobs pending or held by a worker"""
+        return self.conn.execute(
+            "SELECT COUNT(*) FROM jobs WHERE status IN ('pending', 'running')").fetchone()[0]
+
+    def results(self) -> List[Tuple[str, Dict[str, any]]]:
+        """(image, parsed payslip) of every finished job, in the order the jobs were added"""
+        rows = self.conn.execute("SELECT image, data FROM jobs WHERE status = 'done' ORDER BY rowid")
+        return [(image, json.loads(data)) for image, data in rows]
+
+    def failures(self) -> List[Tuple[str, str]]:
+        """(image, error) of every failed job"""
+        return self.conn.execute("SELECT image, error FROM jobs WHERE status = 'failed' ORDER BY rowid").fetchall()
+
+    def workers(self) -> List[Tuple[str, int, float]]:
+        """(worker, jobs done, seconds spent) of every worker that finished a job"""
+        return self.conn.execute('''SELECT worker, COUNT(*), ROUND(SUM(seconds), 1) FROM jobs
+                                    WHERE status = 'done' GROUP BY worker ORDER BY worker''').fetchall()
+
+    def close(self):
+        """Close the queue database"""
+        self.conn.close()
+
+
+class LeaseRenewer:
+    """Renew the leases of the jobs a worker holds, in a background thread"""
+
+    def __init__(self, path: str, worker: str, lease_seconds: float = DEFAULT_LEASE):
+        """
+        Args:
+            path: SQLite file of the queue (the thread opens its own connection)
+            worker: Worker holding the jobs
+            lease_seconds: Lease length; leases are renewed three times per lease
+        """
+        self.path = path
+        self.worker = worker
+        self.lease_seconds = lease_seconds
+        self.held = set()
+        self.lock = threading.Lock()
+        self.stop = threading.Event()
+        self.thread = threading.Thread(target=self._run, name='lease-renewer', daemon=True)
+        self.thread.start()
+
+    def hold(self, image: str):
+        with self.lock:
+            self.held.add(image)
+
+    def release(self, image: str):
+        with self.lock:
+            self.held.discard(image)
+
+    def _run(self):
+        jobs = JobQueue(self.path)
+        try:
+            while not self.stop.wait(self.lease_seconds / 3):
+                with self.lock:
+                    images = list(self.held)
+                if not images:
+                    continue
+                try:
+                    lost = set(images) - set(jobs.renew(self.worker, images, self.lease_seconds))
+                except sqlite3.Error as e:
+                    # Retried at the next renewal, well before the lease runs out
+                    print(f"Could not renew leases: {e}")
+                    continue
+                for image in lost:
+                    print(f"Lease of {os.path.basename(image)} was lost to another worker")
+                    self.release(image)
+        finally:
+            jobs.close()
+
+    def close(self):
+        self.stop.set()
+        self.thread.join()
+
+
+def print_status(jobs: JobQueue):
+    """Print the jobs in each state, the workers' share and the failures"""
+    counts = jobs.counts()
+    print(f"\n=== Queue {jobs.path}: {sum(counts.values())} jobs ===")
+    print('  ' + ', '.join(f"{status} {count}" for status, count in counts.items()))
+    for worker, done, seconds in jobs.workers():
+        print(f"  {worker}: {done} done in {seconds}s")
+    for image, error in jobs.failures():
+        last_line = (error or '').strip().splitlines()[-1:] or ['']
+        print(f"  failed {os.path.basename(image)}: {last_line[0]}")
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Show the state of a shared job queue')
+    parser.add_argument('queue', help='SQLite file of the queue')
+    args = parser.parse_args()
+
+    queue = JobQueue(args.queue)
+    print_status(queue)
+    queue.close()
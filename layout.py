@@ -0,0 +1,303 @@
+#!/usr/bin/env python3
+"""
+Layout profiles for region-of-interest OCR
+
+All payslips of a run share one printed layout. A layout profile records,
+as fractions of the image size, where each field's value sits on the page
+and which block (header, earnings, statutory, summary) it belongs to. It
+is calibrated once from the full-page OCR detections of a sample payslip.
+Later payslips then only need their small field boxes recognised, and each
+value comes from its own box, so numbers cannot leak into other fields.
+"""
+
+import json
+import re
+from typing import Dict, List, Optional
+
+
+# Fields located by a printed label
+#
+#   label:  keyword of the label detection (all words must appear)
+#   value:  'right' (first detection right of the label on the same row),
+#           'below' (nearest detection under the label),
+#           'self' (the label detection itself holds the value),
+#           'row' (everything right of the label on the same row)
+#   type:   'number', 'text' or 'overtime' (rate, hours, amount)
+#   pattern: for text fields, the part of the recognised text to keep
+LAYOUT_FIELDS = [
+    {'field': 'company_name', 'region': 'header', 'label': ('INDUSTRIES',), 'value': 'self', 'type': 'text'},
+    {'field': 'period', 'region': 'header', 'label': ('PAYROLL',), 'value': 'self', 'type': 'text'},
+    {'field': 'date', 'region': 'header', 'label': ('MONTHLY', 'BANK'), 'value': 'below', 'type': 'text',
+     'pattern': r'\d{2}/\d{2}/\d{4}'},
+    {'field': 'employee_no', 'region': 'header', 'label': ('LINE NO',), 'value': 'right', 'type': 'text',
+     'pattern': r'[A-Z]+\d+'},
+    {'field': 'employee_name', 'region': 'header', 'label': ('NAME',), 'value': 'right', 'type': 'text',
+     'pattern': r'[A-Z][A-Z .@]*[A-Z]'},
+    {'field': 'ic_no', 'region': 'header', 'label': ('C NO',), 'value': 'right', 'type': 'text',
+     'pattern': r'[A-Z]{1,2}\d+'},
+    {'field': 'basic_rate', 'region': 'earnings', 'label': ('BASIC RATE',), 'value': 'right', 'type': 'number'},
+    {'field': 'working_days', 'region': 'earnings', 'label': ('WORKING DAYS',), 'value': 'right', 'type': 'number'},
+    {'field': 'basic_pay', 'region': 'earnings', 'label': ('BASIC PAY',), 'value': 'right', 'type': 'number'},
+    {'field': 'allowances.LEADER_ALLW', 'region': 'earnings', 'label': ('LEADER ALLW',), 'value': 'right',
+     'type': 'number'},
+    {'field': 'overtime', 'region': 'earnings', 'label': ('1.5 TIMES',), 'value': 'row', 'type': 'overtime'},
+    {'field': 'monthly_gross', 'region': 'statutory', 'label': ('MONTHLY GROSS',), 'value': 'right',
+     'type': 'number'},
+    {'field': 'epf_employer', 'region': 'statutory', 'label': ('EPF', 'YER'), 'value': 'right', 'type': 'number'},
+    {'field': 'socso_employer', 'region': 'statutory', 'label': ('SOCSO', 'YER'), 'value': 'right',
+     'type': 'number'},
+    {'field': 'eis_employer', 'region': 'statutory', 'label': ('EIS', 'YER'), 'value': 'right', 'type': 'number'},
+    {'field': 'ytd_al', 'region': 'statutory', 'label': ('YTD AL',), 'value': 'right', 'type': 'number'},
+    {'field': 'ytd_mc', 'region': 'statutory', 'label': ('YTD MC',), 'value': 'right', 'type': 'number'},
+]
+
+# Summary table: column heading -> field of the value printed under it
+SUMMARY_COLUMNS = [
+    ('BASIC PAY', 'basic_pay'),
+    ('DIRECTOR FEE', None),
+    ('OVERTIME', 'overtime_total'),
+    ('ALLOWANCE', 'allowance_total'),
+    ('GROSS PAY', 'monthly_gross'),
+    ('DEDUCTION', 'deduction'),
+    ('EPF', 'epf_employee'),
+    ('SOCSO', 'socso_employee'),
+    ('EIS', 'eis_employee'),
+    ('NETT', 'nett_pay'),
+]
+
+_HAS_NUMBER = re.compile(r'\d+\.\d+|\d{2,}')
+
+
+class _Box:
+    """Axis-aligned box of one OCR detection"""
+
+    def __init__(self, bbox, text: str):
+        xs = [point[0] for point in bbox]
+        ys = [point[1] for point in bbox]
+        self.x0, self.x1 = min(xs), max(xs)
+        self.y0, self.y1 = min(ys), max(ys)
+        self.text = text.upper()
+
+    @property
+    def height(self) -> float:
+        return self.y1 - self.y0
+
+    @property
+    def yc(self) -> float:
+        return (self.y0 + self.y1) / 2
+
+    def same_row(self, other: '_Box') -> bool:
+        return abs(self.yc - other.yc) < 0.6 * max(self.height, other.height)
+
+
+class LayoutProfile:
+    """Where the fields of one payslip layout sit on the page"""
+
+    def __init__(self, fields: Dict[str, Dict[str, any]], regions: Dict[str, List[float]],
+                 source: str = ''):
+        """
+        Args:
+            fields: field -> {'box': [x0, y0, x1, y1] as fractions of the image, 'type', 'pattern'}
+            regions: block name -> [x0, y0, x1, y1] covering its fields
+            source: Image the profile was calibrated from
+        """
+        self.fields = fields
+        self.regions = regions
+        self.source = source
+
+    @classmethod
+    def load(cls, path: str) -> 'LayoutProfile':
+        """Load a profile saved with save()"""
+        with open(path, encoding='utf-8') as f:
+            profile = json.load(f)
+        return cls(profile['fields'], profile['regions'], profile.get('source', ''))
+
+    def save(self, path: str):
+        """Save the profile as JSON"""
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump({'source': self.source, 'regions': self.regions, 'fields': self.fields}, f, indent=2)
+        print(f"Layout profile saved to: {path}")
+
+    def settings(self) -> Dict[str, any]:
+        """Profile content that affects OCR output (part of the OCR cache key)"""
+        return {'fields': self.fields}
+
+    def pixel_boxes(self, width: int, height: int) -> Dict[str, List[int]]:
+        """Field boxes in pixels for an image of the given size, clipped to the image"""
+        boxes = {}
+        for field, spec in self.fields.items():
+            x0, y0, x1, y1 = spec['box']
+            boxes[field] = [
+                max(0, int(x0 * width)), max(0, int(y0 * height)),
+                min(width, int(round(x1 * width))), min(height, int(round(y1 * height))),
+            ]
+        return boxes
+
+
+def calibrate_layout(detections, width: int, height: int, source: str = '') -> LayoutProfile:
+    """
+    Build a layout profile from the full-page OCR detections of a sample payslip
+
+    Args:
+        detections: EasyOCR readtext output, [bbox, text, confidence] per detection
+        width: Sample image width in pixels
+        height: Sample image height in pixels
+        source: Sample image path, recorded in the profile
+
+    Returns:
+        The calibrated profile
+    """
+    boxes = [_Box(bbox, text) for bbox, text, _ in detections if bbox is not None]
+    if not boxes:
+        raise ValueError("Layout calibration needs OCR detections with bounding boxes (use EasyOCR)")
+
+    fields = {}
+    for spec in LAYOUT_FIELDS:
+        box = _locate_value(spec, boxes)
+        if box is not None:
+            fields[spec['field']] = {'box': box, 'type': spec['type'], 'region': spec['region']}
+            if 'pattern' in spec:
+                fields[spec['field']]['pattern'] = spec['pattern']
+
+    # Labels printed without a value on the sample (e.g. SOCSO' YER) borrow the
+    # value column of a calibrated field in the same block
+    for spec in LAYOUT_FIELDS:
+        if spec['field'] in fields or spec['value'] != 'right':
+            continue
+        label = _find_label(spec['label'], boxes)
+        column = _value_column(spec['region'], label, fields) if label else None
+        if column is not None:
+            fields[spec['field']] = {
+                'box': [column[0], label.y0 - 0.4 * label.height, column[1], label.y1 + 0.4 * label.height],
+                'type': spec['type'], 'region': spec['region'],
+            }
+
+    for field, box in _locate_summary(boxes).items():
+        fields[field] = {'box': box, 'type': 'number', 'region': 'summary'}
+
+    if not fields:
+        raise ValueError("No payslip labels found in the sample image")
+
+    # Store as fractions of the image size
+    for spec in fields.values():
+        x0, y0, x1, y1 = spec['box']
+        spec['box'] = [round(max(0.0, x0 / width), 4), round(max(0.0, y0 / height), 4),
+                       round(min(1.0, x1 / width), 4), round(min(1.0, y1 / height), 4)]
+
+    regions = {}
+    for spec in fields.values():
+        x0, y0, x1, y1 = spec['box']
+        region = regions.setdefault(spec['region'], [x0, y0, x1, y1])
+        region[0], region[1] = min(region[0], x0), min(region[1], y0)
+        region[2], region[3] = max(region[2], x1), max(region[3], y1)
+
+    missing = [spec['field'] for spec in LAYOUT_FIELDS if spec['field'] not in fields]
+    if missing:
+        print(f"Layout calibration: no position found for {', '.join(missing)}")
+    return LayoutProfile(fields, regions, source)
+
+
+def _find_label(keywords, boxes: List[_Box]) -> Optional[_Box]:
+    """First (top-most) detection containing all keywords"""
+    found = [box for box in boxes if all(keyword in box.text for keyword in keywords)]
+    return min(found, key=lambda box: box.y0) if found else None
+
+
+def _locate_value(spec: Dict[str, any], boxes: List[_Box]) -> Optional[List[float]]:
+    """Pixel box [x0, y0, x1, y1] of a field's value on the sample, or None"""
+    labels = sorted((box for box in boxes if all(keyword in box.text for keyword in spec['label'])),
+                    key=lambda box: box.y0)
+
+    for label in labels:
+        margin = 0.4 * label.height
+        if spec['value'] == 'self':
+            return [label.x0 - margin, label.y0 - margin, label.x1 + margin, label.y1 + margin]
+
+        if spec['value'] == 'below':
+            below = [box for box in boxes if box.y0 >= label.yc and box.y0 - label.y1 < 2 * label.height
+                     and box.x1 > label.x0 and box.x0 < label.x1]
+            if below:
+                value = min(below, key=lambda box: box.y0)
+                return [value.x0 - margin, value.y0 - margin, value.x1 + margin, value.y1 + margin]
+            continue
+
+        right = sorted((box for box in boxes if box is not label and box.same_row(label)
+                        and box.x0 >= label.x1 - margin), key=lambda box: box.x0)
+        # Skip separators such as ':' between label and value
+        right = [box for box in right if re.search(r'[A-Z0-9]', box.text)]
+        if spec['type'] == 'number':
+            right = [box for box in right if _HAS_NUMBER.search(box.text)]
+        if not right:
+            continue
+
+        if spec['value'] == 'row':
+            # Everything from the label up to the next label on the row (a
+            # neighbouring block printed alongside)
+            for index, box in enumerate(right):
+                if not _HAS_NUMBER.search(box.text):
+                    right = right[:index]
+                    break
+            if not right:
+                continue
+            last = right[-1]
+            return [label.x1, min(box.y0 for box in right) - margin, last.x1 + margin,
+                    max(box.y1 for box in right) + margin]
+
+        value = right[0]
+        width = value.x1 - value.x0
+        # Amounts are right-aligned and vary in length, so leave more room on the left
+        return [value.x0 - 0.5 * width, value.y0 - margin, value.x1 + 0.2 * width, value.y1 + margin]
+
+    return None
+
+
+def _value_column(region: str, label: _Box, fields: Dict[str, Dict[str, any]]):
+    """x-range of the calibrated value column nearest to label in the same block"""
+    candidates = [spec['box'] for spec in fields.values()
+                  if spec['region'] == region and spec['type'] == 'number' and spec['box'][0] >= label.x1 - label.height]
+    if not candidates:
+        return None
+    box = min(candidates, key=lambda box: abs((box[1] + box[3]) / 2 - label.yc))
+    return box[0], box[2]
+
+
+def _locate_summary(boxes: List[_Box]) -> Dict[str, List[float]]:
+    """Value boxes under each summary column heading, from the heading positions"""
+    anchor = _find_label(('DIRECTOR',), boxes)
+    if anchor is None:
+        return {}
+    header = sorted((box for box in boxes if box.same_row(anchor)), key=lambda box: box.x0)
+
+    # Headings can come back merged into one detection; estimate each
+    # heading's centre from its character position within the detection
+    centres = []
+    search_from = 0
+    texts = [(box, box.text) for box in header]
+    for heading, field in SUMMARY_COLUMNS:
+        for index, (box, text) in enumerate(texts):
+            if index < search_from:
+                continue
+            position = text.find(heading)
+            if position < 0:
+                continue
+            char_width = (box.x1 - box.x0) / max(len(text), 1)
+            centres.append((field, box.x0 + (position + len(heading) / 2) * char_width))
+            # Blank out the heading so that e.g. EPF is not found again inside it
+            texts[index] = (box, text[:position] + ' ' * len(heading) + text[position + len(heading):])
+            search_from = index
+            break
+
+    if len(centres) < 2:
+        return {}
+
+    row_height = anchor.height
+    y0 = max(box.y1 for box in header)
+    y1 = y0 + 2.5 * row_height
+    fields = {}
+    for index, (field, centre) in enumerate(centres):
+        left = (centres[index - 1][1] + centre) / 2 if index > 0 else centre - (centres[1][1] - centre) / 2
+        right = (centre + centres[index + 1][1]) / 2 if index + 1 < len(centres) else \
+            centre + (centre - centres[index - 1][1]) / 2
+        if field is not None:
+            fields[field] = [left, y0, right, y1]
+    return fields
@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+"""
+Processing manifest for resumable batches
+
+The manifest is a JSONL file beside the batch output with one line per
+processed image: its path, content hash, status, timing, output location
+and error. Lines are appended and flushed as each image finishes, so a
+crashed run leaves an accurate record. When a path appears more than
+once the last line wins.
+
+With --resume, images whose last entry is 'done' with the same content
+hash (and whose output file still exists) are skipped; failed, changed
+and new images are processed again. A page of a multi-page scan is
+recorded under its page reference (see pages.py), with a hash of the
+scan's content and the page number. Images skipped as duplicates of
+another image (--dedup, see dedup.py) are recorded as 'duplicate' with
+the image that was processed in their place.
+"""
+
+import hashlib
+import json
+import os
+import time
+from typing import Dict, List, Optional, Tuple
+
+from pages import is_reference, split_page_ref
+
+
+MANIFEST_NAME = 'manifest.jsonl'
+
+
+def file_sha256(path: str) -> str:
+    """SHA-256 of a file's content"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+# (path, size, mtime) -> SHA-256 of the files referenced by pages or blocks,
+# so that a 500-page scan is hashed once rather than once per page
+_source_hashes: Dict[Tuple[str, int, int], str] = {}
+
+
+def input_sha256(image_path: str) -> str:
+    """
+    Content hash of an input: the file's SHA-256, or for a page or block
+    reference (see pages.py) a hash of the file's SHA-256 and the reference
+    """
+    if not is_reference(image_path):
+        return file_sha256(image_path)
+    path = split_page_ref(image_path)[0]
+    stat = os.stat(path)
+    key = (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+    if key not in _source_hashes:
+        _source_hashes[key] = file_sha256(path)
+    return hashlib.sha256(f"{_source_hashes[key]}{image_path[len(path):]}".encode()).hexdigest()
+
+
+def manifest_path_for(output_dir: str, consolidated_path: Optional[str] = None) -> str:
+    """Manifest location for a batch: beside the consolidated workbook, or in the output directory"""
+    if consolidated_path:
+        return f"{consolidated_path}.manifest.jsonl"
+    return os.path.join(output_dir, MANIFEST_NAME)
+
+
+class Manifest:
+    """Append-only record of which images a batch has processed"""
+
+    def __init__(self, path: str, resume: bool = False):
+        """
+        Open the manifest
+
+        Args:
+            path: JSONL file to write
+            resume: Keep and load the existing entries; otherwise start a new manifest
+        """
+        self.path = path
+        self.entries = {}
+        # Whether recorded entries keep their parsed data in memory (it is always written to the file)
+        self.keep_data = True
+        if resume and os.path.exists(path):
+            self._load()
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.file = open(path, 'a' if resume else 'w', encoding='utf-8')
+
+    def _load(self):
+        """Read the existing entries, last entry per path wins"""
+        with open(self.path, encoding='utf-8') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # Half-written last line of a crashed run
+                    continue
+                self.entries[entry['path']] = entry
+
+    def is_done(self, image_path: str, sha256: str) -> bool:
+        """Whether image_path was processed successfully with this exact content"""
+        entry = self.entries.get(os.path.abspath(image_path))
+        if entry is None or entry['status'] != 'done' or entry['sha256'] != sha256:
+            return False
+        return entry['output'] is None or os.path.exists(entry['output'])
+
+    def pending(self, image_files: List[str]) -> Tuple[List[str], List[Dict[str, any]]]:
+        """
+        Split images into those still to process and those already done
+
+        Returns:
+            (images to process, manifest entries of the completed images; their
+            'data' holds the parsed payslip)
+        """
+        todo = []
+        done = []
+        for image_path in image_files:
+            entry = self.entries.get(os.path.abspath(image_path))
+            if entry is not None and self.is_done(image_path, input_sha256(image_path)):
+                done.append(entry)
+            else:
+                todo.append(image_path)
+        return todo, done
+
+    def record(self, image_path: str, status: str, seconds: float, output: Optional[str] = None,
+               data: Optional[Dict[str, any]] = None, error: Optional[str] = None,
+               duplicate_of: Optional[str] = None):
+        """
+        Append the outcome of one image
+
+        Args:
+            image_path: Processed image or page reference
+            status: 'done', 'failed' or 'duplicate'
+            seconds: Time spent on the image
+            output: Workbook written for the image (None in consolidated mode)
+            data: Parsed payslip data, kept so a resumed run can rebuild a consolidated workbook
+            error: Error traceback of a failed image
+            duplicate_of: Image processed in place of a duplicate
+        """
+        entry = {
+            'path': os.path.abspath(image_path),
+            'sha256': input_sha256(image_path) if os.path.exists(split_page_ref(image_path)[0]) else None,
+            'status': status,
+            'seconds': round(seconds, 3),
+            'finished_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'output': os.path.abspath(output) if output else None,
+            'error': error,
+            'data': data,
+        }
+        if duplicate_of:
+            entry['duplicate_of'] = os.path.abspath(duplicate_of)
+        self.file.write(json.dumps(entry) + '\n')
+        self.file.flush()
+        if not self.keep_data:
+            entry['data'] = None
+        self.entries[entry['path']] = entry
+
+    def forget_data(self):
+        """Stop holding parsed data in memory, for batches that stream their records elsewhere"""
+        self.keep_data = False
+        for entry in self.entries.values():
+            entry['data'] = None
+
+    def close(self):
+        """Close the manifest file"""
+        self.file.close()
@@ -0,0 +1,215 @@
+#!/usr/bin/env python3
+"""
+Per-stage timing, memory and profiling of payslip processing
+
+Code marks its stages with `with stage('ocr_detect'):`. While an image is
+being measured (measure_image), each stage's wall time is added to that
+image's record; outside of it stage() does nothing. Peak memory per stage
+comes from tracemalloc, which is only switched on when memory tracking is
+requested because it slows pure-Python code down. It sees Python and numpy
+allocations but not memory held inside torch.
+
+Stages used by the pipeline:
+
+    image_load     read and decode (and preprocess) the image
+    ocr_cache      OCR cache lookup
+    ocr_detect     EasyOCR text detection
+    ocr_recognize  EasyOCR recognition (or the whole Tesseract call)
+    ocr_reocr      re-reading weak numeric detections (--reocr-below)
+    parse          parse_payslip / parse_fields
+    template_load  openpyxl load of the template
+    cell_writes    writing the employee into the sheet
+    save           workbook save
+"""
+
+import cProfile
+import json
+import marshal
+import os
+import time
+import tracemalloc
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+# Record of the image currently being measured in this process
+_current: Optional[Dict[str, any]] = None
+
+
+def percentile(values: List[float], pct: float) -> float:
+    """Nearest-rank percentile of values"""
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100 * len(ordered))) - 1))
+    return ordered[index]
+
+
+def _max_rss_mb() -> Optional[float]:
+    """Peak resident memory of this process so far, in MB"""
+    if resource is None:
+        return None
+    # ru_maxrss is in kilobytes on Linux
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+
+@contextmanager
+def stage(name: str):
+    """Time the enclosed block as stage `name` of the image being measured"""
+    record = _current
+    if record is None:
+        yield
+        return
+
+    tracing = tracemalloc.is_tracing()
+    if tracing:
+        tracemalloc.reset_peak()
+        base = tracemalloc.get_traced_memory()[0]
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        stats = record['stages'].setdefault(name, {'seconds': 0.0, 'peak_mb': None})
+        stats['seconds'] += time.perf_counter() - start
+        if tracing:
+            peak_mb = (tracemalloc.get_traced_memory()[1] - base) / (1024 * 1024)
+            stats['peak_mb'] = round(max(stats['peak_mb'] or 0.0, peak_mb), 2)
+
+
+@contextmanager
+def measure_image(image_path: str, track_memory: bool = False, profile: bool = False):
+    """
+    Measure the processing of one image
+
+    Yields the image's record, which is complete when the block exits:
+    {'image', 'seconds', 'max_rss_mb', 'stages': {stage: {'seconds', 'peak_mb'}}}
+    and, with profile, a 'profile' entry holding the marshalled cProfile stats.
+    The caller adds an 'error' entry when the image failed.
+    """
+    global _current
+
+    if track_memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+
+    record = {'image': image_path, 'seconds': 0.0, 'max_rss_mb': None, 'stages': {}}
+    _current = record
+    profiler = cProfile.Profile() if profile else None
+    start = time.perf_counter()
+    if profiler is not None:
+        profiler.enable()
+    try:
+        yield record
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            profiler.create_stats()
+            record['profile'] = marshal.dumps(profiler.stats)
+        record['seconds'] = round(time.perf_counter() - start, 4)
+        record['max_rss_mb'] = _max_rss_mb()
+        for stats in record['stages'].values():
+            stats['seconds'] = round(stats['seconds'], 4)
+        _current = None
+
+
+class MetricsCollector:
+    """Collect image records of a run and write them with batch percentiles"""
+
+    def __init__(self, track_memory: bool = True, profile_top: int = 0):
+        """
+        Args:
+            track_memory: Record peak memory per stage (tracemalloc)
+            profile_top: Profile every image and keep the stats of this many slowest
+        """
+        self.track_memory = track_memory
+        self.records = []
+        # Batch-level steps such as the consolidated workbook write: name -> record
+        self.batch_steps = {}
+        self.profile_top = profile_top
+        # (seconds, image, marshalled stats) of the slowest profiled images
+        self.profiles = []
+
+    def measure(self, image_path: str):
+        """measure_image() with this collector's settings"""
+        return measure_image(image_path, self.track_memory, self.profile_top > 0)
+
+    def add(self, record: Dict[str, any]):
+        """Add one image record (as yielded by measure_image)"""
+        profile = record.pop('profile', None)
+        self.records.append(record)
+        if profile is not None and self.profile_top:
+            self.profiles.append((record['seconds'], record['image'], profile))
+            self.profiles.sort(key=lambda item: item[0], reverse=True)
+            del self.profiles[self.profile_top:]
+
+    def mark_failed(self, image_path: str, error: str):
+        """Mark the record of an image as failed after it was added (e.g. by a later batch step)"""
+        for record in self.records:
+            if record['image'] == image_path:
+                record['error'] = error
+
+    def summary(self) -> Dict[str, any]:
+        """p50/p95/max of the image times and of each stage"""
+        def spread(values):
+            return {'p50': round(percentile(values, 50), 4), 'p95': round(percentile(values, 95), 4),
+                    'max': round(max(values), 4)}
+
+        if not self.records:
+            return {'images': 0}
+
+        stages = {}
+        for record in self.records:
+            for name, stats in record['stages'].items():
+                stages.setdefault(name, {'seconds': [], 'peak_mb': []})
+                stages[name]['seconds'].append(stats['seconds'])
+                if stats['peak_mb'] is not None:
+                    stages[name]['peak_mb'].append(stats['peak_mb'])
+
+        summary = {
+            'images': len(self.records),
+            'failed': sum(1 for record in self.records if record.get('error')),
+            'seconds': spread([record['seconds'] for record in self.records]),
+            'stages': {},
+        }
+        rss = [record['max_rss_mb'] for record in self.records if record['max_rss_mb'] is not None]
+        if rss:
+            summary['max_rss_mb'] = max(rss)
+        for name, values in stages.items():
+            summary['stages'][name] = spread(values['seconds'])
+            if values['peak_mb']:
+                summary['stages'][name]['peak_mb_max'] = max(values['peak_mb'])
+        return summary
+
+    def write(self, path: str, extra: Optional[Dict[str, any]] = None):
+        """Write per-image records and the summary as JSON"""
+        report = {'summary': self.summary(), 'images': self.records}
+        if self.batch_steps:
+            report['batch_steps'] = self.batch_steps
+        if extra:
+            report.update(extra)
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+        print(f"Metrics written to: {path}")
+
+    def write_profiles(self, profile_dir: str) -> List[str]:
+        """Dump the kept cProfile stats, readable with pstats.Stats(path)"""
+        os.makedirs(profile_dir, exist_ok=True)
+        paths = []
+        for seconds, image, profile in self.profiles:
+            path = os.path.join(profile_dir, f"{os.path.splitext(os.path.basename(image))[0]}.prof")
+            with open(path, 'wb') as f:
+                f.write(profile)
+            paths.append(path)
+            print(f"Profile of {os.path.basename(image)} ({seconds:.2f}s) written to: {path}")
+        return paths
+
+    def print_report(self):
+        """Print the stage percentiles"""
+        summary = self.summary()
+        if not summary.get('stages'):
+            return
+        print("  Stages (p50 / p95 / max seconds):")
+        for name, stats in summary['stages'].items():
+            print(f"    {name:<14} {stats['p50']:.3f} / {stats['p95']:.3f} / {stats['max']:.3f}")
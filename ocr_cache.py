@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+"""
+On-disk cache of raw OCR results
+
+Entries are keyed by a hash of the image bytes plus the OCR engine and its
+settings, so re-running the parser after a rule or template change does not
+OCR the same payslip again. The cache is a single SQLite file with a size
+cap; the least recently used entries are evicted first.
+
+The total size is kept in its own row, updated in the same transaction as
+each entry, so checking the cap does not sum the whole table. Hits are
+written back (as the entry's last use) TOUCH_BATCH at a time and before
+anything is evicted; a process killed in between loses those touches,
+which only affects the eviction order.
+"""
+
+import atexit
+import hashlib
+import json
+import os
+import sqlite3
+import time
+from typing import Dict, List, Optional
+
+
+# Cache hits whose last use is written back in one transaction
+TOUCH_BATCH = 64
+
+
+def cache_key(image_bytes: bytes, settings: Dict[str, any]) -> str:
+    """
+    Build the cache key for an image
+
+    Args:
+        image_bytes: Raw bytes of the image file
+        settings: OCR engine name and every setting that changes its output
+    """
+    digest = hashlib.sha256(image_bytes)
+    digest.update(json.dumps(settings, sort_keys=True).encode('utf-8'))
+    return digest.hexdigest()
+
+
+def _to_json_detections(detections) -> List[list]:
+    """Convert OCR detections (which may hold numpy numbers) to plain JSON types"""
+    plain = []
+    for bbox, text, confidence in detections:
+        if bbox is not None:
+            bbox = [[float(x), float(y)] for x, y in bbox]
+        if confidence is not None:
+            confidence = float(confidence)
+        plain.append([bbox, text, confidence])
+    return plain
+
+
+class OCRCache:
+    """Persistent LRU cache of OCR detections (bbox, text, confidence)"""
+
+    def __init__(self, cache_dir: str = '.ocr_cache', max_size_mb: float = 1024):
+        """
+        Open (or create) the cache
+
+        Args:
+            cache_dir: Directory holding the cache database
+            max_size_mb: Size cap; least recently used entries are evicted above it
+        """
+        os.makedirs(cache_dir, exist_ok=True)
+        self.path = os.path.join(cache_dir, 'ocr_cache.sqlite')
+        self.max_size = int(max_size_mb * 1024 * 1024)
+        self.hits = 0
+        self.misses = 0
+        # key -> time of the hits not written back yet
+        self._touched: Dict[str, float] = {}
+
+        # Several worker processes may share one cache file
+        self.conn = sqlite3.connect(self.path, timeout=30)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS ocr_results (
+                key TEXT PRIMARY KEY,
+                detections TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                last_used REAL NOT NULL
+            )
+        ''')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS idx_last_used ON ocr_results (last_used)')
+        # Running total of ocr_results.size; summed once for a cache created without it
+        self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS cache_size (
+                id INTEGER PRIMARY KEY CHECK (id = 0),
+                total INTEGER NOT NULL
+            )
+        ''')
+        self.conn.execute('INSERT OR IGNORE INTO cache_size (id, total) '
+                          'SELECT 0, COALESCE(SUM(size), 0) FROM ocr_results')
+        self.conn.commit()
+        atexit.register(self.flush)
+
+    def get(self, key: str) -> Optional[List[list]]:
+        """Return cached detections for key, or None on a miss"""
+        row = self.conn.execute('SELECT detections FROM ocr_results WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        self._touched[key] = time.time()
+        if len(self._touched) >= TOUCH_BATCH:
+            self.flush()
+        return json.loads(row[0])
+
+    def flush(self):
+        """Write back the last use of the pending hits"""
+        if not self._touched:
+            return
+        touched = [(used, key) for key, used in self._touched.items()]
+        self._touched = {}
+        with self.conn:
+            self.conn.executemany('UPDATE ocr_results SET last_used = ? WHERE key = ?', touched)
+
+    def put(self, key: str, detections) -> List[list]:
+        """
+        Store detections for key and evict old entries if over the size cap
+
+        Returns:
+            The detections as stored (plain JSON types)
+        """
+        detections = _to_json_detections(detections)
+        payload = json.dumps(detections)
+        with self.conn:
+            # Before the insert, so an entry it replaces is taken off the total
+            self.conn.execute('UPDATE cache_size SET total = total + ? - '
+                              'COALESCE((SELECT size FROM ocr_results WHERE key = ?), 0) WHERE id = 0',
+                              (len(payload), key))
+            self.conn.execute(
+                'INSERT OR REPLACE INTO ocr_results (key, detections, size, last_used) VALUES (?, ?, ?, ?)',
+                (key, payload, len(payload), time.time())
+            )
+            total = self.conn.execute('SELECT total FROM cache_size WHERE id = 0').fetchone()[0]
+        if total > self.max_size:
+            self._evict()
+        return detections
+
+    def _evict(self):
+        """Drop least recently used entries until the cache fits its size cap"""
+        # Recent hits must count before the oldest entries are picked
+        self.flush()
+        with self.conn:
+            total = self.conn.execute('SELECT total FROM cache_size WHERE id = 0').fetchone()[0]
+            evicted = []
+            freed = 0
+            for key, size in self.conn.execute('SELECT key, size FROM ocr_results ORDER BY last_used'):
+                if total - freed <= self.max_size:
+                    break
+                evicted.append((key,))
+                freed += size
+            self.conn.executemany('DELETE FROM ocr_results WHERE key = ?', evicted)
+            self.conn.execute('UPDATE cache_size SET total = total - ? WHERE id = 0', (freed,))
+
+    def close(self):
+        """Write back the pending hits and close the cache database"""
+        self.flush()
+        atexit.unregister(self.flush)
+        self.conn.close()
@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+"""
+Pages of multi-page scans (TIFF and PDF) as individual inputs
+
+A bulk scanner produces one multi-page TIFF or PDF per department. Each
+page is one payslip, so each page is addressed on its own with a page
+reference, `<file>#page=<n>` (1-based), which goes wherever an image path
+goes: OCR, the cache key, the manifest, the records' 'image' column and
+the output file name.
+
+Listing the pages of a scan only reads its page count. A page is decoded
+(a PDF page rendered at PDF_DPI) when it is read, and the reader keeps
+nothing, so a 500-page scan is never held in memory as a whole: at most
+the pages in flight are.
+
+A payslip block cut from a sheet holding several payslips (see
+sheets.py) is referenced the same way, with the block's number and pixel
+box appended: `<file>#block=<b>&box=<x0>,<y0>,<x1>,<y1>`, or after the
+page, `<file>#page=<n>&block=<b>&box=...`. The box is relative to the
+upright page or image (EXIF orientation applied).
+
+PDF pages are rendered with pypdfium2 (pip install pypdfium2).
+"""
+
+import io
+import os
+import re
+from typing import Iterable, Iterator, Optional, Tuple
+
+Box = Tuple[int, int, int, int]
+
+
+# Extensions of files that can hold several pages
+MULTIPAGE_EXTENSIONS = {'.pdf', '.tif', '.tiff'}
+
+# Resolution at which PDF pages are rendered for OCR
+PDF_DPI = 200
+
+_REF = re.compile(r'^(.*?)#(?:page=(\d+))?(?:&?block=(\d+)&box=(\d+),(\d+),(\d+),(\d+))?$')
+
+
+def page_ref(path: str, page: int) -> str:
+    """Reference to page `page` (1-based) of a multi-page file"""
+    return f"{path}#page={page}"
+
+
+def block_ref(image_path: str, block: int, box: Box) -> str:
+    """Reference to block `block` (1-based), at pixel box `box`, of an image or page"""
+    separator = '&' if is_reference(image_path) else '#'
+    return f"{image_path}{separator}block={block}&box={','.join(str(v) for v in box)}"
+
+
+def _match(image_path: str):
+    match = _REF.match(image_path)
+    if match is None or (match.group(2) is None and match.group(3) is None):
+        return None
+    return match
+
+
+def split_page_ref(image_path: str) -> Tuple[str, Optional[int]]:
+    """(file, page) of a reference; page is None for an image file or a block of one"""
+    match = _match(image_path)
+    if match is None:
+        return image_path, None
+    return match.group(1), int(match.group(2)) if match.group(2) else None
+
+
+def split_block_ref(image_path: str) -> Tuple[str, Optional[int], Optional[Box]]:
+    """(image or page reference, block, box) of a block reference; (image_path, None, None) otherwise"""
+    match = _match(image_path)
+    if match is None or match.group(3) is None:
+        return image_path, None, None
+    parent = match.group(1) if match.group(2) is None else page_ref(match.group(1), int(match.group(2)))
+    return parent, int(match.group(3)), tuple(int(v) for v in match.group(4, 5, 6, 7))
+
+
+def is_reference(image_path: str) -> bool:
+    """Whether image_path refers to a page or block rather than to a whole image file"""
+    return _match(image_path) is not None
+
+
+def _import_pdfium():
+    try:
+        import pypdfium2
+    except ImportError:
+        raise ImportError("PDF input needs pypdfium2. Install it with: pip install pypdfium2")
+    return pypdfium2
+
+
+def page_count(path: str) -> int:
+    """Number of pages of a TIFF or PDF, read without decoding them"""
+    if path.lower().endswith('.pdf'):
+        pdf = _import_pdfium().PdfDocument(path)
+        try:
+            return len(pdf)
+        finally:
+            pdf.close()
+    from PIL import Image
+
+    with Image.open(path) as img:
+        return getattr(img, 'n_frames', 1)
+
+
+def expand_pages(paths: Iterable[str]) -> Iterator[str]:
+    """
+    Yield every input of a list of files: plain images as they are, and a
+    page reference for each page of a multi-page TIFF or PDF
+
+    A TIFF with a single page stays a plain image. A file whose pages
+    cannot be counted is yielded as it is, so that processing reports the
+    error.
+    """
+    for path in paths:
+        if os.path.splitext(path)[1].lower() not in MULTIPAGE_EXTENSIONS:
+            yield path
+            continue
+        try:
+            count = page_count(path)
+        except ImportError:
+            raise
+        except Exception as e:
+            print(f"Cannot count the pages of {path}: {e}")
+            yield path
+            continue
+        if count == 1 and not path.lower().endswith('.pdf'):
+            yield path
+        else:
+            for page in range(1, count + 1):
+                yield page_ref(path, page)
+
+
+def load_page(image_path: str):
+    """
+    Decode one page of a multi-page file as a PIL image
+
+    Only the requested page is decoded: TIFF frames are seeked to, PDF
+    pages rendered on their own.
+    """
+    from PIL import Image
+
+    path, page = split_page_ref(image_path)
+    if path.lower().endswith('.pdf'):
+        pdf = _import_pdfium().PdfDocument(path)
+        try:
+            return pdf[page - 1].render(scale=PDF_DPI / 72).to_pil()
+        finally:
+            pdf.close()
+    with Image.open(path) as scan:
+        scan.seek(page - 1)
+        return scan.copy()
+
+
+def load_upright(image_path: str):
+    """An image file or page as a PIL image, with the EXIF orientation applied (block boxes refer to this)"""
+    from PIL import Image, ImageOps
+
+    if split_page_ref(image_path)[1] is not None:
+        return load_page(image_path)
+    with Image.open(image_path) as img:
+        return ImageOps.exif_transpose(img)
+
+
+def read_reference(image_path: str) -> bytes:
+    """Decode the page or block a reference points to, as PNG file content"""
+    parent, block, box = split_block_ref(image_path)
+    img = load_upright(parent) if block is not None else load_page(image_path)
+    if box is not None:
+        img = img.crop(box)
+    content = io.BytesIO()
+    # Lossless, and fast enough that encoding costs little next to OCR
+    img.save(content, 'PNG', compress_level=1)
+    return content.getvalue()
+
+
+def read_input(image_path: str) -> bytes:
+    """File content of an image, or the decoded page or block of a reference"""
+    if is_reference(image_path):
+        return read_reference(image_path)
+    with open(image_path, 'rb') as f:
+        return f.read()
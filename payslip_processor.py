@@ -4,30 +4,331 @@ Payslip Batch Processor
 Extracts data from payslip images and fills Excel template
 """
 
+import io
 import re
 import os
-from typing import Dict, Optional
-from PIL import Image
-import openpyxl
+import time
+from typing import TYPE_CHECKING, Dict, Iterable, List, Optional, Tuple
 from pathlib import Path
 
+from confidence import NUMERIC_CHARS, box_bounds, field_confidences, numeric_text
+from layout import LayoutProfile, calibrate_layout
+from manifest import Manifest, input_sha256, manifest_path_for
+from metrics import MetricsCollector, measure_image, stage
+from pages import MULTIPAGE_EXTENSIONS, expand_pages, is_reference, read_input, read_reference, split_block_ref, split_page_ref
+from ocr_cache import OCRCache, cache_key
+from sheet_index import SheetIndex
+from sinks import RecordSink, open_sink, read_records
+from validation import validate_payslip
+from watch import FolderWatcher
+
+# PIL, the preprocessor and the asyncio pipeline are imported where they are
+# used, so a call handed to the service (see service.py) does not load them
+if TYPE_CHECKING:
+    from PIL import Image
+    from preprocess import Preprocessor
+
+
+# Declarative field rules for PayslipExtractor.parse_payslip
+#
+#   field:   key in the parsed data ('allowances.X' fills data['allowances']['X'])
+#   when:    alternative keyword sets; the rule applies to a line containing
+#            every keyword of at least one set
+#   unless:  keywords that must not appear in the line
+#   guard:   regex that must also be found in the line
+#   extract: 'number' (first number), 'match' (text matched by pattern),
+#            'line' (whole line), 'name' (name pattern within +-2 lines),
+#            'overtime' (rate, hours and amount)
+#   first:   keep the first value found instead of the last
+#
+# Rules are applied in table order for each line.
+PAYSLIP_RULES = [
+    {'field': 'company_name', 'when': [('INDUSTRIES',), ('SDN BHD',)], 'extract': 'line', 'first': True},
+    {'field': 'employee_no', 'when': [('EMPLOYEE', 'LINE NO')], 'extract': 'match', 'pattern': r'Y\d+'},
+    {'field': 'employee_name', 'when': [('NAME',)], 'extract': 'name',
+     'pattern': r'KYAW\s+\w+\s+\w+|(?<![A-Z])[A-Z]{2,}\s+[A-Z]{2,}\s+[A-Z]{2,}'},
+    {'field': 'ic_no', 'when': [('I/C NO',), ('IC NO',)], 'extract': 'match', 'pattern': r'MD\d+|[A-Z]{2}\d+'},
+    {'field': 'period', 'when': [('PAYROLL',)], 'guard': r'SEPTEMBER|\w\s+\d{4}', 'extract': 'line'},
+    {'field': 'date', 'when': [('MONTHLY', 'BANK')], 'extract': 'match', 'pattern': r'\d{2}/\d{2}/\d{4}'},
+    {'field': 'basic_rate', 'when': [('BASIC RATE',)], 'extract': 'number'},
+    {'field': 'working_days', 'when': [('WORKING DAYS',)], 'extract': 'number'},
+    {'field': 'basic_pay', 'when': [('BASIC PAY',)], 'unless': ('DIRECTOR',), 'extract': 'number'},
+    {'field': 'allowances.LEADER_ALLW', 'when': [('LEADER ALLW',), ('ALLOWANCE', 'LEADER')], 'extract': 'number'},
+    {'field': 'monthly_gross', 'when': [('MONTHLY GROSS',)], 'extract': 'number'},
+    {'field': 'epf_employer', 'when': [('EPF', 'YER')], 'extract': 'number'},
+    {'field': 'socso_employer', 'when': [('SOCSO', 'YER')], 'extract': 'number'},
+    {'field': 'eis_employer', 'when': [('EIS', 'YER')], 'extract': 'number'},
+    {'field': 'ytd_al', 'when': [('YTD AL',)], 'extract': 'number'},
+    {'field': 'ytd_mc', 'when': [('YTD MC',)], 'extract': 'number'},
+    {'field': 'overtime', 'when': [('1.5 TIMES',), ('OVERTIME',)], 'extract': 'overtime'},
+]
+
+_NUMBER = re.compile(r'\d+\.?\d*')
+# Pay multiplier in front of an overtime line ("1.5 TIMES 13.5577 31.00 HRS 420.29")
+_OT_MULTIPLIER = re.compile(r'\d+\.?\d*\s*TIMES', re.IGNORECASE)
+
+
+def _overtime_entry(line: str) -> Optional[Dict[str, any]]:
+    """Rate, hours and amount of an overtime line, or None if it has fewer than three numbers"""
+    # Most overtime lines (the header, the summary) have no multiplier; the
+    # regex is only run on a line that can hold one
+    multiplier = _OT_MULTIPLIER.search(line) if 'TIMES' in line.upper() else None
+    numbers = _NUMBER.findall(line[multiplier.end():] if multiplier else line)
+    if len(numbers) < 3:
+        return None
+    return {
+        'type': '1.5 TIMES',
+        'rate': float(numbers[0]),
+        'hours': float(numbers[1]),
+        'amount': float(numbers[2])
+    }
+
+
+def _make_applier(rule):
+    """
+    Build the function that extracts one rule's value from a line into data
+
+    The returned function takes (data, lines, i, name_matches), where i is
+    the index of the line that matched the rule's keywords.
+    """
+    field = rule['field']
+    extract = rule['extract']
+    guard = re.compile(rule['guard']).search if 'guard' in rule else None
+    pattern = re.compile(rule['pattern']).search if 'pattern' in rule else None
+    first = rule.get('first', False)
+    group, _, key = field.rpartition('.')
+
+    plain = not group and not first
+
+    def store(data, value):
+        if group:
+            data[group][key] = value
+        elif not (first and data[field]):
+            data[field] = value
+
+    # The common case (a plain field, last value wins) writes data[field]
+    # directly: these run for almost every line of a payslip
+    if extract == 'number' and plain:
+        def extract_value(lines, i, data, name_matches):
+            match = _NUMBER.search(lines[i])
+            if match:
+                data[field] = float(match.group())
+    elif extract == 'number':
+        def extract_value(lines, i, data, name_matches):
+            match = _NUMBER.search(lines[i])
+            if match:
+                store(data, float(match.group()))
+    elif extract == 'match' and plain:
+        def extract_value(lines, i, data, name_matches):
+            match = pattern(lines[i])
+            if match:
+                data[field] = match.group()
+    elif extract == 'match':
+        def extract_value(lines, i, data, name_matches):
+            match = pattern(lines[i])
+            if match:
+                store(data, match.group())
+    elif extract == 'line' and plain:
+        def extract_value(lines, i, data, name_matches):
+            data[field] = lines[i].strip()
+    elif extract == 'line':
+        def extract_value(lines, i, data, name_matches):
+            store(data, lines[i].strip())
+    elif extract == 'name':
+        def extract_value(lines, i, data, name_matches):
+            # Look in nearby lines for the name; each line is searched at most once
+            for j in range(max(0, i - 2), min(len(lines), i + 3)):
+                if j not in name_matches:
+                    name_matches[j] = pattern(lines[j])
+                if name_matches[j]:
+                    store(data, name_matches[j].group().strip())
+    elif extract == 'overtime':
+        def extract_value(lines, i, data, name_matches):
+            entry = _overtime_entry(lines[i])
+            if entry:
+                data[field].append(entry)
+    else:
+        raise ValueError(f"Unknown extract type: {extract}")
+
+    if guard is None:
+        return extract_value
+
+    def guarded(lines, i, data, name_matches):
+        if guard(lines[i]):
+            extract_value(lines, i, data, name_matches)
+    return guarded
+
+
+def _compile_rules(rules):
+    """
+    Compile the rule table
+
+    Returns:
+        (compiled rules, keyword -> rule indexes)
+    """
+    compiled = []
+    rules_by_keyword = {}
+    for index, rule in enumerate(rules):
+        compiled.append({
+            'when': [frozenset(required) for required in rule['when']],
+            'unless': frozenset(rule.get('unless', ())),
+            'apply': _make_applier(rule),
+        })
+        for required in rule['when']:
+            for keyword in required:
+                rules_by_keyword.setdefault(keyword, set()).add(index)
+
+    for rule in rules:
+        for keyword in rule.get('unless', ()):
+            rules_by_keyword.setdefault(keyword, set())
+
+    return compiled, rules_by_keyword
+
+
+_COMPILED_RULES, _RULES_BY_KEYWORD = _compile_rules(PAYSLIP_RULES)
+
+# Every keyword a rule checks for
+_KEYWORDS = sorted(_RULES_BY_KEYWORD)
+
+
+# Keyword sequence found on a line -> extract functions to run for it.
+# Keyword conditions depend only on which keywords a line contains, and
+# payslip lines repeat the same few combinations, so each is resolved once.
+_RULE_DISPATCH = {}
+
+
+def _rules_for_keywords(found: tuple) -> tuple:
+    """
+    Extract functions of the rules whose keyword conditions hold for a line
+    containing the keywords `found`, in table order
+    """
+    appliers = _RULE_DISPATCH.get(found)
+    if appliers is not None:
+        return appliers
+
+    keywords = set(found)
+    # Only rules with at least one of their keywords in the line are checked
+    candidates = set()
+    for keyword in keywords:
+        candidates.update(_RULES_BY_KEYWORD[keyword])
+
+    matched = []
+    for rule_index in sorted(candidates):
+        rule = _COMPILED_RULES[rule_index]
+        if any(required <= keywords for required in rule['when']) and not rule['unless'] & keywords:
+            matched.append(rule['apply'])
+
+    if len(_RULE_DISPATCH) > 4096:
+        _RULE_DISPATCH.clear()
+    appliers = _RULE_DISPATCH[found] = tuple(matched)
+    return appliers
+
+
+def _empty_payslip_data() -> Dict[str, any]:
+    """Parsed payslip record with every field at its default"""
+    return {
+        'company_name': '',
+        'employee_no': '',
+        'employee_name': '',
+        'ic_no': '',
+        'period': '',
+        'date': '',
+        'basic_rate': 0.0,
+        'working_days': 0.0,
+        'basic_pay': 0.0,
+        'allowances': {},
+        'overtime': [],
+        # Summary line totals; summed from the overtime lines and allowances without one
+        'director_fee': 0.0,
+        'overtime_total': 0.0,
+        'allowance_total': 0.0,
+        'monthly_gross': 0.0,
+        'epf_employer': 0.0,
+        'socso_employer': 0.0,
+        'eis_employer': 0.0,
+        'ytd_al': 0.0,
+        'ytd_mc': 0.0,
+        'deduction': 0.0,
+        'epf_employee': 0.0,
+        'socso_employee': 0.0,
+        'eis_employee': 0.0,
+        'nett_pay': 0.0,
+        # field -> OCR confidence of the detection its value was read from (EasyOCR only)
+        'field_confidence': {},
+        # File the payslip was read from, its page in a multi-page scan (0 for a plain image)
+        # and its block on a sheet of several payslips (0 for a whole page)
+        'source_file': '',
+        'source_page': 0,
+        'source_block': 0,
+    }
+
+
+def _fill_detail_totals(data: Dict[str, any], read: Iterable[str] = ()):
+    """Sum the overtime and allowance totals from their lines, unless read from the summary"""
+    if 'overtime_total' not in read:
+        data['overtime_total'] = round(sum(entry['amount'] for entry in data['overtime']), 2)
+    if 'allowance_total' not in read:
+        data['allowance_total'] = round(sum(data['allowances'].values()), 2)
+
 
 class PayslipExtractor:
-    """Extract data from payslip images using OCR"""
+    """
+    Extract data from payslip images using OCR
 
-    def __init__(self, ocr_engine='easyocr'):
+    Loading the OCR models is expensive, so create one extractor and reuse it
+    for every image in a run instead of building a new one per payslip.
+    """
+
+    def __init__(self, ocr_engine='easyocr', cache: Optional[OCRCache] = None,
+                 layout: Optional[LayoutProfile] = None, preprocessor: Optional['Preprocessor'] = None,
+                 reocr_threshold: Optional[float] = None):
         """
         Initialize the extractor
 
         Args:
-            ocr_engine: 'easyocr' or 'tesseract'
+            ocr_engine: 'easyocr', 'tesseract' or 'cascade' (Tesseract first, EasyOCR
+                for payslips whose figures do not add up; see extract())
+            cache: OCR result cache consulted before running the engine (optional)
+            layout: Layout profile; if given only its field boxes are recognised
+            preprocessor: Image preprocessing run before OCR (optional)
+            reocr_threshold: Re-recognise numeric EasyOCR detections below this
+                confidence from an upscaled crop (see _reocr_weak); None disables it
         """
         self.ocr_engine = ocr_engine
+        self.cache = cache
+        self.layout = layout
+        self.preprocessor = preprocessor
+        self.languages = ['en']
+        self.engine_version = ''
+        # (kind, image path) -> detections OCR'd ahead of time by prefetch()
+        self._prefetched = {}
+        # image path -> file content already read by the caller (the pipeline's read stage),
+        # used instead of opening the file
+        self.contents: Dict[str, bytes] = {}
+        # (reference, PNG content) of the last page or block read (see pages.py),
+        # so the cache key and the OCR do not decode it twice
+        self._page = (None, None)
+        # Cascade mode: extractor re-running payslips that fail validation
+        self.fallback: Optional[PayslipExtractor] = None
+        # Cascade mode: payslips accepted from Tesseract / re-run with EasyOCR
+        self.cascade_counts = {'fast': 0, 'fallback': 0}
+        self.reocr_threshold = reocr_threshold
+        # Weak numeric detections re-recognised / read with a higher confidence
+        self.reocr_counts = {'weak': 0, 'improved': 0}
+        start = time.perf_counter()
+
+        if ocr_engine == 'cascade':
+            self.fallback = PayslipExtractor('easyocr', cache, layout, preprocessor, reocr_threshold)
+            if self.fallback.ocr_engine != 'easyocr':
+                print("Cascade OCR runs Tesseract only")
+                self.fallback = None
+            ocr_engine = self.ocr_engine = 'tesseract'
 
         if ocr_engine == 'easyocr':
             try:
                 import easyocr
-                self.reader = easyocr.Reader(['en'])
+                self.reader = easyocr.Reader(self.languages)
+                self.engine_version = getattr(easyocr, '__version__', '')
                 print("Using EasyOCR engine")
             except ImportError:
                 print("EasyOCR not available, falling back to Tesseract")
@@ -37,192 +338,680 @@ class PayslipExtractor:
             try:
                 import pytesseract
                 self.pytesseract = pytesseract
+                try:
+                    # The tesseract binary does the OCR; the wrapper's version says nothing about it
+                    self.engine_version = str(pytesseract.get_tesseract_version())
+                except Exception:
+                    # No tesseract binary: every OCR call fails and reports it
+                    self.engine_version = ''
                 print("Using Tesseract engine")
             except ImportError:
                 raise ImportError("Neither EasyOCR nor Tesseract is available. Please install one.")
 
+        # Model load time, reported once per run by batch_process
+        self.startup_time = time.perf_counter() - start
+        print(f"OCR engine ready in {self.startup_time:.2f}s")
+
+    def ocr_settings(self, layout: Optional[LayoutProfile] = None) -> Dict[str, any]:
+        """Engine and settings that affect OCR output (part of the cache key)"""
+        settings = {
+            'engine': self.ocr_engine,
+            'version': self.engine_version,
+            'languages': self.languages,
+        }
+        if self.preprocessor is not None:
+            settings['preprocess'] = self.preprocessor.settings()
+        if layout is not None:
+            settings['layout'] = layout.settings()
+        if self.reocr_threshold is not None and self.ocr_engine == 'easyocr':
+            settings['reocr_threshold'] = self.reocr_threshold
+        return settings
+
+    def _cached(self, image_path: str, settings: Dict[str, any], run_ocr) -> List[list]:
+        """Return run_ocr() for an image, going through the OCR cache when configured"""
+        prefetched = self._prefetched.pop(('fields' if 'layout' in settings else 'page', image_path), None)
+        if prefetched is not None:
+            return prefetched
+        if self.cache is None:
+            return run_ocr()
+
+        with stage('ocr_cache'):
+            content = self._read(image_path)
+            key = cache_key(content, settings)
+            cached = self.cache.get(key)
+        if cached is not None:
+            return cached
+        if self._in_memory(image_path):
+            detections = run_ocr()
+        else:
+            # OCR the content just hashed instead of opening the file again
+            self.contents[image_path] = content
+            try:
+                detections = run_ocr()
+            finally:
+                del self.contents[image_path]
+        with stage('ocr_cache'):
+            return self.cache.put(key, detections)
+
+    def _read(self, image_path: str) -> bytes:
+        """File content of an image, or the decoded page or block of a reference (see pages.py)"""
+        if image_path in self.contents:
+            return self.contents[image_path]
+        if is_reference(image_path):
+            if self._page[0] != image_path:
+                with stage('image_load'):
+                    self._page = (image_path, read_reference(image_path))
+            return self._page[1]
+        with open(image_path, 'rb') as f:
+            return f.read()
+
+    def _in_memory(self, image_path: str) -> bool:
+        """Whether the image is read from memory rather than opened by path"""
+        return image_path in self.contents or is_reference(image_path)
+
+    def _open(self, image_path: str):
+        """Image path, or its content as a file object when it was already read or is a page"""
+        if self._in_memory(image_path):
+            return io.BytesIO(self._read(image_path))
+        return image_path
+
+    def load_image(self, image_path: str) -> 'Image.Image':
+        """Load an image as the OCR engine will see it (after preprocessing)"""
+        with stage('image_load'):
+            if self.preprocessor is not None:
+                return self.preprocessor.load(self._open(image_path))
+            from PIL import Image
+
+            img = Image.open(self._open(image_path))
+            img.load()
+            return img
+
+    def extract_detections(self, image_path: str) -> List[list]:
+        """
+        Run OCR and return the raw detections
+
+        Results are served from the OCR cache when one is configured.
+
+        Returns:
+            List of [bbox, text, confidence]. Tesseract returns the whole page
+            as one detection with no bbox or confidence.
+        """
+        def run_ocr():
+            if self.ocr_engine == 'easyocr':
+                return self._reocr_weak(self._readtext(image_path), lambda: self.load_image(image_path))
+            img = self.load_image(image_path)
+            with stage('ocr_recognize'):
+                return [(None, self.pytesseract.image_to_string(img), None)]
+
+        return self._cached(image_path, self.ocr_settings(), run_ocr)
+
+    def _readtext(self, image_path: str) -> List[list]:
+        """
+        EasyOCR readtext() split into its detection and recognition steps
+
+        Same calls and defaults as Reader.readtext, so the output is
+        identical, but each step is timed as its own stage.
+        """
+        from easyocr.utils import reformat_input
+
+        if self.preprocessor is not None:
+            import numpy as np
+            image = np.array(self.load_image(image_path))
+        else:
+            # reformat_input decodes file content as well as paths
+            image = self._read(image_path) if self._in_memory(image_path) else image_path
+        with stage('image_load'):
+            img, img_cv_grey = reformat_input(image)
+        with stage('ocr_detect'):
+            horizontal_list, free_list = self.reader.detect(img, reformat=False)
+        with stage('ocr_recognize'):
+            return self.reader.recognize(img_cv_grey, horizontal_list[0], free_list[0], reformat=False)
+
+    def _readtext_batch(self, images: List['Image.Image']) -> List[List[list]]:
+        """
+        Full-page EasyOCR of several images, one text detection pass per image size
+
+        Text detection is the expensive network and accepts a batch of
+        equally sized images (as in Reader.readtext_batched). Images of the
+        same size are detected together as they are; they are not padded or
+        resized to a common size, which would change how the detector scales
+        them, so the result is the same as _readtext() and shares its cache
+        entry.
+        """
+        import numpy as np
+        from easyocr.utils import reformat_input
+
+        with stage('image_load'):
+            arrays = [reformat_input(np.array(img)) for img in images]
+        sizes = {}
+        for i, (img, _) in enumerate(arrays):
+            sizes.setdefault(img.shape, []).append(i)
+
+        results = [None] * len(arrays)
+        for indexes in sizes.values():
+            with stage('ocr_detect'):
+                horizontal_lists, free_lists = self.reader.detect(np.stack([arrays[i][0] for i in indexes]),
+                                                                  reformat=False)
+            with stage('ocr_recognize'):
+                for i, horizontal_list, free_list in zip(indexes, horizontal_lists, free_lists):
+                    results[i] = self.reader.recognize(arrays[i][1], horizontal_list, free_list, reformat=False)
+        return results
+
+    def _reocr_weak(self, detections: List[list], load_image, numeric: Optional[List[bool]] = None) -> List[list]:
+        """
+        Read the weak numeric detections of an image again, leaving the rest as they are
+
+        Each detection below reocr_threshold that holds a number is cropped,
+        upscaled 3x and recognised with only digits and separators allowed.
+        If that is still below the threshold and Tesseract is installed, it
+        reads the crop as a single line of digits as well. The most confident
+        reading replaces the detection if it beats the original.
+
+        Args:
+            detections: [bbox, text, confidence] from EasyOCR
+            load_image: Returns the image the detections are from; only called
+                if a detection needs re-reading
+            numeric: Per detection, whether it holds a number (layout fields);
+                None decides from the text
+
+        Returns:
+            Detections with the weak ones replaced
+        """
+        threshold = self.reocr_threshold
+        if threshold is None or self.ocr_engine != 'easyocr':
+            return detections
+        weak = [i for i, (bbox, text, confidence) in enumerate(detections)
+                if bbox is not None and confidence is not None and confidence < threshold
+                and (numeric[i] if numeric is not None else numeric_text(text))]
+        if not weak:
+            return detections
+
+        import numpy as np
+        from PIL import Image
+
+        img = load_image().convert('L')
+        detections = list(detections)
+        with stage('ocr_reocr'):
+            for i in weak:
+                bbox, text, confidence = detections[i]
+                x0, y0, x1, y1 = box_bounds(bbox, *img.size)
+                if x1 <= x0 or y1 <= y0:
+                    continue
+                crop = img.crop((x0, y0, x1, y1))
+                crop = crop.resize((crop.width * 3, crop.height * 3), Image.LANCZOS)
+                self.reocr_counts['weak'] += 1
+
+                candidates = []
+                for _, new_text, new_confidence in self.reader.recognize(
+                        np.array(crop), horizontal_list=[[0, crop.width, 0, crop.height]], free_list=[],
+                        allowlist=NUMERIC_CHARS, reformat=False):
+                    candidates.append((new_confidence, new_text))
+                if not candidates or max(candidates)[0] < threshold:
+                    candidates.extend(self._tesseract_digits(crop))
+
+                if candidates and max(candidates)[0] > confidence:
+                    new_confidence, new_text = max(candidates)
+                    detections[i] = (bbox, new_text, new_confidence)
+                    self.reocr_counts['improved'] += 1
+        return detections
+
+    def _tesseract_digits(self, crop: 'Image.Image') -> List[tuple]:
+        """(confidence 0-1, text) of Tesseract reading a crop as one line of digits; empty without Tesseract"""
+        try:
+            import pytesseract
+            result = pytesseract.image_to_data(
+                crop, config=f'--psm 7 -c tessedit_char_whitelist={NUMERIC_CHARS}',
+                output_type=pytesseract.Output.DICT)
+        except Exception:
+            # Not installed, or no tesseract binary
+            return []
+        words = [(word, float(conf)) for word, conf in zip(result['text'], result['conf'])
+                 if word.strip() and float(conf) >= 0]
+        if not words:
+            return []
+        return [(min(conf for _, conf in words) / 100, ' '.join(word for word, _ in words))]
+
+    def _numeric_fields(self) -> List[bool]:
+        """Per field of _layout_fields(), whether it holds a number"""
+        return [self.layout.fields[field]['type'] == 'number' for field in self._layout_fields()]
+
+    def _layout_fields(self) -> List[str]:
+        """Layout fields with a non-empty box"""
+        return [field for field, spec in self.layout.fields.items()
+                if spec['box'][2] > spec['box'][0] and spec['box'][3] > spec['box'][1]]
+
+    def _recognize_fields(self, images: List['Image.Image'], batch_size: int = 1) -> List[List[list]]:
+        """
+        Recognise the layout field boxes of one or more images
+
+        With EasyOCR the field crops of all images are stacked into one strip
+        and sent through the recogniser in a single call, which batches them
+        (batch_size crops per forward pass). Results are matched back to their
+        field by position, so every image gets one detection per field in
+        _layout_fields() order; a crop too small to read gives empty text.
+
+        Returns:
+            Per image, [bbox, text, confidence] of each field in its own pixel coordinates
+        """
+        fields = self._layout_fields()
+        crops = []
+        for index, img in enumerate(images):
+            pixel_boxes = self.layout.pixel_boxes(*img.size)
+            for field in fields:
+                crops.append((index, pixel_boxes[field]))
+
+        if self.ocr_engine != 'easyocr':
+            detections = [[] for _ in images]
+            with stage('ocr_recognize'):
+                for index, (x0, y0, x1, y1) in crops:
+                    # --psm 7: treat the crop as a single text line
+                    text = self.pytesseract.image_to_string(images[index].crop((x0, y0, x1, y1)),
+                                                            config='--psm 7')
+                    detections[index].append(([[x0, y0], [x1, y0], [x1, y1], [x0, y1]], text.strip(), None))
+            return detections
+
+        import numpy as np
+        greys = [np.array(img.convert('L')) for img in images]
+        # Boxes clipped to nothing at the image edge are not sent to the recogniser
+        sized = [(index, box) for index, box in crops if box[2] > box[0] and box[3] > box[1]]
+        tops = {}
+        by_top = {}
+        if sized:
+            strip = np.full((sum(y1 - y0 for _, (x0, y0, x1, y1) in sized),
+                             max(x1 - x0 for _, (x0, y0, x1, y1) in sized)), 255, dtype=np.uint8)
+            horizontal_list = []
+            top = 0
+            for index, (x0, y0, x1, y1) in sized:
+                strip[top:top + y1 - y0, :x1 - x0] = greys[index][y0:y1, x0:x1]
+                horizontal_list.append([0, x1 - x0, top, top + y1 - y0])
+                tops[(index, x0, y0, x1, y1)] = top
+                top += y1 - y0
+
+            with stage('ocr_recognize'):
+                results = self.reader.recognize(strip, horizontal_list=horizontal_list, free_list=[],
+                                                batch_size=batch_size, reformat=False)
+            # The recogniser may reorder crops (by height when batching) or skip tiny ones
+            by_top = {int(bbox[0][1]): (text, confidence) for bbox, text, confidence in results}
+
+        detections = [[] for _ in images]
+        for index, (x0, y0, x1, y1) in crops:
+            text, confidence = by_top.get(tops.get((index, x0, y0, x1, y1)), ('', 0.0))
+            detections[index].append(([[x0, y0], [x1, y0], [x1, y1], [x0, y1]], text, confidence))
+        return detections
+
+    def extract_field_detections(self, image_path: str) -> Dict[str, list]:
+        """
+        Recognise only the field boxes of the layout profile
+
+        No text detection pass is run: each field box goes straight to the
+        recogniser, which is much cheaper than full-page OCR.
+
+        Returns:
+            field -> [bbox, text, confidence]
+        """
+        def run_ocr():
+            img = self.load_image(image_path)
+            return self._reocr_weak(self._recognize_fields([img])[0], lambda: img, self._numeric_fields())
+
+        detections = self._cached(image_path, self.ocr_settings(self.layout), run_ocr)
+        return dict(zip(self._layout_fields(), detections))
+
+    def _batched(self, image_paths: List[str], settings: Dict[str, any], batch_size: int,
+                 run_batch) -> List[Optional[List[list]]]:
+        """
+        OCR images batch_size at a time with run_batch(images), through the OCR cache
+
+        Cached images are not OCR'd again. An image that cannot be loaded, or
+        a batch the engine fails on, is left as None for the one-image path to
+        handle (and report) later.
+        """
+        results = [None] * len(image_paths)
+        keys = {}
+        todo = []
+        # image index -> content hashed for its cache key, held until the image
+        # is loaded for its batch so the file is only read once
+        held = {}
+
+        def run(indexes):
+            loaded = []
+            for i in indexes:
+                image_path = image_paths[i]
+                content = held.pop(i, None)
+                if content is not None:
+                    self.contents[image_path] = content
+                try:
+                    loaded.append((i, self.load_image(image_path)))
+                except Exception as e:
+                    print(f"Skipping {image_path} in OCR batch: {e}")
+                finally:
+                    if content is not None:
+                        del self.contents[image_path]
+            if not loaded:
+                return
+            try:
+                batch = run_batch([img for _, img in loaded])
+            except Exception as e:
+                print(f"Batched OCR failed ({e}); these images will be OCR'd one at a time")
+                return
+            for (i, _), detections in zip(loaded, batch):
+                if self.cache is not None:
+                    detections = self.cache.put(keys[i], detections)
+                results[i] = detections
+
+        for i, image_path in enumerate(image_paths):
+            if self.cache is not None:
+                try:
+                    content = self._read(image_path)
+                except OSError:
+                    continue
+                keys[i] = cache_key(content, settings)
+                cached = self.cache.get(keys[i])
+                if cached is not None:
+                    results[i] = cached
+                    continue
+                if not self._in_memory(image_path):
+                    held[i] = content
+            todo.append(i)
+            if len(todo) == batch_size:
+                run(todo)
+                todo = []
+        if todo:
+            run(todo)
+        return results
+
+    def extract_detections_batch(self, image_paths: List[str], batch_size: int = 8) -> List[Optional[List[list]]]:
+        """
+        Full-page OCR of several images, up to batch_size images of the same size per detection pass
+
+        Returns:
+            Per image, detections as extract_detections() returns them, or None
+            for an image that could not be OCR'd in a batch
+        """
+        def run_batch(images):
+            if self.ocr_engine == 'easyocr':
+                return [self._reocr_weak(detections, lambda img=img: img)
+                        for img, detections in zip(images, self._readtext_batch(images))]
+            # Tesseract has no batched mode; each image is its own call
+            with stage('ocr_recognize'):
+                return [[(None, self.pytesseract.image_to_string(img), None)] for img in images]
+
+        return self._batched(image_paths, self.ocr_settings(), batch_size, run_batch)
+
+    def _field_detections_batch(self, image_paths: List[str], batch_size: int) -> List[Optional[List[list]]]:
+        """Layout field detections of several images as cached lists, batch_size images per call"""
+        crops_per_call = batch_size * len(self._layout_fields())
+        numeric = self._numeric_fields()
+
+        def run_batch(images):
+            return [self._reocr_weak(detections, lambda img=img: img, numeric)
+                    for img, detections in zip(images, self._recognize_fields(images, crops_per_call))]
+
+        return self._batched(image_paths, self.ocr_settings(self.layout), batch_size, run_batch)
+
+    def extract_field_detections_batch(self, image_paths: List[str],
+                                       batch_size: int = 8) -> List[Optional[Dict[str, list]]]:
+        """
+        Layout field recognition of several images, the crops of batch_size images per call
+
+        Returns:
+            Per image, field -> [bbox, text, confidence], or None for an image
+            that could not be OCR'd in a batch
+        """
+        fields = self._layout_fields()
+        return [dict(zip(fields, detections)) if detections is not None else None
+                for detections in self._field_detections_batch(image_paths, batch_size)]
+
+    def prefetch(self, image_paths: List[str], batch_size: int = 8):
+        """
+        OCR the next images in batches before they are extracted one by one
+
+        extract(), extract_text() and the field detection methods then use the
+        prefetched detections instead of running OCR again. Uses the layout
+        field boxes when a layout profile is set, the full page otherwise.
+        """
+        if self.layout is not None:
+            kind = 'fields'
+            results = self._field_detections_batch(image_paths, batch_size)
+        else:
+            kind = 'page'
+            results = self.extract_detections_batch(image_paths, batch_size)
+        for image_path, detections in zip(image_paths, results):
+            if detections is not None:
+                self._prefetched[(kind, image_path)] = detections
+
+    def discard_prefetched(self, image_path: str):
+        """Drop what prefetch() holds for an image that was not extracted (e.g. it failed)"""
+        self._prefetched.pop(('page', image_path), None)
+        self._prefetched.pop(('fields', image_path), None)
+
     def extract_text(self, image_path: str) -> str:
         """Extract text from image using OCR"""
 
-        if self.ocr_engine == 'easyocr':
-            result = self.reader.readtext(image_path)
-            # Combine all detected text with positions
-            text_lines = []
-            for detection in result:
-                bbox, text, confidence = detection
-                text_lines.append(text)
-            return '\n'.join(text_lines)
-        else:
-            img = Image.open(image_path)
-            return self.pytesseract.image_to_string(img)
+        # Combine all detected text
+        text_lines = []
+        for detection in self.extract_detections(image_path):
+            bbox, text, confidence = detection
+            text_lines.append(text)
+        return '\n'.join(text_lines)
+
+    def extract(self, image_path: str, verbose: bool = False) -> Dict[str, any]:
+        """
+        OCR an image and parse it, reusing the loaded OCR engine
+
+        With a layout profile only the field boxes are recognised. If that
+        misses the key totals (e.g. the photo is framed differently from the
+        calibration sample) the full page is OCR'd instead.
+
+        In cascade mode the fast Tesseract result is kept when its figures
+        add up (validation.validate_payslip); otherwise the image is OCR'd
+        again with EasyOCR.
+
+        The confidence of each field's detection is returned in
+        data['field_confidence'] (EasyOCR only), and the file and page the
+        payslip was read from in data['source_file'], data['source_page']
+        and data['source_block'].
+
+        Args:
+            image_path: Payslip image, or page or block reference (see pages.py)
+            verbose: Print the OCR text of full-page OCR
+        """
+        data = self._extract(image_path, verbose)
+        if self.fallback is not None:
+            with stage('parse'):
+                problems = validate_payslip(data)
+            if not problems:
+                self.cascade_counts['fast'] += 1
+            else:
+                self.cascade_counts['fallback'] += 1
+                print(f"Tesseract result of {os.path.basename(image_path)} does not add up "
+                      f"({'; '.join(problems)}), re-running with EasyOCR")
+                data = self.fallback._extract(image_path, verbose)
+
+        source_file, page = split_page_ref(image_path)
+        data['source_file'] = source_file
+        data['source_page'] = page or 0
+        data['source_block'] = split_block_ref(image_path)[1] or 0
+        return data
+
+    def _extract(self, image_path: str, verbose: bool = False) -> Dict[str, any]:
+        """extract() with this extractor's engine only"""
+        if self.layout is not None:
+            field_detections = self.extract_field_detections(image_path)
+            field_texts = {field: detection[1] for field, detection in field_detections.items()}
+            with stage('parse'):
+                data = self.parse_fields(field_texts)
+            if data['basic_pay'] and data['monthly_gross']:
+                data['field_confidence'] = {field: round(float(detection[2]), 4)
+                                            for field, detection in field_detections.items()
+                                            if detection[2] is not None and detection[1]}
+                return data
+            print(f"Layout fields incomplete for {image_path}, falling back to full-page OCR")
+
+        detections = self.extract_detections(image_path)
+        text = '\n'.join(detection[1] for detection in detections)
+        if verbose:
+            print("\n=== Extracted Text ===")
+            print(text)
+            print("\n=== Parsing Data ===")
+        with stage('parse'):
+            data = self.parse_payslip(text)
+            data['field_confidence'] = field_confidences(data, detections)
+        return data
+
+    def parse_fields(self, field_texts: Dict[str, str]) -> Dict[str, any]:
+        """
+        Parse the text recognised in each layout field box
+
+        Args:
+            field_texts: field -> recognised text of its box
+
+        Returns:
+            Data in the same format as parse_payslip
+        """
+        data = _empty_payslip_data()
+
+        for field, text in field_texts.items():
+            spec = self.layout.fields[field]
+            if spec['type'] == 'number':
+                match = _NUMBER.search(text)
+                if not match:
+                    continue
+                value = float(match.group())
+            elif spec['type'] == 'overtime':
+                entry = _overtime_entry(text)
+                if entry:
+                    data['overtime'].append(entry)
+                continue
+            else:
+                text = text.strip().upper()
+                if 'pattern' in spec:
+                    match = re.search(spec['pattern'], text)
+                    if not match:
+                        continue
+                    text = match.group()
+                value = text
+
+            group, _, key = field.rpartition('.')
+            if group:
+                data[group][key] = value
+            else:
+                data[field] = value
+
+        _fill_detail_totals(data, field_texts)
+        return data
+
+    @staticmethod
+    def _apply_rules(keyword_lines: List[tuple], lines: List[str], data: Dict[str, any]):
+        """Run the rules triggered by the keywords found on each line ((line index, keywords) pairs)"""
+        # line index -> name pattern match, shared by the name rule's +-2 line windows
+        name_matches = {}
+        for i, found in keyword_lines:
+            for apply_rule in _rules_for_keywords(tuple(found)):
+                apply_rule(lines, i, data, name_matches)
+
+    @staticmethod
+    def _keyword_lines(text: str) -> List[tuple]:
+        """
+        (line index, keywords on it) of every line holding a keyword
+
+        Each keyword is looked up over the whole text with str.find, so the
+        lines without a keyword (OCR noise, mostly) cost nothing in Python.
+        A line contains a keyword exactly when the substring is in it.
+        """
+        hits = []
+        find = text.find
+        for keyword in _KEYWORDS:
+            start = find(keyword)
+            while start != -1:
+                hits.append((start, keyword))
+                start = find(keyword, start + 1)
+        hits.sort()
+
+        keyword_lines = []
+        line_no = last_pos = 0
+        found = None
+        for start, keyword in hits:
+            line_no += text.count('\n', last_pos, start)
+            last_pos = start
+            if found is None or keyword_lines[-1][0] != line_no:
+                found = []
+                keyword_lines.append((line_no, found))
+            found.append(keyword)
+        return keyword_lines
 
     def parse_payslip(self, text: str) -> Dict[str, any]:
         """Parse payslip text and extract relevant fields"""
 
-        data = {
-            'company_name': '',
-            'employee_no': '',
-            'employee_name': '',
-            'ic_no': '',
-            'period': '',
-            'date': '',
-            'basic_rate': 0.0,
-            'working_days': 0.0,
-            'basic_pay': 0.0,
-            'allowances': {},
-            'overtime': [],
-            'monthly_gross': 0.0,
-            'epf_employer': 0.0,
-            'socso_employer': 0.0,
-            'eis_employer': 0.0,
-            'ytd_al': 0.0,
-            'ytd_mc': 0.0,
-            'deduction': 0.0,
-            'epf_employee': 0.0,
-            'socso_employee': 0.0,
-            'eis_employee': 0.0,
-            'nett_pay': 0.0
-        }
+        data = _empty_payslip_data()
 
         lines = text.split('\n')
 
-        # Extract company name
-        for line in lines:
-            if 'INDUSTRIES' in line or 'SDN BHD' in line:
-                data['company_name'] = line.strip()
-                break
-
-        # Extract employee information
-        for i, line in enumerate(lines):
-            # Employee number
-            if 'EMPLOYEE' in line and 'LINE NO' in line:
-                # Look for Y#### pattern
-                match = re.search(r'Y\d+', line)
-                if match:
-                    data['employee_no'] = match.group()
-
-            # Employee name and IC
-            if 'NAME' in line:
-                # Look in nearby lines for name
-                for j in range(max(0, i-2), min(len(lines), i+3)):
-                    name_match = re.search(r'KYAW\s+\w+\s+\w+|[A-Z]{2,}\s+[A-Z]{2,}\s+[A-Z]{2,}', lines[j])
-                    if name_match:
-                        data['employee_name'] = name_match.group().strip()
-
-            if 'I/C NO' in line or 'IC NO' in line:
-                match = re.search(r'MD\d+|[A-Z]{2}\d+', line)
-                if match:
-                    data['ic_no'] = match.group()
-
-            # Period and date
-            if 'PAYROLL' in line and ('SEPTEMBER' in line or re.search(r'\w+\s+\d{4}', line)):
-                data['period'] = line.strip()
-
-            if 'MONTHLY' in line and 'BANK' in line:
-                date_match = re.search(r'\d{2}/\d{2}/\d{4}', line)
-                if date_match:
-                    data['date'] = date_match.group()
-
-            # Basic rate and working days
-            if 'BASIC RATE' in line:
-                match = re.search(r'(\d+\.?\d*)', line)
-                if match:
-                    data['basic_rate'] = float(match.group(1))
-
-            if 'WORKING DAYS' in line:
-                match = re.search(r'(\d+\.?\d*)', line)
-                if match:
-                    data['working_days'] = float(match.group(1))
-
-            # Basic pay
-            if 'BASIC PAY' in line and 'DIRECTOR' not in line:
-                match = re.search(r'(\d+\.?\d*)', line)
-                if match:
-                    data['basic_pay'] = float(match.group(1))
-
-            # Allowances
-            if 'LEADER ALLW' in line or 'ALLOWANCE' in line:
-                match = re.search(r'(\d+\.?\d*)', line)
-                if match and 'LEADER' in line:
-                    data['allowances']['LEADER_ALLW'] = float(match.group(1))
-
-            # Monthly gross
-            if 'MONTHLY GROSS' in line:
-                match = re.search(r'(\d+\.?\d*)', line)
-                if match:
-                    data['monthly_gross'] = float(match.group(1))
-
-            # EPF, SOCSO, EIS
-            if "EPF" in line and "YER" in line:
-                match = re.search(r'(\d+\.?\d*)', line)
-                if match:
-                    data['epf_employer'] = float(match.group(1))
-
-            if "SOCSO" in line and "YER" in line:
-                match = re.search(r'(\d+\.?\d*)', line)
-                if match:
-                    data['socso_employer'] = float(match.group(1))
-
-            if "EIS" in line and "YER" in line:
-                match = re.search(r'(\d+\.?\d*)', line)
-                if match:
-                    data['eis_employer'] = float(match.group(1))
-
-            # YTD AL and MC
-            if 'YTD AL' in line:
-                match = re.search(r'(\d+\.?\d*)', line)
-                if match:
-                    data['ytd_al'] = float(match.group(1))
-
-            if 'YTD MC' in line:
-                match = re.search(r'(\d+\.?\d*)', line)
-                if match:
-                    data['ytd_mc'] = float(match.group(1))
-
-            # Overtime
-            if '1.5 TIMES' in line or 'OVERTIME' in line:
-                # Try to extract overtime details
-                numbers = re.findall(r'\d+\.?\d*', line)
-                if len(numbers) >= 3:
-                    data['overtime'].append({
-                        'type': '1.5 TIMES',
-                        'rate': float(numbers[0]) if numbers else 0,
-                        'hours': float(numbers[1]) if len(numbers) > 1 else 0,
-                        'amount': float(numbers[2]) if len(numbers) > 2 else 0
-                    })
-
-        # Try to extract summary line (last line with all values)
+        self._apply_rules(self._keyword_lines(text), lines, data)
+
+        # Summary line (last line with all values), normally the very last line
         for line in reversed(lines):
-            if 'NETT' in line or re.findall(r'\d+\.?\d*', line):
-                numbers = re.findall(r'\d+\.?\d*', line)
-                if len(numbers) >= 8:
-                    try:
-                        data['basic_pay'] = float(numbers[0])
-                        # numbers[1] is director fee
-                        data['overtime_total'] = float(numbers[2]) if len(numbers) > 2 else 0
-                        data['allowance_total'] = float(numbers[3]) if len(numbers) > 3 else 0
-                        data['monthly_gross'] = float(numbers[4]) if len(numbers) > 4 else 0
-                        data['deduction'] = float(numbers[5]) if len(numbers) > 5 else 0
-                        data['epf_employee'] = float(numbers[6]) if len(numbers) > 6 else 0
-                        data['socso_employee'] = float(numbers[7]) if len(numbers) > 7 else 0
-                        if len(numbers) > 8:
-                            data['eis_employee'] = float(numbers[8])
-                        if len(numbers) > 9:
-                            data['nett_pay'] = float(numbers[9])
-                        break
-                    except (ValueError, IndexError):
-                        pass
+            numbers = _NUMBER.findall(line)
+            if len(numbers) < 8:
+                continue
+            data['basic_pay'] = float(numbers[0])
+            data['director_fee'] = float(numbers[1])
+            data['overtime_total'] = float(numbers[2])
+            data['allowance_total'] = float(numbers[3])
+            data['monthly_gross'] = float(numbers[4])
+            data['deduction'] = float(numbers[5])
+            data['epf_employee'] = float(numbers[6])
+            data['socso_employee'] = float(numbers[7])
+            if len(numbers) > 8:
+                data['eis_employee'] = float(numbers[8])
+            if len(numbers) > 9:
+                data['nett_pay'] = float(numbers[9])
+            break
+        else:
+            _fill_detail_totals(data)
 
         return data
 
 
+# Sheet listing the payslips that have no row in the template, and its columns (label, data field)
+UNMATCHED_SHEET = 'Unmatched'
+UNMATCHED_COLUMNS = [
+    ('Source File', 'source_file'), ('Page', 'source_page'), ('Block', 'source_block'),
+    ('Staff Code', 'employee_no'), ('Name', 'employee_name'), ('NRIC / Passport', 'ic_no'),
+    ('Basic Pay', 'basic_pay'), ('Monthly Gross', 'monthly_gross'), ('Nett Pay', 'nett_pay'),
+]
+
+
 class ExcelWriter:
     """Write extracted data to Excel template"""
 
-    def __init__(self, template_path: str):
-        """Load Excel template"""
+    def __init__(self, template_path: str, workbook_path: Optional[str] = None):
+        """
+        Load Excel template
+
+        Args:
+            template_path: Excel template; its column layout comes from the schema cached beside it
+            workbook_path: Workbook to continue instead of a fresh copy of the template
+        """
+        # openpyxl takes longer to import than a payslip takes to parse, so
+        # it is only imported when a workbook is written
+        import openpyxl
+        from template_schema import load_template_schema
+
         self.template_path = template_path
-        self.wb = openpyxl.load_workbook(template_path)
+        with stage('template_load'):
+            self.wb = openpyxl.load_workbook(workbook_path or template_path)
+            self.schema = load_template_schema(template_path, None if workbook_path else self.wb)
+        # sheet title -> SheetIndex
+        self._indexes = {}
+        # (data, reason) of the payslips written to the UNMATCHED_SHEET
+        self.unmatched: List[Tuple[Dict[str, any], str]] = []
+
+    def index(self, sheet_name: Optional[str] = None) -> SheetIndex:
+        """Employee row index of a sheet, built on first use and kept up to date by the writer"""
+        sheet = self.wb[sheet_name] if sheet_name else self.wb.active
+        if sheet.title not in self._indexes:
+            self._indexes[sheet.title] = SheetIndex(sheet, self.schema)
+        return self._indexes[sheet.title]
 
     def fill_data(self, data: Dict[str, any], sheet_name: Optional[str] = None):
         """
@@ -232,43 +1021,66 @@ class ExcelWriter:
             data: Extracted payslip data
             sheet_name: Target sheet name (uses active sheet if None)
         """
-        if sheet_name:
-            sheet = self.wb[sheet_name]
-        else:
-            sheet = self.wb.active
-
-        # This is a template mapping - will be adjusted after seeing actual template structure
-        # For now, creating a simple data dump
-
-        # Start from row 2 (assuming row 1 has headers)
-        row = 2
-
-        # Add basic information
-        mappings = {
-            'A': 'employee_no',
-            'B': 'employee_name',
-            'C': 'ic_no',
-            'D': 'period',
-            'E': 'basic_rate',
-            'F': 'working_days',
-            'G': 'basic_pay',
-            'H': 'monthly_gross',
-            'I': 'epf_employer',
-            'J': 'socso_employer',
-            'K': 'eis_employer',
-            'L': 'epf_employee',
-            'M': 'socso_employee',
-            'N': 'eis_employee',
-            'O': 'nett_pay',
-        }
+        self.add_employee(data, sheet_name)
+
+    def add_employee(self, data: Dict[str, any], sheet_name: Optional[str] = None) -> int:
+        """
+        Write one parsed payslip into its employee row
+
+        An employee already listed in the sheet (same staff code, or same
+        NRIC/passport) is updated in place, so reprocessing a payslip
+        overwrites its row. A new employee is appended to the section whose
+        staff share the code prefix (e.g. Z#### goes to "Subcon Foreigner");
+        if the section is full a row is inserted and the subtotal formulas are
+        extended to cover it.
+
+        Args:
+            data: Extracted payslip data (as returned by parse_payslip)
+            sheet_name: Target sheet name (uses active sheet if None)
+
+        A payslip that matches no employee and no section (staff code not
+        read, or with an unknown prefix) is written to the UNMATCHED_SHEET
+        instead, so that no payslip is left out of the workbook.
+
+        Returns:
+            Row number that was written (None: written to the UNMATCHED_SHEET)
+        """
+        from demo_fill_excel import write_employee_row
 
-        for col, field in mappings.items():
-            if field in data:
-                sheet[f'{col}{row}'] = data[field]
+        index = self.index(sheet_name)
+        try:
+            row, employee_no = index.upsert(data.get('employee_no', ''), data.get('ic_no', ''))
+        except ValueError as e:
+            self.add_unmatched(data, str(e))
+            return None
+        write_employee_row(index.sheet, row, employee_no, to_employee_data(data), index.columns_at(row))
+        return row
+
+    def add_unmatched(self, data: Dict[str, any], reason: str):
+        """Append a payslip that has no row in the template to the UNMATCHED_SHEET, for someone to place"""
+        if UNMATCHED_SHEET not in self.wb.sheetnames:
+            self.wb.create_sheet(UNMATCHED_SHEET).append([label for label, _ in UNMATCHED_COLUMNS] + ['Reason'])
+        self.wb[UNMATCHED_SHEET].append([data.get(field, '') for _, field in UNMATCHED_COLUMNS] + [reason])
+        self.unmatched.append((data, reason))
+        print(f"No template row for {data.get('employee_no') or data.get('employee_name') or 'a payslip'} "
+              f"({reason}); written to the {UNMATCHED_SHEET} sheet")
+
+    def add_employees(self, results: List[Dict[str, any]], sheet_name: Optional[str] = None):
+        """
+        Write many parsed payslips, inserting the rows they need in one go per section
+
+        Employees without a matching section go to the UNMATCHED_SHEET
+        (listed in self.unmatched).
+        """
+        index = self.index(sheet_name)
+        index.reserve((data.get('employee_no', ''), data.get('ic_no', '')) for data in results)
+        for data in results:
+            self.add_employee(data, sheet_name)
 
     def save(self, output_path: str):
         """Save the filled Excel file"""
-        self.wb.save(output_path)
+        with stage('save'):
+            self.wb.save(output_path)
         print(f"Saved to: {output_path}")
 
     def close(self):
@@ -276,104 +1088,1426 @@ class ExcelWriter:
         self.wb.close()
 
 
-def process_payslip(image_path: str, template_path: str, output_path: str, ocr_engine='easyocr'):
+def to_employee_data(data: Dict[str, any]) -> Dict[str, any]:
+    """Convert parse_payslip output to the employee_data layout used by demo_fill_excel"""
+    ot_15 = [ot for ot in data.get('overtime', []) if ot.get('type') == '1.5 TIMES']
+    return {
+        'employee_code': data.get('employee_no', ''),
+        'employee_name': data.get('employee_name', ''),
+        'nric': data.get('ic_no', ''),
+        'basic_pay': data.get('basic_pay', 0),
+        'working_days': data.get('working_days', 0),
+        'ot_15_hours': sum(ot['hours'] for ot in ot_15),
+        'ot_15_amount': sum(ot['amount'] for ot in ot_15),
+        # Written to the section's column of the same label (LEADER ALLW falls
+        # back to Travelling Allw where the section has no Leader Allw column)
+        'allowances': dict(data.get('allowances', {})),
+        'monthly_gross': data.get('monthly_gross', 0),
+        'epf_employer': data.get('epf_employer', 0),
+        'epf_employee': data.get('epf_employee', 0),
+        'socso_employer': data.get('socso_employer', 0),
+        'socso_employee': data.get('socso_employee', 0),
+        'eis_employer': data.get('eis_employer', 0),
+        'eis_employee': data.get('eis_employee', 0),
+        'nett_pay': data.get('nett_pay', 0),
+    }
+
+
+def make_extractor(ocr_engine: str = 'easyocr', cache_options: Optional[Dict[str, any]] = None,
+                   layout_path: Optional[str] = None,
+                   preprocess_options: Optional[Dict[str, any]] = None,
+                   reocr_threshold: Optional[float] = None) -> PayslipExtractor:
+    """
+    Create an extractor from picklable options (as passed to worker processes)
+
+    Args:
+        ocr_engine: OCR engine to use
+        cache_options: OCRCache keyword arguments, or None to disable the cache
+        layout_path: Layout profile to recognise field boxes only, or None for full-page OCR
+        preprocess_options: Preprocessor keyword arguments, or None to disable preprocessing
+        reocr_threshold: Re-read numeric detections below this confidence, or None
+    """
+    from preprocess import Preprocessor
+
+    cache = OCRCache(**cache_options) if cache_options is not None else None
+    layout = LayoutProfile.load(layout_path) if layout_path else None
+    preprocessor = Preprocessor(**preprocess_options) if preprocess_options is not None else None
+    return PayslipExtractor(ocr_engine=ocr_engine, cache=cache, layout=layout, preprocessor=preprocessor,
+                            reocr_threshold=reocr_threshold)
+
+
+def process_payslip(image_path: str, template_path: str, output_path: str, ocr_engine='easyocr',
+                    extractor: Optional[PayslipExtractor] = None, verbose: bool = True):
     """
     Process a single payslip image
 
     Args:
         image_path: Path to payslip image
         template_path: Path to Excel template
-        output_path: Path for output Excel file
-        ocr_engine: OCR engine to use ('easyocr' or 'tesseract')
+        output_path: Path for output Excel file (None only extracts the data)
+        ocr_engine: OCR engine to use ('easyocr', 'tesseract' or 'cascade')
+        extractor: Already loaded extractor to reuse (a new one is created if None)
+        verbose: Print the OCR text and parsed fields
     """
     print(f"Processing payslip: {image_path}")
 
     # Extract data
-    extractor = PayslipExtractor(ocr_engine=ocr_engine)
-    text = extractor.extract_text(image_path)
+    if extractor is None:
+        extractor = PayslipExtractor(ocr_engine=ocr_engine)
 
-    print("\n=== Extracted Text ===")
-    print(text)
-    print("\n=== Parsing Data ===")
+    data = extractor.extract(image_path, verbose)
 
-    data = extractor.parse_payslip(text)
+    if verbose:
+        print("\nExtracted Data:")
+        for key, value in data.items():
+            if value and value != 0 and value != {} and value != []:
+                print(f"  {key}: {value}")
 
-    print("\nExtracted Data:")
-    for key, value in data.items():
-        if value and value != 0 and value != {} and value != []:
-            print(f"  {key}: {value}")
+    if output_path is None:
+        return data
 
     # Write to Excel
-    print("\n=== Writing to Excel ===")
+    if verbose:
+        print("\n=== Writing to Excel ===")
+    write_workbook(data, template_path, output_path)
+
+    if verbose:
+        print("\nProcessing complete!")
+    return data
+
+
+def write_workbook(data: Dict[str, any], template_path: str, output_path: str):
+    """
+    Write one parsed payslip to its own copy of the template
+
+    Raises:
+        ValueError: The payslip has no row in the template; the workbook is
+            saved with it on the UNMATCHED_SHEET
+    """
     excel_writer = ExcelWriter(template_path)
-    excel_writer.fill_data(data)
+    with stage('cell_writes'):
+        excel_writer.fill_data(data)
     excel_writer.save(output_path)
     excel_writer.close()
+    for _, reason in excel_writer.unmatched:
+        raise ValueError(f"{reason}; written to the {UNMATCHED_SHEET} sheet of {output_path}")
 
-    print("\nProcessing complete!")
-    return data
+
+IMAGE_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.bmp', '.tiff'} | MULTIPAGE_EXTENSIONS
 
 
-def batch_process(image_dir: str, template_path: str, output_dir: str, ocr_engine='easyocr'):
+def find_images(image_dir: str) -> List[str]:
+    """
+    List the payslip images in a directory
+
+    Multi-page TIFFs and PDFs are listed as one page reference per page
+    (see pages.py); their pages are only decoded when processed.
+    """
+    image_files = []
+
+    for file in os.listdir(image_dir):
+        if Path(file).suffix.lower() in IMAGE_EXTENSIONS:
+            image_files.append(os.path.join(image_dir, file))
+
+    return list(expand_pages(image_files))
+
+
+def output_path_for(image_path: str, output_dir: str) -> str:
+    """Per-image output workbook path inside output_dir (one per page of a multi-page scan and per block)"""
+    source_file, page = split_page_ref(image_path)
+    image_name = Path(source_file).stem
+    if page is not None:
+        image_name = f"{image_name}_p{page:03d}"
+    block = split_block_ref(image_path)[1]
+    if block is not None:
+        image_name = f"{image_name}_b{block}"
+    return os.path.join(output_dir, f"{image_name}_output.xlsx")
+
+
+def batch_process(image_dir: str, template_path: str, output_dir: str, ocr_engine='easyocr',
+                  extractor: Optional[PayslipExtractor] = None, workers: int = 1,
+                  cache_options: Optional[Dict[str, any]] = None,
+                  consolidated_path: Optional[str] = None,
+                  layout_path: Optional[str] = None,
+                  preprocess_options: Optional[Dict[str, any]] = None,
+                  resume: bool = False,
+                  metrics: Optional[MetricsCollector] = None,
+                  records_path: Optional[str] = None,
+                  ocr_batch_size: int = 1,
+                  pipeline: bool = False,
+                  read_threads: int = 4,
+                  queue_size: int = 16,
+                  reocr_threshold: Optional[float] = None,
+                  reconcile_path: Optional[str] = None,
+                  previous_records: Optional[str] = None,
+                  dedup: bool = False,
+                  dedup_distance: Optional[int] = None,
+                  split_sheets: bool = False) -> List[Dict[str, any]]:
     """
     Batch process multiple payslip images
 
+    By default every image gets its own `<image>_output.xlsx`. With
+    consolidated_path, all employees are written into one workbook instead:
+    the template is loaded once and saved once for the whole batch. With
+    records_path, each parsed payslip is streamed to a CSV/JSONL/Parquet file
+    as it finishes (see sinks.py) and no per-image workbooks are written.
+
+    With ocr_batch_size > 1 (single process only), the images are OCR'd
+    that many at a time ahead of parsing (PayslipExtractor.prefetch), which
+    makes better use of the CPU than one engine call per image.
+
+    With pipeline, reading images, OCR (in `workers` processes) and writing
+    the outputs run as overlapped stages (see pipeline.py), so slow storage
+    does not leave the OCR workers idle between images.
+
+    With split_sheets, sheets holding several payslips are split before OCR
+    (see sheets.py) and each payslip is processed as its own image, a block
+    reference of the sheet.
+
+    With dedup, exact copies of the same file are found before OCR (see
+    dedup.py): only the first copy is processed and the others are recorded
+    in the manifest as duplicates. With dedup_distance > 0, photos that look
+    alike are grouped too and only the best-quality photo of a group is
+    processed.
+
+    The outcome of every image is appended to a manifest beside the output
+    (see manifest.py). With resume, images already completed with the same
+    content are skipped and only failed, changed or new images are processed.
+
     Args:
         image_dir: Directory containing payslip images
         template_path: Path to Excel template
         output_dir: Directory for output Excel files
         ocr_engine: OCR engine to use
+        extractor: Already loaded extractor to reuse (a new one is created if None)
+        workers: Number of worker processes (1 processes images in this process)
+        cache_options: OCRCache keyword arguments for extractors created here (None disables the cache)
+        consolidated_path: Write every employee into this single workbook
+        layout_path: Layout profile for extractors created here (None OCRs the full page)
+        preprocess_options: Preprocessor keyword arguments for extractors created here (None disables it)
+        resume: Skip images the manifest of a previous run records as done
+        metrics: Collects per-stage timing and memory of every image (optional)
+        records_path: Stream every parsed payslip to this .csv, .jsonl or .parquet file
+        ocr_batch_size: Images per batched OCR call (1 OCRs each image on its own)
+        pipeline: Overlap reading, OCR and writing (uses a process pool even with one worker)
+        read_threads: Images the pipeline reads from disk in parallel
+        queue_size: Images the pipeline holds between stages
+        reocr_threshold: For extractors created here, re-read numeric detections below this confidence
+        reconcile_path: Reconcile the batch afterwards (see reconcile.py) and write the report here
+        previous_records: Records file of the previous month to reconcile against
+        dedup: Skip duplicates before OCR
+        dedup_distance: Largest perceptual hash distance of the near-duplicates grouped (None: dedup.DEFAULT_DISTANCE)
+        split_sheets: Split sheets holding several payslips into one image per payslip
+
+    Returns:
+        Parsed data of every successfully processed image, in completion order
+        (images completed by a resumed run first); empty when the records are
+        only streamed to records_path (read them back with sinks.read_records)
     """
     os.makedirs(output_dir, exist_ok=True)
 
-    image_extensions = {'.jpg', '.jpeg', '.png', '.bmp', '.tiff'}
-    image_files = []
-
-    for file in os.listdir(image_dir):
-        if Path(file).suffix.lower() in image_extensions:
-            image_files.append(os.path.join(image_dir, file))
+    image_files = find_images(image_dir)
+    if split_sheets:
+        image_files = split_sheet_blocks(image_files, metrics)
+    batch_images = list(image_files)
 
     print(f"Found {len(image_files)} images to process")
 
+    manifest = Manifest(manifest_path_for(output_dir, consolidated_path), resume=resume)
+    if dedup:
+        image_files = skip_duplicates(image_files, manifest, dedup_distance, metrics)
+    sink = open_sink(records_path, _empty_payslip_data()) if records_path else None
+    # Records streamed to a file are not also held in memory
+    keep_results = sink is None or bool(consolidated_path)
+    previous = []
+    if resume:
+        image_files, done = manifest.pending(image_files)
+        print(f"Resuming: {len(done)} already done, {len(image_files)} remaining")
+        # The records file is rewritten, so it starts with the completed images
+        if sink is not None:
+            for entry in done:
+                sink.write(entry['data'], entry['path'])
+        if keep_results:
+            previous = [entry['data'] for entry in done]
+    if not keep_results:
+        manifest.forget_data()
+
+    # With a consolidated workbook or a records file the per-image steps only extract data
+    per_image_dir = None if consolidated_path or records_path else output_dir
+
+    if workers > 1 or pipeline:
+        if ocr_batch_size > 1:
+            print("Note: --ocr-batch-size applies to single-process batches; each worker OCRs one image at a time")
+        if pipeline:
+            results = previous + _batch_process_pipelined(image_files, template_path, per_image_dir, ocr_engine,
+                                                          workers, cache_options, layout_path, preprocess_options,
+                                                          manifest, metrics, sink, read_threads, queue_size,
+                                                          reocr_threshold, keep_results)
+        else:
+            results = previous + _batch_process_parallel(image_files, template_path, per_image_dir, ocr_engine,
+                                                         workers, cache_options, layout_path, preprocess_options,
+                                                         manifest, metrics, sink, reocr_threshold, keep_results)
+        if sink is not None:
+            sink.close()
+            print(f"Records written to: {records_path}")
+        if consolidated_path:
+            _write_consolidated_measured(results, template_path, consolidated_path, manifest, metrics)
+        manifest.close()
+        if reconcile_path:
+            reconcile_batch(manifest, batch_images, template_path, reconcile_path, previous_records, records_path)
+        return results
+
+    # Load the OCR models once and share them across every image
+    if extractor is None:
+        extractor = make_extractor(ocr_engine, cache_options, layout_path, preprocess_options, reocr_threshold)
+
+    results = previous
+    image_times = []
+    batch_share = 0.0
     for i, image_path in enumerate(image_files, 1):
+        if ocr_batch_size > 1 and (i - 1) % ocr_batch_size == 0:
+            chunk = image_files[i - 1:i - 1 + ocr_batch_size]
+            print(f"\nOCR batch of {len(chunk)} images")
+            batch_start = time.perf_counter()
+            extractor.prefetch(chunk, ocr_batch_size)
+            batch_seconds = time.perf_counter() - batch_start
+            # Each image of the batch is charged an equal share of the batched OCR
+            batch_share = batch_seconds / len(chunk)
+            if metrics is not None:
+                step = metrics.batch_steps.setdefault('ocr_batches', {'batches': 0, 'images': 0, 'seconds': 0.0})
+                step['batches'] += 1
+                step['images'] += len(chunk)
+                step['seconds'] = round(step['seconds'] + batch_seconds, 4)
+
         print(f"\n{'='*60}")
         print(f"Processing {i}/{len(image_files)}: {os.path.basename(image_path)}")
         print(f"{'='*60}")
 
-        # Generate output filename
-        image_name = Path(image_path).stem
-        output_path = os.path.join(output_dir, f"{image_name}_output.xlsx")
+        output_path = output_path_for(image_path, per_image_dir) if per_image_dir else None
+
+        start = time.perf_counter() - batch_share
+        with measure_image(image_path) if metrics is None else metrics.measure(image_path) as record:
+            try:
+                data = process_payslip(image_path, template_path, output_path, ocr_engine,
+                                       extractor=extractor)
+            except Exception as e:
+                import traceback
+                error = traceback.format_exc()
+                print(f"Error processing {image_path}: {e}\n{error}")
+                record['error'] = f"{type(e).__name__}: {e}"
+                manifest.record(image_path, 'failed', time.perf_counter() - start, error=error)
+            else:
+                if keep_results:
+                    results.append(data)
+                if sink is not None:
+                    sink.write(data, image_path)
+                manifest.record(image_path, 'done', time.perf_counter() - start, output_path, data)
+            finally:
+                extractor.discard_prefetched(image_path)
+        image_times.append(time.perf_counter() - start)
+        if metrics is not None:
+            metrics.add(record)
+    if sink is not None:
+        sink.close()
+        print(f"Records written to: {records_path}")
+
+    print_timing_report(extractor.startup_time, image_times)
+    if extractor.preprocessor is not None:
+        extractor.preprocessor.print_report()
+    if extractor.cache is not None:
+        print(f"  OCR cache: {extractor.cache.hits} hits, {extractor.cache.misses} misses")
+    if extractor.reocr_threshold is not None:
+        print(f"  Re-OCR: {extractor.reocr_counts['weak']} weak numeric detections re-read, "
+              f"{extractor.reocr_counts['improved']} improved")
+    if extractor.fallback is not None:
+        print(f"  OCR cascade: {extractor.cascade_counts['fast']} accepted from Tesseract, "
+              f"{extractor.cascade_counts['fallback']} re-run with EasyOCR")
+    if metrics is not None:
+        metrics.print_report()
+
+    if consolidated_path:
+        _write_consolidated_measured(results, template_path, consolidated_path, manifest, metrics)
+    manifest.close()
+    if reconcile_path:
+        reconcile_batch(manifest, batch_images, template_path, reconcile_path, previous_records, records_path)
+    return results
+
+
+def split_sheet_blocks(image_files: List[str], metrics: Optional[MetricsCollector] = None) -> List[str]:
+    """
+    Replace every sheet holding several payslips by a block reference per payslip
+
+    Args:
+        image_files: Images of the batch
+        metrics: Records the time taken as the 'split_sheets' batch step (optional)
+
+    Returns:
+        The images to process
+    """
+    from sheets import split_sheets
+
+    start = time.perf_counter()
+    inputs = []
+    sheets = {}
+    for image_path in split_sheets(image_files):
+        inputs.append(image_path)
+        parent, block, _ = split_block_ref(image_path)
+        if block is not None:
+            sheets[parent] = block
+    seconds = time.perf_counter() - start
+    print(f"Split {len(sheets)} sheets into {sum(sheets.values())} payslips "
+          f"({len(inputs)} images to process, {seconds:.2f}s)")
+    for parent, count in sheets.items():
+        print(f"  {os.path.basename(parent)}: {count} payslips")
+    if metrics is not None:
+        metrics.batch_steps['split_sheets'] = {'images': len(image_files), 'sheets': len(sheets),
+                                               'payslips': len(inputs), 'seconds': round(seconds, 4)}
+    return inputs
+
+
+def skip_duplicates(image_files: List[str], manifest: Manifest, max_distance: Optional[int] = None,
+                    metrics: Optional[MetricsCollector] = None) -> List[str]:
+    """
+    Drop duplicates from a batch before OCR and record them in the manifest
+
+    Exact copies are always dropped; with max_distance > 0 so are
+    near-duplicates, and the best-quality photo of each group is kept.
+
+    Args:
+        image_files: Images of the batch
+        manifest: Manifest of the batch
+        max_distance: Largest perceptual hash distance of the near-duplicates grouped (None: dedup.DEFAULT_DISTANCE)
+        metrics: Records the time taken as the 'dedup' batch step (optional)
+
+    Returns:
+        The images to process
+    """
+    from dedup import DEFAULT_DISTANCE, find_duplicates, print_report
+
+    start = time.perf_counter()
+    keep, groups = find_duplicates(image_files, DEFAULT_DISTANCE if max_distance is None else max_distance)
+    seconds = time.perf_counter() - start
+    for group in groups:
+        for duplicate in group['duplicates']:
+            manifest.record(duplicate['path'], 'duplicate', 0.0, duplicate_of=group['keep'])
+    print_report(groups, len(image_files))
+    print(f"  Dedup took {seconds:.2f}s")
+    if metrics is not None:
+        similar = sum(duplicate['match'] == 'similar' for group in groups for duplicate in group['duplicates'])
+        metrics.batch_steps['dedup'] = {'images': len(image_files), 'skipped': len(image_files) - len(keep),
+                                        'groups': len(groups), 'similar': similar,
+                                        'seconds': round(seconds, 4)}
+    return keep
+
+
+def reconcile_batch(manifest: Manifest, image_files: List[str], template_path: str, report_path: str,
+                    previous_records: Optional[str] = None, records_path: Optional[str] = None) -> Dict[str, any]:
+    """
+    Reconcile the payslips of a finished batch and write the anomaly report
+
+    The parsed data comes from the batch's records file, or else from the
+    manifest; either way payslips completed by an earlier run of a resumed
+    batch are included.
+
+    Args:
+        manifest: Manifest of the batch
+        image_files: Images of the batch
+        template_path: Template whose sections are totalled
+        report_path: JSON file for the report
+        previous_records: Records file of the previous month (optional)
+        records_path: Records file the batch streamed its payslips to (optional)
+    """
+    from reconcile import RECORD_DEFAULTS, print_report, reconcile, write_report
+
+    if records_path:
+        records = read_records(records_path, RECORD_DEFAULTS)
+    else:
+        records = []
+        for image_path in image_files:
+            entry = manifest.entries.get(os.path.abspath(image_path))
+            if entry is not None and entry['status'] == 'done' and entry['data'] is not None:
+                records.append({**entry['data'], 'image': image_path})
+    previous = read_records(previous_records, RECORD_DEFAULTS) if previous_records else None
+    report = reconcile(records, previous, template_path)
+    print_report(report)
+    write_report(report, report_path)
+    return report
+
+
+def _write_consolidated_measured(results: List[Dict[str, any]], template_path: str, output_path: str,
+                                 manifest: Manifest, metrics: Optional[MetricsCollector] = None):
+    """
+    write_consolidated(), recorded as a batch step of metrics when given
+
+    Payslips that went to the UNMATCHED_SHEET are recorded as failures of
+    their images in the manifest and metrics, so that they are counted and
+    retried by --resume.
+    """
+    if metrics is None:
+        unmatched = write_consolidated(results, template_path, output_path)
+    else:
+        with metrics.measure(output_path) as record:
+            unmatched = write_consolidated(results, template_path, output_path)
+        record.pop('profile', None)
+        record['unmatched'] = len(unmatched)
+        metrics.batch_steps['consolidated_write'] = record
+
+    # The manifest holds the same data objects as the results
+    image_of = {id(entry['data']): entry['path'] for entry in manifest.entries.values() if entry['data'] is not None}
+    for data, reason in unmatched:
+        image_path = image_of.get(id(data))
+        if image_path is None:
+            continue
+        error = f"{reason}; written to the {UNMATCHED_SHEET} sheet of {output_path}"
+        manifest.record(image_path, 'failed', 0.0, error=error)
+        if metrics is not None:
+            metrics.mark_failed(image_path, error)
+    if unmatched:
+        print(f"{len(unmatched)} payslips have no row in the template; see the {UNMATCHED_SHEET} sheet")
+
+
+def write_consolidated(results: List[Dict[str, any]], template_path: str,
+                       output_path: str) -> List[Tuple[Dict[str, any], str]]:
+    """
+    Write all parsed payslips into a single workbook
+
+    The template is loaded once, each employee is written to its row (rows for
+    new employees are inserted per section in one go) and the workbook is
+    saved once at the end.
+
+    Args:
+        results: Parsed payslip data
+        template_path: Path to Excel template
+        output_path: Path for the consolidated Excel file
+
+    Returns:
+        (data, reason) of the payslips written to the UNMATCHED_SHEET
+    """
+    print(f"\n=== Writing {len(results)} employees to {output_path} ===")
+    excel_writer = ExcelWriter(template_path)
+    with stage('cell_writes'):
+        excel_writer.add_employees(results)
+    excel_writer.save(output_path)
+    excel_writer.close()
+    return excel_writer.unmatched
+
+
+def fill_from_records(records_path: str, template_path: str, output_path: str):
+    """
+    Fill the template from a records file written by a sink, in one bulk pass
+
+    Args:
+        records_path: .csv, .jsonl or .parquet file of parsed payslips
+        template_path: Path to Excel template
+        output_path: Path for the filled Excel file
+    """
+    results = list(read_records(records_path, _empty_payslip_data()))
+    print(f"Read {len(results)} records from {records_path}")
+    write_consolidated(results, template_path, output_path)
+
+
+def process_queue(queue_path: str, image_dir: Optional[str], ocr_engine: str = 'easyocr',
+                  extractor: Optional[PayslipExtractor] = None, workers: int = 1,
+                  cache_options: Optional[Dict[str, any]] = None,
+                  layout_path: Optional[str] = None,
+                  preprocess_options: Optional[Dict[str, any]] = None,
+                  reocr_threshold: Optional[float] = None,
+                  lease_seconds: Optional[float] = None,
+                  split_sheets: bool = False,
+                  retry_failed: bool = False) -> Dict[str, int]:
+    """
+    Work on a batch shared by several machines through a job queue (see jobqueue.py)
+
+    Every node runs this with the same arguments. The images of image_dir
+    are added to the queue (already queued, unchanged images are left as
+    they are), then `workers` processes on this node claim and process jobs
+    until the queue is drained, including jobs another node claimed and
+    abandoned. Parsed payslips are stored in the queue; merge_queue()
+    writes them out once every node is done.
+
+    Args:
+        queue_path: SQLite file of the queue, on storage every node reaches
+        image_dir: Directory of payslip images to add (None only works on the queue)
+        ocr_engine: OCR engine to use
+        extractor: Already loaded extractor to reuse with one worker (a new one is created if None)
+        workers: Worker processes on this node (1 processes jobs in this process)
+        cache_options: OCRCache keyword arguments for extractors created here (None disables the cache)
+        layout_path: Layout profile for extractors created here (None OCRs the full page)
+        preprocess_options: Preprocessor keyword arguments for extractors created here (None disables it)
+        reocr_threshold: For extractors created here, re-read numeric detections below this confidence
+        lease_seconds: Lease of a claimed job (None: jobqueue.DEFAULT_LEASE)
+        split_sheets: Split sheets holding several payslips into one job per payslip
+        retry_failed: Put the queue's failed jobs back to pending
+
+    Returns:
+        Jobs this node finished: {'done', 'failed', 'lost'}
+    """
+    from jobqueue import DEFAULT_LEASE, JobQueue, input_signature, print_status
+
+    lease_seconds = lease_seconds or DEFAULT_LEASE
+    jobs = JobQueue(queue_path)
+    if image_dir or retry_failed:
+        image_files = find_images(image_dir) if image_dir else []
+        if split_sheets:
+            # Only files that are new or changed since another node queued them are analysed
+            queued = jobs.sources()
+            image_files = [path for path in image_files
+                           if queued.get(os.path.abspath(split_page_ref(path)[0])) != input_signature(path)]
+            image_files = split_sheet_blocks(image_files) if image_files else []
+        counts = jobs.add(image_files, retry_failed)
+        print(f"Queue {queue_path}: {counts['added']} added, {counts['changed']} changed, "
+              f"{counts['removed']} removed, {counts['retried']} failed jobs retried")
+
+    start = time.perf_counter()
+    stats = {'done': 0, 'failed': 0, 'lost': 0, 'times': [], 'startup_time': 0.0}
+    if workers > 1:
+        from concurrent.futures import ProcessPoolExecutor, as_completed
+        from concurrent.futures.process import BrokenProcessPool
+
+        def add_stats(worker_stats):
+            for key, value in worker_stats.items():
+                stats[key] = max(stats[key], value) if key == 'startup_time' else stats[key] + value
+
+        initargs = (ocr_engine, cache_options, layout_path, preprocess_options, (False, False), reocr_threshold)
+        while True:
+            futures = []
+            try:
+                with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=initargs) as pool:
+                    futures = [pool.submit(_drain_queue_in_worker, queue_path, lease_seconds)
+                               for _ in range(workers)]
+                    for future in as_completed(futures):
+                        add_stats(future.result())
+                        futures.remove(future)
+            except BrokenProcessPool:
+                # Workers that returned before the pool broke still count;
+                # the dead worker's job comes back when its lease runs out
+                for future in futures:
+                    if future.done() and not future.cancelled() and future.exception() is None:
+                        add_stats(future.result())
+                print("A worker process died, restarting the workers")
+                continue
+            break
+    else:
+        if extractor is None:
+            extractor = make_extractor(ocr_engine, cache_options, layout_path, preprocess_options, reocr_threshold)
+        stats.update(_drain_queue(queue_path, extractor, lease_seconds))
+
+    wall_time = time.perf_counter() - start
+    print(f"\nThis node: {stats['done']} done, {stats['failed']} failed, {stats['lost']} lost to other workers "
+          f"in {wall_time:.1f}s")
+    print_timing_report(stats['startup_time'], stats['times'], wall_time=wall_time, processes=workers)
+    print_status(jobs)
+    jobs.close()
+    return {key: stats[key] for key in ('done', 'failed', 'lost')}
+
+
+def merge_queue(queue_path: str, template_path: str, consolidated_path: Optional[str] = None,
+                records_path: Optional[str] = None) -> List[Dict[str, any]]:
+    """
+    Write the payslips finished in a job queue to one workbook and/or a records file
+
+    Args:
+        queue_path: SQLite file of the queue
+        template_path: Path to Excel template
+        consolidated_path: Write every employee into this single workbook
+        records_path: Write every parsed payslip to this .csv, .jsonl or .parquet file
+
+    Returns:
+        Parsed data of every finished job
+    """
+    from jobqueue import JobQueue, print_status
+
+    jobs = JobQueue(queue_path)
+    print_status(jobs)
+    results = jobs.results()
+    unfinished = jobs.unfinished()
+    jobs.close()
+    if unfinished:
+        print(f"Warning: {unfinished} jobs are not finished yet; merging the {len(results)} done")
+
+    if records_path:
+        sink = open_sink(records_path, _empty_payslip_data())
+        for image_path, data in results:
+            sink.write(data, image_path)
+        sink.close()
+        print(f"Records written to: {records_path}")
+    if consolidated_path:
+        write_consolidated([data for _, data in results], template_path, consolidated_path)
+    return [data for _, data in results]
+
+
+def watch_folder(watch_dir: str, template_path: str, output_dir: str, extractor: PayslipExtractor,
+                 consolidated_path: Optional[str] = None, poll_interval: float = 1.0,
+                 settle_seconds: float = 2.0, queue_size: int = 16, save_every: int = 50,
+                 metrics: Optional[MetricsCollector] = None, records_path: Optional[str] = None,
+                 split_sheets: bool = False):
+    """
+    Process payslips as they arrive in a folder, until interrupted
+
+    Images are picked up once they have finished copying and go through a
+    bounded queue to the already loaded extractor. With consolidated_path,
+    employees are written to that workbook (continuing an existing one, so a
+    payslip that arrives again updates its employee's row),
+    which is saved whenever the queue runs dry; otherwise each image gets
+    its own workbook in output_dir, unless records_path streams the parsed
+    payslips to a records file instead. Progress goes to the batch manifest,
+    so a restarted watcher skips images it has already processed.
+
+    As in batch_process, every page of an arriving multi-page TIFF or PDF is
+    processed as its own input (see pages.py), and with split_sheets every
+    payslip of a sheet holding several (see sheets.py).
+
+    Args:
+        watch_dir: Folder the scans arrive in
+        template_path: Path to Excel template
+        output_dir: Directory for per-image workbooks and the manifest
+        extractor: Loaded extractor, kept warm for the whole run
+        consolidated_path: Running workbook that every employee is written to
+        poll_interval: Seconds between folder scans
+        settle_seconds: How long a file must stay unchanged before it is processed
+        queue_size: Most ready images waiting for OCR; the scanner pauses when full
+        save_every: Also save the running workbook after this many unsaved employees
+        metrics: Collects per-stage timing and memory of every image (optional)
+        records_path: Stream every parsed payslip to this .csv, .jsonl or .parquet file
+        split_sheets: Split sheets holding several payslips into one image per payslip
+    """
+    import queue
+    from collections import deque
+    import signal
+    import threading
+
+    os.makedirs(output_dir, exist_ok=True)
+    manifest = Manifest(manifest_path_for(output_dir, consolidated_path), resume=True)
+
+    writer = None
+    if consolidated_path:
+        # Keep appending to today's workbook if the watcher is restarted
+        writer = ExcelWriter(template_path, consolidated_path if os.path.exists(consolidated_path) else None)
+    unsaved = 0
+
+    sink = None
+    if records_path:
+        # The records file is rewritten, starting with what earlier runs completed
+        sink = open_sink(records_path, _empty_payslip_data())
+        for entry in manifest.entries.values():
+            if entry['status'] == 'done' and entry['data'] is not None:
+                sink.write(entry['data'], entry['path'])
+
+    def save():
+        nonlocal unsaved
+        # Write to a temporary file first so an interrupted save cannot corrupt the running output
+        tmp_path = consolidated_path + '.tmp.xlsx'
+        writer.save(tmp_path)
+        os.replace(tmp_path, consolidated_path)
+        unsaved = 0
+
+    # Let `kill` stop the watcher as cleanly as Ctrl+C
+    def on_sigterm(signum, frame):
+        raise KeyboardInterrupt
+    if threading.current_thread() is threading.main_thread():
+        signal.signal(signal.SIGTERM, on_sigterm)
+
+    ready = queue.Queue(maxsize=queue_size)
+    stop = threading.Event()
+    FolderWatcher(watch_dir, IMAGE_EXTENSIONS, settle_seconds).start(ready, stop, poll_interval)
+    print(f"Watching {watch_dir} (Ctrl+C to stop)")
+
+    processed = 0
+    # Pages and blocks of the last file that arrived
+    inputs = deque()
+    try:
+        while True:
+            if not inputs:
+                try:
+                    inputs.extend(_arrived_inputs(ready.get(timeout=poll_interval), split_sheets))
+                except queue.Empty:
+                    if unsaved:
+                        save()
+                continue
+            image_path = inputs.popleft()
+
+            # Already processed by an earlier run of the watcher
+            if (os.path.abspath(image_path) in manifest.entries
+                    and manifest.is_done(image_path, input_sha256(image_path))):
+                continue
+
+            output_path = None if consolidated_path or records_path else output_path_for(image_path, output_dir)
+            start = time.perf_counter()
+            error = None
+            with measure_image(image_path) if metrics is None else metrics.measure(image_path) as record:
+                try:
+                    data = process_payslip(image_path, template_path, output_path, extractor=extractor,
+                                           verbose=False)
+                    if writer is not None:
+                        with stage('cell_writes'):
+                            row = writer.add_employee(data)
+                        unsaved += 1
+                        if row is None:
+                            raise ValueError(f"{writer.unmatched[-1][1]}; written to the {UNMATCHED_SHEET} sheet")
+                except Exception as e:
+                    import traceback
+                    print(f"Error processing {image_path}: {e}")
+                    error = traceback.format_exc()
+                    record['error'] = f"{type(e).__name__}: {e}"
+            if metrics is not None:
+                metrics.add(record)
+            if error:
+                manifest.record(image_path, 'failed', time.perf_counter() - start, error=error)
+                continue
+
+            processed += 1
+            elapsed = time.perf_counter() - start
+            if sink is not None:
+                sink.write(data, image_path)
+            manifest.record(image_path, 'done', elapsed, output_path, data)
+            print(f"[{processed}] Done {os.path.basename(image_path)} in {elapsed:.2f}s "
+                  f"({ready.qsize() + len(inputs)} waiting)")
+            if unsaved >= save_every:
+                save()
+    except KeyboardInterrupt:
+        print("\nStopping watcher")
+    finally:
+        stop.set()
+        if unsaved:
+            save()
+        if writer is not None:
+            writer.close()
+        if sink is not None:
+            sink.close()
+        manifest.close()
+        print(f"Processed {processed} images")
+
+
+def _arrived_inputs(path: str, split_sheets: bool = False) -> List[str]:
+    """Inputs of a file that arrived in a watched folder: its pages, or the payslips of its sheets"""
+    try:
+        inputs = list(expand_pages([path]))
+    except ImportError as e:
+        # Processed as it is, so that the manifest records the failure
+        print(f"Cannot read the pages of {path}: {e}")
+        return [path]
+    if split_sheets:
+        from sheets import split_sheets as split
+
+        inputs = list(split(inputs))
+    return inputs
+
+
+# Extractor owned by a pool worker process, loaded once by _init_worker
+_worker_extractor = None
+# measure_image() settings of the worker: (track_memory, profile)
+_worker_measure = (False, False)
+
+
+def _init_worker(ocr_engine: str, cache_options: Optional[Dict[str, any]] = None,
+                 layout_path: Optional[str] = None, preprocess_options: Optional[Dict[str, any]] = None,
+                 measure_options: tuple = (False, False), reocr_threshold: Optional[float] = None):
+    """
+    Process pool initializer: load the OCR engine once per worker
+
+    Args:
+        ocr_engine: OCR engine to use
+        cache_options: OCRCache keyword arguments, or None to disable the cache
+        layout_path: Layout profile to recognise field boxes only, or None for full-page OCR
+        preprocess_options: Preprocessor keyword arguments, or None to disable preprocessing
+        measure_options: (track_memory, profile) for each image's metrics record
+        reocr_threshold: Re-read numeric detections below this confidence, or None
+    """
+    global _worker_extractor, _worker_measure
+    _worker_measure = measure_options
 
+    # Each worker should use a single core; otherwise every process starts
+    # its own torch thread pool and they fight over the CPUs
+    try:
+        import torch
+        torch.set_num_threads(1)
+    except ImportError:
+        pass
+
+    _worker_extractor = make_extractor(ocr_engine, cache_options, layout_path, preprocess_options, reocr_threshold)
+
+
+def _process_in_worker(image_path: str, template_path: str, output_path: str):
+    """
+    Process one image inside a pool worker
+
+    Errors are returned instead of raised so one bad image does not take
+    down the rest of the batch.
+
+    Returns:
+        (image_path, data or None, error traceback or None, seconds, worker startup seconds,
+        metrics record)
+    """
+    import traceback
+
+    start = time.perf_counter()
+    with measure_image(image_path, *_worker_measure) as record:
         try:
-            process_payslip(image_path, template_path, output_path, ocr_engine)
-        except Exception as e:
-            print(f"Error processing {image_path}: {e}")
-            import traceback
-            traceback.print_exc()
+            data = process_payslip(image_path, template_path, output_path,
+                                   extractor=_worker_extractor, verbose=False)
+            error = None
+        except Exception:
+            data = None
+            error = traceback.format_exc()
+    return image_path, data, error, time.perf_counter() - start, _worker_extractor.startup_time, record
+
+
+def _process_content_in_worker(image_path: str, content: bytes):
+    """
+    Extract the data of an image the pipeline has already read, inside a pool worker
+
+    The worker OCRs from memory instead of waiting on the file. Returns the
+    same tuple as _process_in_worker.
+    """
+    _worker_extractor.contents[image_path] = content
+    try:
+        return _process_in_worker(image_path, None, None)
+    finally:
+        del _worker_extractor.contents[image_path]
+
+
+def _drain_queue(queue_path: str, extractor: PayslipExtractor, lease_seconds: float,
+                 poll_interval: float = 5.0) -> Dict[str, any]:
+    """
+    Claim and process jobs of a queue until no job is pending or running
+
+    While another worker holds the last jobs, this one waits for them, so
+    that it takes over any whose lease runs out. A job in progress when the
+    worker is interrupted is put back for the others.
+
+    Returns:
+        {'done', 'failed', 'lost', 'times', 'startup_time'} of this worker
+    """
+    import socket
+    import traceback
+
+    from jobqueue import JobQueue, LeaseRenewer
+
+    worker = f"{socket.gethostname()}:{os.getpid()}"
+    jobs = JobQueue(queue_path)
+    renewer = LeaseRenewer(queue_path, worker, lease_seconds)
+    stats = {'done': 0, 'failed': 0, 'lost': 0, 'times': [], 'startup_time': extractor.startup_time}
+    try:
+        while True:
+            image_path = jobs.claim(worker, lease_seconds)
+            if image_path is None:
+                if not jobs.unfinished():
+                    break
+                time.sleep(poll_interval)
+                continue
+
+            renewer.hold(image_path)
+            start = time.perf_counter()
+            error = None
+            try:
+                data = process_payslip(image_path, None, None, extractor=extractor, verbose=False)
+            except KeyboardInterrupt:
+                jobs.release(image_path, worker)
+                raise
+            except Exception:
+                error = traceback.format_exc()
+            finally:
+                renewer.release(image_path)
+            elapsed = time.perf_counter() - start
+
+            if error:
+                kept = jobs.fail(image_path, worker, error, elapsed)
+                print(f"[{worker}] Error processing {image_path}:\n{error}")
+            else:
+                kept = jobs.complete(image_path, worker, data, elapsed)
+                print(f"[{worker}] Done {os.path.basename(image_path)} in {elapsed:.2f}s")
+            if not kept:
+                stats['lost'] += 1
+                print(f"[{worker}] Lease of {os.path.basename(image_path)} expired and was claimed again, "
+                      f"result dropped")
+            elif error:
+                stats['failed'] += 1
+            else:
+                stats['done'] += 1
+                stats['times'].append(elapsed)
+    finally:
+        renewer.close()
+        jobs.close()
+    return stats
+
+
+def _drain_queue_in_worker(queue_path: str, lease_seconds: float) -> Dict[str, any]:
+    """_drain_queue() inside a pool worker, with the extractor _init_worker loaded"""
+    return _drain_queue(queue_path, _worker_extractor, lease_seconds)
+
+
+def _run_pool(queue, template_path: str, output_dir: str, initargs: tuple, workers: int,
+              on_result, window: int) -> List[str]:
+    """
+    Feed images from queue to a fresh process pool until the queue is empty
+
+    At most `window` images are in flight at once, so if a worker process
+    dies only those images are affected; the rest stay in the queue.
+
+    Args:
+        queue: collections.deque of image paths, consumed in place
+        template_path: Path to Excel template
+        output_dir: Directory for output Excel files (None only extracts the data)
+        initargs: Arguments for _init_worker
+        workers: Number of worker processes
+        on_result: Called with each worker result tuple as it completes
+        window: Maximum number of submitted but unfinished images
+
+    Returns:
+        Images that were in flight when the pool broke (empty if it did not)
+    """
+    from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+    from concurrent.futures.process import BrokenProcessPool
+
+    in_flight = {}
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=initargs) as pool:
+        while queue or in_flight:
+            while queue and len(in_flight) < window:
+                image_path = queue.popleft()
+                output_path = output_path_for(image_path, output_dir) if output_dir else None
+                future = pool.submit(_process_in_worker, image_path, template_path, output_path)
+                in_flight[future] = image_path
+
+            finished, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in finished:
+                try:
+                    result = future.result()
+                except BrokenProcessPool:
+                    # Every unfinished future of a broken pool fails the same way
+                    return list(in_flight.values())
+                del in_flight[future]
+                on_result(result)
+
+    return []
+
+
+def _batch_process_parallel(image_files: List[str], template_path: str, output_dir: str,
+                            ocr_engine: str, workers: int,
+                            cache_options: Optional[Dict[str, any]] = None,
+                            layout_path: Optional[str] = None,
+                            preprocess_options: Optional[Dict[str, any]] = None,
+                            manifest: Optional[Manifest] = None,
+                            metrics: Optional[MetricsCollector] = None,
+                            sink: Optional[RecordSink] = None,
+                            reocr_threshold: Optional[float] = None,
+                            keep_results: bool = True) -> List[Dict[str, any]]:
+    """
+    Spread images across a process pool and collect results as they finish
+
+    Args:
+        image_files: Images to process
+        template_path: Path to Excel template
+        output_dir: Directory for output Excel files (None only extracts the data)
+        ocr_engine: OCR engine to use
+        workers: Number of worker processes
+        cache_options: OCRCache keyword arguments for each worker (None disables the cache)
+        layout_path: Layout profile for each worker (None OCRs the full page)
+        preprocess_options: Preprocessor keyword arguments for each worker (None disables it)
+        manifest: Manifest recording the outcome of each image (optional)
+        metrics: Collects the metrics record of each image (optional)
+        sink: Record sink each parsed payslip is written to as it completes (optional)
+        reocr_threshold: Each worker re-reads numeric detections below this confidence (None disables it)
+        keep_results: Collect the parsed data (False when it is only streamed to the sink)
+
+    Returns:
+        Parsed data of every successfully processed image, in completion order
+        (empty without keep_results)
+    """
+    from collections import deque
+
+    batch_start = time.perf_counter()
+    results = []
+    image_times = []
+    stats = {'done': 0, 'failed': 0, 'startup_time': 0.0}
+
+    def on_result(result):
+        image_path, data, error, elapsed, worker_startup, record = result
+        stats['done'] += 1
+        if metrics is not None and record is not None:
+            if error:
+                record['error'] = error.strip().splitlines()[-1]
+            metrics.add(record)
+        stats['startup_time'] = max(stats['startup_time'], worker_startup)
+        progress = f"[{stats['done']}/{len(image_files)}]"
+        if error:
+            stats['failed'] += 1
+            print(f"{progress} Error processing {image_path}:\n{error}")
+            if manifest is not None:
+                manifest.record(image_path, 'failed', elapsed, error=error)
+        else:
+            image_times.append(elapsed)
+            if keep_results:
+                results.append(data)
+            if sink is not None:
+                sink.write(data, image_path)
+            print(f"{progress} Done {os.path.basename(image_path)} in {elapsed:.2f}s")
+            if manifest is not None:
+                output_path = output_path_for(image_path, output_dir) if output_dir else None
+                manifest.record(image_path, 'done', elapsed, output_path, data)
+
+    measure_options = (metrics.track_memory, metrics.profile_top > 0) if metrics is not None else (False, False)
+    initargs = (ocr_engine, cache_options, layout_path, preprocess_options, measure_options, reocr_threshold)
+    queue = deque(image_files)
+    while queue:
+        suspects = _run_pool(queue, template_path, output_dir, initargs, workers,
+                             on_result, window=workers * 2)
+        if not suspects:
+            continue
+
+        # A worker died outright (e.g. out of memory or a native crash). Re-run
+        # the images that were in flight one at a time to find the culprit.
+        print(f"Worker process died, re-checking {len(suspects)} in-flight images one by one")
+        suspects = deque(suspects)
+        while suspects:
+            for image_path in _run_pool(suspects, template_path, output_dir, initargs, 1,
+                                        on_result, window=1):
+                on_result((image_path, None, "worker process died", 0.0, 0.0, None))
+
+    if stats['failed']:
+        print(f"\n{stats['failed']} of {len(image_files)} images failed")
+    print_timing_report(stats['startup_time'], image_times, wall_time=time.perf_counter() - batch_start,
+                        processes=workers)
+    if metrics is not None:
+        metrics.print_report()
+    return results
+
+
+def _batch_process_pipelined(image_files: List[str], template_path: str, output_dir: str,
+                             ocr_engine: str, workers: int,
+                             cache_options: Optional[Dict[str, any]] = None,
+                             layout_path: Optional[str] = None,
+                             preprocess_options: Optional[Dict[str, any]] = None,
+                             manifest: Optional[Manifest] = None,
+                             metrics: Optional[MetricsCollector] = None,
+                             sink: Optional[RecordSink] = None,
+                             read_threads: int = 4, queue_size: int = 16,
+                             reocr_threshold: Optional[float] = None,
+                             keep_results: bool = True) -> List[Dict[str, any]]:
+    """
+    Process images through the overlapped read -> OCR -> write pipeline (see pipeline.py)
+
+    Reader threads load the next images while the process pool OCRs and
+    parses, and a writer thread fills the per-image workbooks, the records
+    file and the manifest, so the OCR workers never wait on disk.
+
+    Args:
+        image_files: Images to process
+        template_path: Path to Excel template
+        output_dir: Directory for output Excel files (None only extracts the data)
+        ocr_engine: OCR engine to use
+        workers: Number of OCR worker processes
+        cache_options: OCRCache keyword arguments for each worker (None disables the cache)
+        layout_path: Layout profile for each worker (None OCRs the full page)
+        preprocess_options: Preprocessor keyword arguments for each worker (None disables it)
+        manifest: Manifest recording the outcome of each image (optional)
+        metrics: Collects the metrics record of each image (optional)
+        sink: Record sink each parsed payslip is written to as it completes (optional)
+        read_threads: Images read from disk in parallel
+        queue_size: Images held between stages before the earlier stage waits
+        reocr_threshold: Each worker re-reads numeric detections below this confidence (None disables it)
+        keep_results: Collect the parsed data (False when it is only streamed to the sink)
+
+    Returns:
+        Parsed data of every successfully processed image, in completion order
+        (empty without keep_results)
+    """
+    from concurrent.futures import BrokenExecutor, ProcessPoolExecutor
+
+    measure_options = (metrics.track_memory, metrics.profile_top > 0) if metrics is not None else (False, False)
+    initargs = (ocr_engine, cache_options, layout_path, preprocess_options, measure_options, reocr_threshold)
+    results = []
+    image_times = []
+    stats = {'done': 0, 'failed': 0, 'startup_time': 0.0}
+
+    def make_pool(pool_workers):
+        return ProcessPoolExecutor(max_workers=pool_workers, initializer=_init_worker, initargs=initargs)
+
+    def write(image_path, result, error):
+        # Runs in the pipeline's writer thread
+        stats['done'] += 1
+        progress = f"[{stats['done']}/{len(image_files)}]"
+        if error is not None:
+            # Raised by the pipeline itself: the image could not be read, or killed its worker
+            message = "worker process died" if isinstance(error, BrokenExecutor) else f"{type(error).__name__}: {error}"
+            result = (image_path, None, message, 0.0, 0.0, None)
+        image_path, data, error, elapsed, worker_startup, record = result
+        stats['startup_time'] = max(stats['startup_time'], worker_startup)
+
+        output_path = output_path_for(image_path, output_dir) if output_dir else None
+        if not error and output_path:
+            start = time.perf_counter()
+            with measure_image(image_path) as write_record:
+                try:
+                    write_workbook(data, template_path, output_path)
+                except Exception:
+                    import traceback
+                    error = traceback.format_exc()
+            elapsed += time.perf_counter() - start
+            if record is not None:
+                record['stages'].update(write_record['stages'])
+                record['seconds'] = round(elapsed, 4)
+        if metrics is not None and record is not None:
+            if error:
+                record['error'] = error.strip().splitlines()[-1]
+            metrics.add(record)
+
+        if error:
+            stats['failed'] += 1
+            print(f"{progress} Error processing {image_path}:\n{error}")
+            if manifest is not None:
+                manifest.record(image_path, 'failed', elapsed, error=error)
+            return
+        image_times.append(elapsed)
+        if keep_results:
+            results.append(data)
+        if sink is not None:
+            sink.write(data, image_path)
+        print(f"{progress} Done {os.path.basename(image_path)} in {elapsed:.2f}s")
+        if manifest is not None:
+            manifest.record(image_path, 'done', elapsed, output_path, data)
+
+    from pipeline import run_pipeline
+
+    pipeline_stats = run_pipeline(image_files, read_input, _process_content_in_worker, write, make_pool,
+                                  workers, read_threads=read_threads, queue_size=queue_size)
+
+    if stats['failed']:
+        print(f"\n{stats['failed']} of {len(image_files)} images failed")
+    print_timing_report(stats['startup_time'], image_times, wall_time=pipeline_stats.seconds,
+                        processes=workers)
+    pipeline_stats.print_report()
+    if metrics is not None:
+        metrics.batch_steps['pipeline'] = pipeline_stats.to_dict()
+        metrics.print_report()
+    return results
+
+
+def print_timing_report(startup_time: float, image_times: List[float], wall_time: Optional[float] = None,
+                        processes: int = 1):
+    """
+    Print startup vs per-image timing for a batch
+
+    Args:
+        startup_time: Seconds spent loading the OCR engine
+        image_times: Seconds spent on each image
+        wall_time: Elapsed time of the whole batch, for throughput (parallel runs)
+        processes: Number of processes that each loaded an engine
+    """
+    if not image_times:
+        return
+
+    total = sum(image_times)
+    print(f"\n{'='*60}")
+    print("Timing report")
+    print(f"{'='*60}")
+    print(f"  OCR engine startup (once per process): {startup_time:.2f}s")
+    print(f"  Images processed: {len(image_times)}")
+    print(f"  Per image: avg {total / len(image_times):.2f}s, "
+          f"min {min(image_times):.2f}s, max {max(image_times):.2f}s")
+    if wall_time is None:
+        print(f"  Total: {startup_time + total:.2f}s")
+    else:
+        print(f"  Wall time: {wall_time:.2f}s ({len(image_times) / wall_time:.2f} images/sec)")
+    # Every image after the first would have paid the startup cost again
+    saved_loads = max(len(image_times) - processes, 0)
+    print(f"  Startup cost avoided by reusing the engine: {startup_time * saved_loads:.2f}s")
 
 
 if __name__ == '__main__':
     import argparse
 
     parser = argparse.ArgumentParser(description='Process payslip images and fill Excel template')
-    parser.add_argument('--image', type=str, help='Single image file to process')
+    parser.add_argument('--image', type=str,
+                        help='Single image file to process (a page of a TIFF/PDF scan as FILE#page=N)')
     parser.add_argument('--batch', type=str, help='Directory of images to batch process')
+    parser.add_argument('--watch', type=str, metavar='DIR',
+                        help='Keep running and process images as they arrive in DIR')
+    parser.add_argument('--serve', action='store_true',
+                        help='Keep running with a warm OCR engine and process images submitted over '
+                             'localhost HTTP (see --service)')
+    parser.add_argument('--port', type=int, default=8765, help='Local port of the --serve service')
+    parser.add_argument('--service', type=str, nargs='?', const='http://127.0.0.1:8765', metavar='URL',
+                        help='Hand --image to a running --serve service instead of loading the OCR engine')
     parser.add_argument('--template', type=str, default='SA - Empty.xlsx', help='Excel template file')
     parser.add_argument('--output', type=str, help='Output file/directory')
-    parser.add_argument('--ocr', type=str, choices=['easyocr', 'tesseract'], default='easyocr',
-                        help='OCR engine to use')
+    parser.add_argument('--ocr', type=str, choices=['easyocr', 'tesseract', 'cascade'], default='easyocr',
+                        help='OCR engine to use; cascade tries Tesseract first and re-runs with EasyOCR '
+                             'when the figures do not add up')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='Worker processes for --batch (each loads its own OCR engine)')
+    parser.add_argument('--pipeline', action='store_true',
+                        help='In --batch, overlap image reads, OCR (in --workers processes) and output writes')
+    parser.add_argument('--read-threads', type=int, default=4,
+                        help='Threads reading images ahead of OCR in --pipeline mode')
+    parser.add_argument('--ocr-batch-size', type=int, default=1, metavar='N',
+                        help='OCR N images per engine call in a single-process --batch (default 1: one at a time)')
+    parser.add_argument('--reocr-below', type=float, metavar='CONFIDENCE',
+                        help='Re-read numeric EasyOCR detections below this confidence (0-1) from an upscaled crop')
+    parser.add_argument('--cache-dir', type=str, default='.ocr_cache',
+                        help='Directory of the OCR result cache')
+    parser.add_argument('--cache-size-mb', type=float, default=1024,
+                        help='OCR cache size cap; least recently used results are evicted')
+    parser.add_argument('--no-cache', action='store_true', help='Always run OCR, ignoring the cache')
+    parser.add_argument('--consolidate', type=str, metavar='FILE',
+                        help='Write all employees of a --batch run into this single workbook')
+    parser.add_argument('--records', type=str, metavar='FILE',
+                        help='Stream parsed payslips to a .csv, .jsonl or .parquet file instead of per-image workbooks')
+    parser.add_argument('--fill-from', type=str, metavar='RECORDS',
+                        help='Fill the template from a --records file into --consolidate (or --output) and exit')
+    parser.add_argument('--reconcile', type=str, metavar='FILE',
+                        help='After a --batch, cross-check all payslips and write the anomaly report to FILE')
+    parser.add_argument('--previous', type=str, metavar='RECORDS',
+                        help="Records file of the previous month, for --reconcile")
+    parser.add_argument('--poll-interval', type=float, default=1.0,
+                        help='Seconds between folder scans in --watch mode')
+    parser.add_argument('--settle-seconds', type=float, default=2.0,
+                        help='In --watch mode, wait until a file is unchanged this long before processing it')
+    parser.add_argument('--queue-size', type=int, default=16,
+                        help='Most images waiting for OCR before scanning (--watch) or reading (--pipeline) pauses')
+    parser.add_argument('--resume', action='store_true',
+                        help='Skip images the batch manifest records as done; retry failed or changed ones')
+    parser.add_argument('--dedup', action='store_true',
+                        help='In --batch mode, skip exact copies of the same file before OCR')
+    parser.add_argument('--dedup-distance', type=int, metavar='BITS',
+                        help='With --dedup, also group photos within this perceptual hash distance of each '
+                             'other and process only the best-quality one (default: 0, exact copies only)')
+    parser.add_argument('--split-sheets', action='store_true',
+                        help='In --batch and --watch mode, split sheets holding several payslips and process '
+                             'each payslip')
+    parser.add_argument('--queue', type=str, metavar='FILE',
+                        help='Shared SQLite job queue: with --batch, add the images and work until the queue is '
+                             'drained (run on every node); alone, only work; with --merge, write the results')
+    parser.add_argument('--merge', action='store_true',
+                        help='Write the payslips finished in --queue to --consolidate and/or --records and exit')
+    parser.add_argument('--lease', type=float, metavar='SECONDS',
+                        help='Seconds a --queue job stays claimed without renewal before others take it over '
+                             '(default: 300)')
+    parser.add_argument('--metrics', type=str, metavar='FILE',
+                        help='Write per-image stage timings, peak memory and p50/p95/max to this JSON file')
+    parser.add_argument('--profile', type=int, nargs='?', const=3, default=0, metavar='N',
+                        help='cProfile every image and dump the stats of the N slowest (default 3)')
+    parser.add_argument('--layout', type=str, metavar='FILE',
+                        help='Layout profile: OCR only its field boxes instead of the whole page')
+    parser.add_argument('--calibrate-layout', type=str, metavar='IMAGE',
+                        help='Build the --layout profile from this sample payslip and exit')
+    parser.add_argument('--exif-rotate', action='store_true', help='Preprocess: apply the EXIF orientation')
+    parser.add_argument('--autocrop', action='store_true', help='Preprocess: crop the photo to the paper')
+    parser.add_argument('--grayscale', action='store_true', help='Preprocess: convert to grayscale')
+    parser.add_argument('--max-side', type=int, metavar='PIXELS',
+                        help='Preprocess: downscale so the longer side is at most PIXELS')
+    parser.add_argument('--target-dpi', type=int, metavar='DPI',
+                        help='Preprocess: downscale to DPI, assuming the image spans the paper (see --paper)')
+    parser.add_argument('--paper', type=str, choices=['a4', 'a5', 'letter'], default='a4',
+                        help='Paper size for --target-dpi')
+    parser.add_argument('--deskew', action='store_true', help='Preprocess: straighten tilted text lines')
+    parser.add_argument('--binarize', action='store_true', help='Preprocess: convert to black and white')
 
     args = parser.parse_args()
 
+    if args.image:
+        image_output = args.output or output_path_for(args.image, os.path.dirname(args.image))
+
+    if args.image and args.service:
+        # The service already has the engine loaded: nothing heavy is imported here
+        from service import submit
+        try:
+            result = submit(args.image, image_output, args.template, args.service)
+        except ConnectionError as e:
+            print(f"{e}; processing locally")
+        except RuntimeError as e:
+            print(f"Error: {e}")
+            raise SystemExit(1)
+        else:
+            print(f"Processed {args.image} by the service in {result['seconds']:.2f}s")
+            print(f"Saved to: {result['output']}")
+            raise SystemExit(0)
+
+    # One warm engine shared by everything this invocation processes.
+    # Parallel batches load one per worker process instead.
+    cache_options = None
+    if not args.no_cache:
+        cache_options = {'cache_dir': args.cache_dir, 'max_size_mb': args.cache_size_mb}
+
+    preprocess_options = None
+    if (args.exif_rotate or args.autocrop or args.grayscale or args.max_side or args.target_dpi
+            or args.deskew or args.binarize):
+        preprocess_options = {
+            'exif_rotate': args.exif_rotate, 'autocrop': args.autocrop, 'grayscale': args.grayscale,
+            'max_side': args.max_side, 'target_dpi': args.target_dpi, 'paper': args.paper,
+            'deskew': args.deskew, 'binarize': args.binarize,
+        }
+
+    if args.calibrate_layout:
+        # Full-page OCR of the sample gives the position of every label and value.
+        # Field boxes are relative to the preprocessed image, so calibrate on that.
+        extractor = make_extractor('easyocr', cache_options, preprocess_options=preprocess_options)
+        detections = extractor.extract_detections(args.calibrate_layout)
+        width, height = extractor.load_image(args.calibrate_layout).size
+        profile = calibrate_layout(detections, width, height, source=args.calibrate_layout)
+        profile.save(args.layout or 'layout_profile.json')
+        raise SystemExit(0)
+
+    if args.fill_from:
+        # No OCR needed: the records were parsed by an earlier run
+        fill_from_records(args.fill_from, args.template, args.consolidate or args.output or 'output.xlsx')
+        raise SystemExit(0)
+
+    if args.merge:
+        if not args.queue:
+            parser.error('--merge needs --queue')
+        merge_queue(args.queue, args.template, args.consolidate or (None if args.records else 'output.xlsx'),
+                    args.records)
+        raise SystemExit(0)
+
+    extractor = None
+    if not ((args.batch or args.queue) and (args.workers > 1 or args.pipeline)):
+        extractor = make_extractor(args.ocr, cache_options, args.layout, preprocess_options, args.reocr_below)
+
+    metrics = None
+    if args.metrics or args.profile:
+        metrics = MetricsCollector(track_memory=bool(args.metrics), profile_top=args.profile)
+
     if args.image:
         # Process single image
-        output = args.output or args.image.replace('.jpg', '_output.xlsx').replace('.png', '_output.xlsx')
-        process_payslip(args.image, args.template, output, args.ocr)
+        if metrics is None:
+            process_payslip(args.image, args.template, image_output, args.ocr, extractor=extractor)
+        else:
+            with metrics.measure(args.image) as record:
+                process_payslip(args.image, args.template, image_output, args.ocr, extractor=extractor)
+            metrics.add(record)
+
+    elif args.serve:
+        from service import serve
+        serve(extractor, args.template, args.port)
+
+    elif args.watch:
+        watch_folder(args.watch, args.template, args.output or 'output', extractor,
+                     consolidated_path=args.consolidate, poll_interval=args.poll_interval,
+                     settle_seconds=args.settle_seconds, queue_size=args.queue_size, metrics=metrics,
+                     records_path=args.records, split_sheets=args.split_sheets)
+
+    elif args.queue:
+        # One node of a batch shared through the queue; --merge writes the output
+        if args.dedup or args.pipeline or args.consolidate or args.records:
+            print("Note: with --queue, --dedup and --pipeline do not apply and the output is written by --merge")
+        process_queue(args.queue, args.batch, args.ocr, extractor=extractor, workers=args.workers,
+                      cache_options=cache_options, layout_path=args.layout,
+                      preprocess_options=preprocess_options, reocr_threshold=args.reocr_below,
+                      lease_seconds=args.lease, split_sheets=args.split_sheets, retry_failed=args.resume)
 
     elif args.batch:
         # Batch process
         output_dir = args.output or 'output'
-        batch_process(args.batch, args.template, output_dir, args.ocr)
+        batch_process(args.batch, args.template, output_dir, args.ocr, extractor=extractor,
+                      workers=args.workers, cache_options=cache_options,
+                      consolidated_path=args.consolidate, layout_path=args.layout,
+                      preprocess_options=preprocess_options, resume=args.resume, metrics=metrics,
+                      records_path=args.records, ocr_batch_size=args.ocr_batch_size,
+                      pipeline=args.pipeline, read_threads=args.read_threads, queue_size=args.queue_size,
+                      reocr_threshold=args.reocr_below, reconcile_path=args.reconcile,
+                      previous_records=args.previous, dedup=args.dedup, dedup_distance=args.dedup_distance,
+                      split_sheets=args.split_sheets)
 
     else:
         # Default: process the test image
@@ -381,5 +2515,13 @@ if __name__ == '__main__':
             'Image_20251027112221_133_4.jpg',
             'SA - Empty.xlsx',
             'output_test.xlsx',
-            args.ocr
+            args.ocr,
+            extractor=extractor
         )
+
+    if metrics is not None:
+        if args.metrics:
+            metrics.write(args.metrics)
+        if args.profile:
+            profile_dir = os.path.splitext(args.metrics)[0] + '_profiles' if args.metrics else 'profiles'
+            metrics.write_profiles(profile_dir)
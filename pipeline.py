@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+"""
+Overlapped read -> OCR -> write pipeline driven by asyncio
+
+Processing an image one step after the other leaves the CPU idle while
+the next image is read from disk (often a network share) and while the
+previous result is written out. Here each step is its own stage, joined
+to the next by a bounded asyncio queue:
+
+    read    thread pool: loads the file content ahead of the OCR workers
+    ocr     process pool: OCR and parsing, fed from memory
+    write   one thread: workbooks, records and manifest, in completion order
+
+Because the queues are bounded, a slow stage holds the ones before it back
+instead of letting images pile up in memory. The event loop only moves
+items between the pools; none of the work runs on it.
+"""
+
+import asyncio
+import time
+from concurrent.futures import BrokenExecutor, Executor, ThreadPoolExecutor
+from typing import Callable, Dict, Iterable
+
+# Marks the end of a queue
+_DONE = object()
+
+
+class PipelineStats:
+    """Where the pipeline waited, to tell which stage limits throughput"""
+
+    def __init__(self):
+        self.items = 0
+        self.seconds = 0.0
+        # OCR slots waiting for the read stage (reading is the bottleneck)
+        self.ocr_starved = 0.0
+        # OCR slots waiting for room in the write queue (writing is the bottleneck)
+        self.write_blocked = 0.0
+        self.pool_restarts = 0
+
+    def to_dict(self) -> Dict[str, any]:
+        return {
+            'items': self.items,
+            'seconds': round(self.seconds, 4),
+            'ocr_starved_seconds': round(self.ocr_starved, 4),
+            'write_blocked_seconds': round(self.write_blocked, 4),
+            'pool_restarts': self.pool_restarts,
+        }
+
+    def print_report(self):
+        print(f"  Pipeline: OCR waited {self.ocr_starved:.2f}s for reads, "
+              f"{self.write_blocked:.2f}s for writes")
+        if self.pool_restarts:
+            print(f"  Pipeline: OCR pool restarted {self.pool_restarts} times after a worker died")
+
+
+async def _run(items: Iterable, read: Callable, process: Callable, write: Callable,
+               make_executor: Callable[[int], Executor], workers: int, slots: int, read_threads: int,
+               queue_size: int, stats: PipelineStats):
+    loop = asyncio.get_running_loop()
+    read_pool = ThreadPoolExecutor(max_workers=read_threads, thread_name_prefix='pipeline-read')
+    write_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix='pipeline-write')
+    pool = {'executor': make_executor(workers), 'isolation': None}
+    isolation_lock = asyncio.Lock()
+    todo = iter(items)
+    read_queue = asyncio.Queue(maxsize=queue_size)
+    write_queue = asyncio.Queue(maxsize=queue_size)
+
+    async def reader():
+        # Readers share one iterator, so each item is read exactly once
+        for item in todo:
+            try:
+                payload = await loop.run_in_executor(read_pool, read, item)
+                await read_queue.put((item, payload, None))
+            except Exception as e:
+                await read_queue.put((item, None, e))
+
+    async def isolated(item, payload):
+        # Items in flight when a worker died are re-run one at a time in a
+        # single-worker pool, so only the item that kills its worker fails
+        async with isolation_lock:
+            if pool['isolation'] is None:
+                pool['isolation'] = make_executor(1)
+            try:
+                return await loop.run_in_executor(pool['isolation'], process, item, payload), None
+            except BrokenExecutor as e:
+                pool['isolation'].shutdown(wait=False)
+                pool['isolation'] = None
+                return None, e
+            except Exception as e:
+                return None, e
+
+    async def ocr():
+        while True:
+            waited = time.perf_counter()
+            entry = await read_queue.get()
+            stats.ocr_starved += time.perf_counter() - waited
+            if entry is _DONE:
+                return
+            item, payload, error = entry
+            result = None
+            if error is None:
+                executor = pool['executor']
+                try:
+                    result = await loop.run_in_executor(executor, process, item, payload)
+                except BrokenExecutor:
+                    # A worker died: a fresh pool takes the next items and this one is re-checked
+                    if pool['executor'] is executor:
+                        executor.shutdown(wait=False)
+                        pool['executor'] = make_executor(workers)
+                        stats.pool_restarts += 1
+                    result, error = await isolated(item, payload)
+                except Exception as e:
+                    error = e
+            waited = time.perf_counter()
+            await write_queue.put((item, result, error))
+            stats.write_blocked += time.perf_counter() - waited
+
+    async def writer():
+        while True:
+            entry = await write_queue.get()
+            if entry is _DONE:
+                return
+            try:
+                await loop.run_in_executor(write_pool, write, *entry)
+            except Exception as e:
+                # The OCR stage would block on a full queue if the writer stopped
+                print(f"Error writing {entry[0]}: {e}")
+            stats.items += 1
+
+    start = time.perf_counter()
+    try:
+        write_task = asyncio.ensure_future(writer())
+        ocr_tasks = [asyncio.ensure_future(ocr()) for _ in range(slots)]
+        await asyncio.gather(*(reader() for _ in range(read_threads)))
+        for _ in ocr_tasks:
+            await read_queue.put(_DONE)
+        await asyncio.gather(*ocr_tasks)
+        await write_queue.put(_DONE)
+        await write_task
+    finally:
+        stats.seconds = time.perf_counter() - start
+        pool['executor'].shutdown()
+        if pool['isolation'] is not None:
+            pool['isolation'].shutdown()
+        read_pool.shutdown()
+        write_pool.shutdown()
+
+
+def run_pipeline(items: Iterable, read: Callable, process: Callable, write: Callable,
+                 make_executor: Callable[[int], Executor], workers: int, read_threads: int = 4,
+                 queue_size: int = 16) -> PipelineStats:
+    """
+    Run every item through read, process and write with the stages overlapped
+
+    Args:
+        items: Work items (image paths), in the order they should be read
+        read: read(item) -> payload, run in a thread (I/O bound)
+        process: process(item, payload) -> result, run in the executor; must be
+            picklable for a process pool
+        write: write(item, result, error) in a single thread, in completion
+            order. error is the exception raised by read or process (result is
+            then None), or None.
+        make_executor: make_executor(workers) creates the executor for process.
+            If a worker dies, a new one replaces it and the items that were in
+            flight are re-run one at a time, so only the culprit fails.
+        workers: Worker count of the executor; twice as many items are in
+            flight, so a worker finds its next item ready
+        read_threads: Files read in parallel
+        queue_size: Items held between stages before the earlier stage waits
+
+    Returns:
+        Waiting times of the run
+    """
+    stats = PipelineStats()
+    asyncio.run(_run(items, read, process, write, make_executor, workers, workers * 2, read_threads,
+                     queue_size, stats))
+    return stats
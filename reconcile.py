@@ -0,0 +1,309 @@
+#!/usr/bin/env python3
+"""
+Cross-employee reconciliation of a batch of parsed payslips
+
+    python3 reconcile.py records.jsonl --previous last_month.jsonl --report anomalies.json
+
+validation.py checks one payslip at a time while it is being extracted.
+This module checks a whole batch afterwards. The records are loaded once
+into NumPy columns, and every check runs on whole columns, so tens of
+thousands of payslips take well under a second:
+
+    arithmetic        gross and nett identities, rate x hours of every overtime line
+    statutory ratio   EPF/SOCSO/EIS contributions against gross, outside RATIO_BANDS
+    batch outlier     gross, nett and basic pay far from the rest of the employee's section
+    previous month    basic, gross and nett changed by more than PREVIOUS_MONTH_CHANGE
+    duplicate         the same staff code on more than one payslip
+
+It also totals each template section, which is what the section's
+subtotal row should add up to.
+"""
+
+import json
+from typing import Dict, Iterable, List, Optional
+
+import numpy as np
+
+from sheet_index import code_prefix
+from sinks import read_records
+from validation import TOLERANCE
+
+
+# Numeric columns loaded from the records
+NUMERIC_FIELDS = [
+    'basic_pay', 'director_fee', 'overtime_total', 'allowance_total', 'monthly_gross', 'deduction',
+    'epf_employee', 'socso_employee', 'eis_employee', 'nett_pay',
+    'epf_employer', 'socso_employer', 'eis_employer',
+]
+
+# Records file columns converted back from CSV text
+RECORD_DEFAULTS = {**{field: 0.0 for field in NUMERIC_FIELDS}, 'overtime': [], 'allowances': {}}
+
+# Contribution / gross ratios considered normal: 0 (not covered) or inside one of the bands.
+# EPF: 2% foreign workers, 5.5% (employee) at 60+, 9-11% employee and 12-13% employer.
+# SOCSO and EIS go by wage brackets, so their bands are wider than the nominal rates.
+RATIO_BANDS = {
+    'epf_employee': [(0.015, 0.025), (0.05, 0.06), (0.08, 0.115)],
+    'epf_employer': [(0.015, 0.025), (0.035, 0.07), (0.115, 0.135)],
+    'socso_employee': [(0.004, 0.0065)],
+    'socso_employer': [(0.011, 0.0195)],
+    'eis_employee': [(0.0015, 0.0026)],
+    'eis_employer': [(0.0015, 0.0026)],
+}
+
+# SOCSO and EIS are charged on wages up to this ceiling (RM)
+WAGE_CEILING = 6000.0
+
+# Columns compared with the rest of the section. A value is an outlier when its
+# robust z-score is above OUTLIER_Z and it is also more than OUTLIER_RATIO times
+# above or below the section median (sections mix pay grades and overtime, so
+# z alone flags whole grades; a misread digit is off by far more).
+OUTLIER_FIELDS = ['basic_pay', 'monthly_gross', 'nett_pay']
+OUTLIER_Z = 3.5
+OUTLIER_RATIO = 2.0
+# Sections smaller than this are not checked for outliers
+OUTLIER_MIN_GROUP = 5
+
+# Largest relative change from the previous month before it is flagged
+PREVIOUS_MONTH_CHANGE = {'basic_pay': 0.10, 'monthly_gross': 0.50, 'nett_pay': 0.50}
+
+# Columns totalled per template section
+TOTAL_FIELDS = [
+    'basic_pay', 'overtime_total', 'allowance_total', 'monthly_gross', 'deduction',
+    'epf_employer', 'epf_employee', 'socso_employer', 'socso_employee', 'eis_employer', 'eis_employee',
+    'nett_pay',
+]
+
+
+class RecordArrays:
+    """Parsed payslips as NumPy columns, one row per payslip"""
+
+    def __init__(self, records: Iterable[Dict[str, any]]):
+        """
+        Load the records in a single pass
+
+        Overtime and allowance totals come from the summary line when the
+        record has them, otherwise from the overtime lines and allowances
+        (records files written before the totals were stored read them back
+        as 0).
+
+        Args:
+            records: Parsed payslips (from a batch or read_records)
+        """
+        records = list(records)
+        self.count = len(records)
+        self.images = [record.get('image') for record in records]
+        self.codes = np.array([(record.get('employee_no') or '').strip().upper() for record in records],
+                              dtype=str)
+
+        self.columns: Dict[str, np.ndarray] = {}
+        for field in NUMERIC_FIELDS:
+            self.columns[field] = np.fromiter((record.get(field) or 0.0 for record in records),
+                                              dtype=float, count=self.count)
+
+        # Overtime lines of every payslip, flattened; owner is the payslip's row
+        overtime = [record.get('overtime') or [] for record in records]
+        self.ot_owner = np.repeat(np.arange(self.count), [len(entries) for entries in overtime])
+        self.ot_rate = np.array([entry['rate'] for entries in overtime for entry in entries], dtype=float)
+        self.ot_hours = np.array([entry['hours'] for entries in overtime for entry in entries], dtype=float)
+        self.ot_amount = np.array([entry['amount'] for entries in overtime for entry in entries], dtype=float)
+
+        # Totals missing from the record are summed from the details
+        summed = np.bincount(self.ot_owner, weights=self.ot_amount, minlength=self.count)
+        missing = self.columns['overtime_total'] == 0
+        self.columns['overtime_total'] = np.where(missing, summed, self.columns['overtime_total'])
+        summed = np.fromiter((sum((record.get('allowances') or {}).values()) for record in records),
+                             dtype=float, count=self.count)
+        missing = self.columns['allowance_total'] == 0
+        self.columns['allowance_total'] = np.where(missing, summed, self.columns['allowance_total'])
+
+    def __getitem__(self, field: str) -> np.ndarray:
+        return self.columns[field]
+
+
+def _robust_z(values: np.ndarray) -> np.ndarray:
+    """|value - median| in units of the (scaled) median absolute deviation"""
+    median = np.median(values)
+    deviation = np.abs(values - median)
+    scale = 1.4826 * np.median(deviation)
+    if scale == 0:
+        # Most values identical: fall back to the mean absolute deviation
+        scale = 1.2533 * deviation.mean()
+    if scale == 0:
+        return np.zeros_like(values)
+    return deviation / scale
+
+
+def section_names(codes: np.ndarray, template_path: Optional[str] = None) -> List[str]:
+    """
+    Template section of each staff code
+
+    The first section listing a code prefix receives it, as when the
+    template is filled. Without a template the prefix itself is the section.
+    """
+    prefixes = [code_prefix(code) for code in codes]
+    if template_path is None:
+        return [prefix or '(no code)' for prefix in prefixes]
+
+    from template_schema import load_template_schema
+
+    by_prefix = {}
+    for section in load_template_schema(template_path).sections:
+        for prefix in section['prefixes']:
+            by_prefix.setdefault(prefix, section['name'] or '(untitled)')
+    return [by_prefix.get(prefix, '(no section)') for prefix in prefixes]
+
+
+def reconcile(records: Iterable[Dict[str, any]], previous: Optional[Iterable[Dict[str, any]]] = None,
+              template_path: Optional[str] = None, tolerance: float = TOLERANCE) -> Dict[str, any]:
+    """
+    Check a batch of payslips against each other and the previous month
+
+    Args:
+        records: Parsed payslips of the batch
+        previous: Parsed payslips of the previous month (optional)
+        template_path: Template whose sections to total (None: group by code prefix)
+        tolerance: Largest difference taken as rounding in the arithmetic checks
+
+    Returns:
+        JSON-serialisable report: 'records', 'counts' per check, 'anomalies'
+        (image, employee_no, check, detail) and 'section_totals'
+    """
+    batch = RecordArrays(records)
+    anomalies = []
+
+    def flag(mask: np.ndarray, check: str, detail):
+        # Only the flagged rows are visited in Python
+        for row in np.flatnonzero(mask):
+            anomalies.append({'image': batch.images[row], 'employee_no': str(batch.codes[row]),
+                              'check': check, 'detail': detail(row)})
+
+    basic, gross, nett = batch['basic_pay'], batch['monthly_gross'], batch['nett_pay']
+
+    # Arithmetic
+    earnings = basic + batch['director_fee'] + batch['overtime_total'] + batch['allowance_total']
+    has_gross = (basic > 0) & (gross > 0)
+    flag(has_gross & (np.abs(earnings - gross) > tolerance), 'gross',
+         lambda row: f"earnings add up to {earnings[row]:.2f}, gross is {gross[row]:.2f}")
+    payable = gross - batch['deduction'] - batch['epf_employee'] - batch['socso_employee'] - batch['eis_employee']
+    flag((gross > 0) & (nett > 0) & (np.abs(payable - nett) > tolerance), 'nett',
+         lambda row: f"gross less deductions is {payable[row]:.2f}, nett is {nett[row]:.2f}")
+    flag((gross > 0) & (nett == 0), 'nett', lambda row: "nett pay missing")
+
+    if len(batch.ot_owner):
+        expected = batch.ot_rate * batch.ot_hours
+        wrong = np.abs(expected - batch.ot_amount) > tolerance
+        wrong_rows = np.zeros(batch.count, dtype=bool)
+        wrong_rows[batch.ot_owner[wrong]] = True
+        flag(wrong_rows, 'overtime', lambda row: "rate x hours does not match the amount of an overtime line")
+
+    # Statutory contribution ratios
+    for field, bands in RATIO_BANDS.items():
+        contribution = batch[field]
+        base = np.minimum(gross, WAGE_CEILING) if field.startswith(('socso', 'eis')) else gross
+        ratio = np.divide(contribution, base, out=np.zeros_like(contribution), where=base > 0)
+        in_band = ratio == 0
+        for low, high in bands:
+            in_band |= (ratio >= low) & (ratio <= high)
+        flag((base > 0) & ~in_band, 'ratio',
+             lambda row, field=field, ratio=ratio: f"{field} is {100 * ratio[row]:.2f}% of gross")
+
+    # Outliers within each section
+    sections = np.array(section_names(batch.codes, template_path), dtype=str)
+    names, group = np.unique(sections, return_inverse=True)
+    for index in range(len(names)):
+        members = np.flatnonzero(group == index)
+        if len(members) < OUTLIER_MIN_GROUP:
+            continue
+        for field in OUTLIER_FIELDS:
+            values = batch[field][members]
+            median = np.median(values)
+            far = (values > median * OUTLIER_RATIO) | (values < median / OUTLIER_RATIO)
+            outlier = np.zeros(batch.count, dtype=bool)
+            outlier[members[(_robust_z(values) > OUTLIER_Z) & far]] = True
+            flag(outlier, 'outlier',
+                 lambda row, field=field, median=median:
+                 f"{field} {batch[field][row]:.2f} vs section median {median:.2f}")
+
+    # Previous month, matched by staff code
+    if previous is not None:
+        last = RecordArrays(previous)
+        known = np.flatnonzero(last.codes != '')
+        order = known[np.argsort(last.codes[known], kind='stable')]
+        ordered = last.codes[order]
+        if len(ordered):
+            position = np.minimum(np.searchsorted(ordered, batch.codes), len(ordered) - 1)
+            matched = (batch.codes != '') & (ordered[position] == batch.codes)
+            source = order[position]
+            for field, limit in PREVIOUS_MONTH_CHANGE.items():
+                before = last[field][source]
+                after = batch[field]
+                change = np.divide(after - before, before, out=np.zeros_like(after), where=before > 0)
+                flag(matched & (before > 0) & (np.abs(change) > limit), 'previous_month',
+                     lambda row, field=field, before=before, change=change:
+                     f"{field} {batch[field][row]:.2f} vs {before[row]:.2f} last month ({100 * change[row]:+.0f}%)")
+
+    # The same employee on several payslips
+    unique, inverse, counts = np.unique(batch.codes, return_inverse=True, return_counts=True)
+    repeated = (counts[inverse] > 1) & (batch.codes != '')
+    flag(repeated, 'duplicate', lambda row: f"{counts[inverse[row]]} payslips with this staff code")
+
+    # Section totals: what each section's subtotal row should show
+    employees = np.bincount(group, minlength=len(names))
+    section_totals = {}
+    sums = {field: np.bincount(group, weights=batch[field], minlength=len(names)) for field in TOTAL_FIELDS}
+    for index, name in enumerate(names):
+        totals = {field: round(float(sums[field][index]), 2) for field in TOTAL_FIELDS}
+        section_totals[str(name)] = {'employees': int(employees[index]), **totals}
+
+    counts_by_check = {}
+    for anomaly in anomalies:
+        counts_by_check[anomaly['check']] = counts_by_check.get(anomaly['check'], 0) + 1
+    return {
+        'records': batch.count,
+        'counts': counts_by_check,
+        'anomalies': anomalies,
+        'section_totals': section_totals,
+    }
+
+
+def print_report(report: Dict[str, any], limit: int = 20):
+    """Print the anomaly counts, the first `limit` anomalies and the section totals"""
+    print(f"\n=== Reconciliation of {report['records']} payslips ===")
+    if not report['anomalies']:
+        print("  No anomalies")
+    for check, count in sorted(report['counts'].items()):
+        print(f"  {check}: {count}")
+    for anomaly in report['anomalies'][:limit]:
+        print(f"    {anomaly['employee_no'] or '?'} ({anomaly['image']}): {anomaly['check']} - {anomaly['detail']}")
+    if len(report['anomalies']) > limit:
+        print(f"    ... {len(report['anomalies']) - limit} more in the report file")
+
+    print("  Section totals (employees / basic / gross / nett):")
+    for name, totals in report['section_totals'].items():
+        print(f"    {name}: {totals['employees']} / {totals['basic_pay']:.2f} / "
+              f"{totals['monthly_gross']:.2f} / {totals['nett_pay']:.2f}")
+
+
+def write_report(report: Dict[str, any], path: str):
+    """Write the report as JSON"""
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+    print(f"Reconciliation report written to: {path}")
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Reconcile a records file of parsed payslips')
+    parser.add_argument('records', help='.csv, .jsonl or .parquet records file (see --records)')
+    parser.add_argument('--previous', metavar='RECORDS', help="Records file of the previous month")
+    parser.add_argument('--template', type=str, help='Excel template whose sections to total')
+    parser.add_argument('--report', type=str, metavar='FILE', help='Write the full report to this JSON file')
+    args = parser.parse_args()
+
+    previous = read_records(args.previous, RECORD_DEFAULTS) if args.previous else None
+    report = reconcile(read_records(args.records, RECORD_DEFAULTS), previous, args.template)
+    print_report(report)
+    if args.report:
+        write_report(report, args.report)
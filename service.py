@@ -0,0 +1,217 @@
+#!/usr/bin/env python3
+"""
+Resident payslip service: a warm extractor answering submissions over localhost HTTP
+
+    python3 payslip_processor.py --serve --port 8765
+    python3 payslip_processor.py --image payslip.jpg --service http://127.0.0.1:8765
+
+Importing EasyOCR (torch) and loading its models takes far longer than
+processing one payslip, and a tool that runs the CLI once per upload pays
+it on every call. The service loads the extractor once and keeps it; a
+CLI call with --service only imports the standard library, hands the
+image over and waits for the result.
+
+    POST /process   {"image": path, "output": path or null, "template": path or null}
+                    -> {"data": parsed payslip, "output": path or null, "seconds": ...}
+    GET  /health    -> {"status": "ok", "engine": ..., "queued": ..., "processed": ..., "failed": ...}
+
+Paths are opened by the service, so the client and the service share the
+file system; the service only listens on 127.0.0.1. Requests are accepted
+by server threads and queued; the main thread, which loaded the extractor
+(and opened its OCR cache), processes them one at a time.
+"""
+
+import json
+import os
+import queue
+import threading
+import time
+import traceback
+import urllib.error
+import urllib.request
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Optional
+
+from pages import split_page_ref
+
+
+DEFAULT_PORT = 8765
+DEFAULT_URL = f'http://127.0.0.1:{DEFAULT_PORT}'
+
+
+class PayslipService:
+    """Processes submitted images in order with one long-lived extractor"""
+
+    def __init__(self, extractor, template_path: str):
+        """
+        Args:
+            extractor: Loaded PayslipExtractor to reuse for every request
+            template_path: Template for requests that do not name one
+        """
+        self.extractor = extractor
+        self.template_path = os.path.abspath(template_path)
+        # (request, Future) waiting for the main thread
+        self.jobs = queue.Queue()
+        self.started = time.time()
+        self.processed = 0
+        self.failed = 0
+
+    def health(self) -> Dict[str, any]:
+        return {
+            'status': 'ok',
+            'engine': self.extractor.ocr_engine,
+            'startup_time': round(self.extractor.startup_time, 3),
+            'uptime': round(time.time() - self.started, 1),
+            'queued': self.jobs.qsize(),
+            'processed': self.processed,
+            'failed': self.failed,
+        }
+
+    def submit(self, request: Dict[str, any]) -> Dict[str, any]:
+        """
+        Queue a submission and wait for its result (called by server threads)
+
+        Raises:
+            ValueError: The request does not name an existing image
+            RuntimeError: The image could not be processed
+        """
+        image_path = request.get('image')
+        if not image_path or not os.path.isfile(split_page_ref(image_path)[0]):
+            raise ValueError(f"image not found: {image_path}")
+        future = Future()
+        self.jobs.put((request, future))
+        return future.result()
+
+    def run_next(self, timeout: float = 0.5):
+        """Process the next queued submission, if one arrives within timeout (called by the main thread)"""
+        from payslip_processor import process_payslip
+
+        try:
+            request, future = self.jobs.get(timeout=timeout)
+        except queue.Empty:
+            return
+        image_path = request['image']
+        output_path = request.get('output')
+        start = time.perf_counter()
+        try:
+            data = process_payslip(image_path, request.get('template') or self.template_path, output_path,
+                                   extractor=self.extractor, verbose=False)
+        except Exception as e:
+            self.failed += 1
+            print(f"Error processing {image_path}: {e}\n{traceback.format_exc()}")
+            # Reported to the client as a failed image, not as a bad request
+            future.set_exception(RuntimeError(str(e) or type(e).__name__))
+            return
+        seconds = time.perf_counter() - start
+        self.processed += 1
+        print(f"Processed {os.path.basename(image_path)} in {seconds:.2f}s")
+        future.set_result({'data': data, 'output': output_path, 'seconds': round(seconds, 3)})
+
+
+class _Handler(BaseHTTPRequestHandler):
+    service: PayslipService = None
+
+    def _reply(self, status: int, body: Dict[str, any]):
+        content = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def do_GET(self):
+        if self.path == '/health':
+            self._reply(200, self.service.health())
+        else:
+            self._reply(404, {'error': f"unknown path {self.path}"})
+
+    def do_POST(self):
+        if self.path != '/process':
+            self._reply(404, {'error': f"unknown path {self.path}"})
+            return
+        try:
+            length = int(self.headers.get('Content-Length') or 0)
+            result = self.service.submit(json.loads(self.rfile.read(length) or b'{}'))
+        except ValueError as e:
+            self._reply(400, {'error': str(e)})
+        except Exception as e:
+            self._reply(500, {'error': str(e)})
+        else:
+            self._reply(200, result)
+
+    def log_message(self, format, *args):
+        # Processed images are reported by PayslipService.run_next
+        pass
+
+
+def serve(extractor, template_path: str, port: int = DEFAULT_PORT):
+    """
+    Answer submissions on 127.0.0.1:port until interrupted (Ctrl+C or SIGTERM)
+
+    Args:
+        extractor: Loaded PayslipExtractor
+        template_path: Default template of the requests
+        port: Local port to listen on
+    """
+    import signal
+
+    service = PayslipService(extractor, template_path)
+    handler = type('Handler', (_Handler,), {'service': service})
+    server = ThreadingHTTPServer(('127.0.0.1', port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='payslip-service', daemon=True).start()
+
+    def on_sigterm(signum, frame):
+        raise KeyboardInterrupt
+
+    signal.signal(signal.SIGTERM, on_sigterm)
+    print(f"Payslip service listening on http://127.0.0.1:{port} (Ctrl+C to stop)")
+    try:
+        while True:
+            service.run_next()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.shutdown()
+        server.server_close()
+        print(f"\nService stopped: {service.processed} processed, {service.failed} failed")
+
+
+def submit(image_path: str, output_path: Optional[str] = None, template_path: Optional[str] = None,
+           url: str = DEFAULT_URL, timeout: float = 600) -> Dict[str, any]:
+    """
+    Have a running service process an image
+
+    Args:
+        image_path: Payslip image
+        output_path: Workbook for the service to write (None only extracts the data)
+        template_path: Template to fill (None uses the service's)
+        url: Base URL of the service
+        timeout: Seconds to wait for the result
+
+    Returns:
+        {'data': parsed payslip, 'output': workbook path, 'seconds': processing time}
+
+    Raises:
+        ConnectionError: The service is not running
+        RuntimeError: The service could not process the image
+    """
+    request = {
+        'image': os.path.abspath(image_path),
+        'output': os.path.abspath(output_path) if output_path else None,
+        'template': os.path.abspath(template_path) if template_path else None,
+    }
+    post = urllib.request.Request(url.rstrip('/') + '/process', data=json.dumps(request).encode('utf-8'),
+                                  headers={'Content-Type': 'application/json'})
+    try:
+        with urllib.request.urlopen(post, timeout=timeout) as response:
+            return json.loads(response.read())
+    except urllib.error.HTTPError as e:
+        try:
+            message = json.loads(e.read()).get('error')
+        except ValueError:
+            message = e.reason
+        raise RuntimeError(f"service could not process {image_path}: {message}") from None
+    except urllib.error.URLError as e:
+        raise ConnectionError(f"payslip service not reachable at {url}: {e.reason}") from None
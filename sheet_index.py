@@ -0,0 +1,290 @@
+#!/usr/bin/env python3
+"""
+In-memory index of the payroll template's employee rows
+
+The template lists staff in sections ("Director", "Factroy Foreigner",
+...), each closed by a subtotal row whose Basic Pay cell is a =SUM(...)
+formula. Scanning the sheet row by row for every employee written makes
+filling a large workbook quadratic, so the sheet is scanned once and the
+index answers:
+
+    which row holds an employee (by staff code, then NRIC/passport)
+    which section a new employee belongs to (by staff code prefix)
+    which row is the next free one at the end of that section
+    which running number (column A) comes next
+
+Rows inserted through the index keep it and the sheet's formulas in step.
+"""
+
+import re
+from copy import copy
+from typing import Dict, Iterable, List, Optional, Tuple
+
+
+_CELL_REF = re.compile(r"(?<![A-Za-z_$])(\$?[A-Z]{1,3}\$?)(\d+)(?![\d(])")
+_RANGE_END = re.compile(r"(:\$?[A-Z]{1,3}\$?)(\d+)(?![\d(])")
+# A single cell (not a range end) inside a SUM(...), e.g. the E11 of =SUM(E11)
+_SUM_ARGS = re.compile(r"SUM\(([^()]*)\)", re.IGNORECASE)
+_SINGLE_CELL = re.compile(r"(?<![A-Za-z_$:])(\$?[A-Z]{1,3}\$?)(\d+)(?![\d(:])")
+
+# Fewest blank rows inserted when a section fills up. A full section grows
+# by half its rows (at least this many): every insert rewrites all the
+# formulas of the sheet, so growing in chunks keeps a run of single
+# upserts (watch mode) from shifting the sheet once per employee
+SPARE_ROWS = 5
+
+# Columns read when indexing, in this order
+_KEY_FIELDS = ['no', 'employee_code', 'employee_name', 'nric', 'basic_pay']
+_KEY_COLUMNS = {'no': 'A', 'employee_code': 'B', 'employee_name': 'C', 'nric': 'D', 'basic_pay': 'E'}
+
+
+def insert_row(sheet, row: int, count: int = 1):
+    """
+    Insert blank rows above `row`, keeping formulas and merged cells intact
+
+    openpyxl's insert_rows only moves cells, so references to rows at or
+    below the insertion point are shifted here. Ranges ending right above
+    the insertion point (the SUM ranges of a section's subtotal row) are
+    extended so the new rows are included in the subtotal; so is a SUM of
+    the single cell above it (=SUM(E11) of a one-employee section).
+    """
+    sheet.insert_rows(row, count)
+
+    def shift(match):
+        ref_row = int(match.group(2))
+        return f"{match.group(1)}{ref_row + count if ref_row >= row else ref_row}"
+
+    def extend(match):
+        end_row = int(match.group(2))
+        return f"{match.group(1)}{row + count - 1 if end_row == row - 1 else end_row}"
+
+    def widen(match):
+        column, ref_row = match.group(1), int(match.group(2))
+        if ref_row != row - 1:
+            return match.group()
+        return f"{column}{ref_row}:{column}{row + count - 1}"
+
+    for cells in sheet.iter_rows():
+        for cell in cells:
+            if isinstance(cell.value, str) and cell.value.startswith('='):
+                formula = _CELL_REF.sub(shift, cell.value)
+                if cell.row == row + count:
+                    formula = _RANGE_END.sub(extend, formula)
+                    formula = _SUM_ARGS.sub(lambda match: f"SUM({_SINGLE_CELL.sub(widen, match.group(1))})",
+                                            formula)
+                cell.value = formula
+
+    for merged in sheet.merged_cells.ranges:
+        if merged.min_row >= row:
+            merged.shift(0, count)
+
+    # Give the new rows the look of the employee row above them
+    for cell in sheet[row - 1]:
+        if cell.has_style:
+            for new_row in range(row, row + count):
+                sheet.cell(row=new_row, column=cell.column)._style = copy(cell._style)
+
+
+def code_prefix(code: str) -> str:
+    """Letter prefix of a staff code, which decides its section (e.g. 'Y' for Y0004)"""
+    return re.match(r'[A-Z]*', (code or '').strip().upper()).group()
+
+
+def _code_key(code: str) -> str:
+    return (code or '').strip().upper()
+
+
+def _nric_key(nric: str) -> str:
+    # OCR and typing vary in dashes and spaces: 860116-56-5039 / 860116 56 5039
+    return re.sub(r'[^0-9A-Z]', '', (nric or '').upper())
+
+
+class Section:
+    """One staff section of the template"""
+
+    def __init__(self, name: Optional[str], header_row: Optional[int]):
+        self.name = name
+        self.header_row = header_row
+        self.first_row = None
+        self.last_row = None
+        self.total_row = None
+        self.prefixes = set()
+        # Column layout from the template schema (None: the default layout)
+        self.columns = None
+
+    @property
+    def next_row(self) -> int:
+        """Row after the section's last employee"""
+        return self.last_row + 1
+
+    @property
+    def free_rows(self) -> int:
+        """Blank rows left between the last employee and the subtotal row"""
+        return self.total_row - self.next_row
+
+
+class SheetIndex:
+    """Employee rows, sections and running numbers of one template sheet"""
+
+    def __init__(self, sheet, schema=None):
+        """
+        Scan the sheet once
+
+        A row is an employee row when column A holds its running number and
+        column B its staff code; a title in column B alone opens a section and
+        a =SUM subtotal in column E closes it.
+
+        Args:
+            sheet: Worksheet to index
+            schema: TemplateSchema of the template; gives the key columns and
+                each section's column layout (Section.columns)
+        """
+        self.sheet = sheet
+        self.schema = schema
+        self.sections: List[Section] = []
+        self.by_code: Dict[str, int] = {}
+        self.by_nric: Dict[str, Optional[int]] = {}
+        # row -> running number in column A
+        self.numbers: Dict[int, int] = {}
+        self.last_no = 0
+
+        from openpyxl.utils import column_index_from_string
+
+        keys = schema.key_columns() if schema is not None else _KEY_COLUMNS
+        positions = [column_index_from_string(keys[field]) for field in _KEY_FIELDS]
+
+        current = None
+        rows = sheet.iter_rows(min_col=1, max_col=max(positions), values_only=True)
+        for row, values in enumerate(rows, start=1):
+            number, code, name, nric, basic_pay = (values[position - 1] for position in positions)
+            if isinstance(number, int) and isinstance(code, str) and code.strip():
+                if current is None:
+                    current = Section(None, None)
+                if current.first_row is None:
+                    current.first_row = row
+                current.last_row = row
+                current.prefixes.add(code_prefix(code))
+                self._register(row, number, code, nric)
+            elif isinstance(basic_pay, str) and basic_pay.upper().startswith('=SUM('):
+                if current is not None and current.first_row is not None:
+                    current.total_row = row
+                    self.sections.append(current)
+                current = None
+            elif number is None and name is None and isinstance(code, str) and code.strip():
+                current = Section(code.strip(), row)
+
+        # The first section listing a prefix receives new employees with it
+        self.by_prefix: Dict[str, Section] = {}
+        for section in self.sections:
+            if schema is not None:
+                section.columns = schema.columns_for(section.name)
+            for prefix in section.prefixes:
+                self.by_prefix.setdefault(prefix, section)
+
+    def _register(self, row: int, number: int, code: str, nric: Optional[str]):
+        self.numbers[row] = number
+        self.last_no = max(self.last_no, number)
+        if _code_key(code):
+            self.by_code[_code_key(code)] = row
+        if isinstance(nric, str) and _nric_key(nric):
+            key = _nric_key(nric)
+            # An NRIC/passport listed on several rows (e.g. a worker moved from
+            # Y#### to Z####) is ambiguous: None, so it matches no row
+            self.by_nric[key] = row if self.by_nric.get(key, row) == row else None
+
+    def find(self, code: str, nric: str = '') -> Optional[int]:
+        """
+        Row of an employee already in the sheet, matched by staff code, then NRIC
+
+        The NRIC only matches when exactly one row lists it.
+        """
+        row = self.by_code.get(_code_key(code))
+        if row is None and _nric_key(nric):
+            row = self.by_nric.get(_nric_key(nric))
+        return row
+
+    def section_of(self, row: int) -> Optional[Section]:
+        """Section containing a row"""
+        for section in self.sections:
+            if section.first_row <= row < section.total_row:
+                return section
+        return None
+
+    def columns_at(self, row: int) -> Optional[Dict[str, any]]:
+        """Column layout of the section containing a row (None: the default layout)"""
+        section = self.section_of(row)
+        return section.columns if section is not None else None
+
+    def section_for(self, code: str) -> Optional[Section]:
+        """Section that new employees with this staff code go to"""
+        return self.by_prefix.get(code_prefix(code))
+
+    def upsert(self, code: str, nric: str = '') -> Tuple[int, int]:
+        """
+        Row and running number to write an employee to
+
+        An employee already in the sheet keeps its row and number. A new one
+        gets the row after the last employee of its section, with blank rows
+        inserted above the subtotal if the section is full (see SPARE_ROWS),
+        and the next running number. The index records the employee either way.
+
+        Raises:
+            ValueError: No section holds staff codes like `code`
+        """
+        row = self.find(code, nric)
+        if row is not None:
+            number = self.numbers.get(row) or self.last_no + 1
+        else:
+            section = self.section_for(code)
+            if section is None:
+                raise ValueError(f"No template section holds employee codes like '{code}'")
+            if section.free_rows < 1:
+                self.insert(section.total_row, max(SPARE_ROWS, (section.last_row - section.first_row + 1) // 2))
+            row = section.next_row
+            section.last_row = row
+            number = self.last_no + 1
+        self._register(row, number, code, nric)
+        return row, number
+
+    def reserve(self, employees: Iterable[Tuple[str, str]]):
+        """
+        Make room for several employees at once
+
+        Inserting rows rewrites every formula in the sheet, so the rows new
+        employees need are inserted with one insert per section instead of
+        one per employee.
+
+        Args:
+            employees: (staff code, NRIC) of the employees about to be written
+        """
+        needed: Dict[int, int] = {}
+        seen = set()
+        for code, nric in employees:
+            key = _code_key(code) or _nric_key(nric)
+            if key in seen or self.find(code, nric) is not None:
+                continue
+            seen.add(key)
+            section = self.section_for(code)
+            if section is not None:
+                needed[id(section)] = needed.get(id(section), 0) + 1
+
+        for section in self.sections:
+            shortfall = needed.get(id(section), 0) - section.free_rows
+            if shortfall > 0:
+                self.insert(section.total_row, shortfall)
+
+    def insert(self, row: int, count: int):
+        """Insert blank rows above `row` and move the indexed rows below them"""
+        insert_row(self.sheet, row, count)
+
+        def moved(value):
+            return value + count if value is not None and value >= row else value
+
+        self.by_code = {key: moved(value) for key, value in self.by_code.items()}
+        self.by_nric = {key: moved(value) for key, value in self.by_nric.items()}
+        self.numbers = {moved(key): value for key, value in self.numbers.items()}
+        for section in self.sections:
+            section.header_row = moved(section.header_row)
+            section.first_row = moved(section.first_row)
+            section.last_row = moved(section.last_row)
+            section.total_row = moved(section.total_row)
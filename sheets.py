@@ -0,0 +1,230 @@
+#!/usr/bin/env python3
+"""
+Sheets holding several payslips, split into one block per payslip before OCR
+
+    python3 sheets.py images/
+
+Some sites print two to four payslips on one sheet and photograph or scan
+the sheet whole. parse_payslip reads one employee per image, so such a
+sheet yields one record that mixes the employees' values. Splitting the
+sheet first turns each payslip into its own input, referenced as a block
+of the image or page (see pages.py), and each block is OCR'd, cached,
+recorded in the manifest and written like any other image. Small blocks
+also batch and spread over workers better than one large sheet.
+
+The layout is found on a copy reduced to ANALYSIS_SIDE pixels, without
+OCR. Rows (then columns) without ink split the sheet into bands of text;
+a sheet holds several payslips when its bands can be grouped into
+MAX_BLOCKS or fewer blocks that look alike: of similar size, and with the
+same pattern of text lines, since every payslip on a sheet is printed from
+the same template. The sections of a single payslip (header, earnings,
+totals) differ in size and pattern, so a single payslip stays whole.
+Stacked payslips, side-by-side payslips and grids of both are found.
+
+Sheets whose background is not blank between the payslips (shadows, a
+desk around the paper) are not split; they are processed whole as before.
+"""
+
+import os
+from itertools import combinations
+from typing import Iterable, Iterator, List, Optional, Tuple
+
+from pages import Box, block_ref, is_reference, load_page
+
+
+# Long side (pixels) of the copy the layout is analysed on
+ANALYSIS_SIDE = 600
+
+# Most payslips expected on one sheet
+MAX_BLOCKS = 4
+
+# Smallest gap between two payslips, as a fraction of the sheet side
+MIN_GAP = 0.02
+
+# Smallest payslip, as a fraction of the sheet side
+MIN_BLOCK = 0.15
+
+# Smallest ratio of the smallest to the largest block of a split
+MIN_SIZE_RATIO = 0.8
+
+# Smallest correlation of the blocks' text line patterns for a split
+MIN_CORRELATION = 0.6
+
+# Gaps between text bands tried as the boundary between two payslips: the
+# widest ones. Bounds the splits compared to C(9, 3) + C(9, 2) + 9 = 129
+# however many bands a sheet has.
+MAX_CUT_GAPS = 9
+
+# Largest fraction of a row (column) that may be ink for it to count as blank
+_BLANK = 0.005
+
+Span = Tuple[int, int]
+
+
+def _analysis_image(image_path: str):
+    """Upright grayscale copy of an image or page at ANALYSIS_SIDE, and the upright full size"""
+    from PIL import Image, ImageOps
+
+    if is_reference(image_path):
+        img = load_page(image_path).convert('L')
+        size = img.size
+    else:
+        with Image.open(image_path) as img:
+            size = img.size
+            img.draft('L', (ANALYSIS_SIDE, ANALYSIS_SIDE))
+            drafted = img.size
+            img = ImageOps.exif_transpose(img.convert('L'))
+        if img.size != drafted:
+            size = size[::-1]
+    img.thumbnail((ANALYSIS_SIDE, ANALYSIS_SIDE))
+    return img, size
+
+
+def _ink_runs(blank, min_gap: int) -> List[Span]:
+    """Runs of non-blank lines, joined across gaps narrower than min_gap"""
+    runs = []
+    start = None
+    last_ink = None
+    for i, is_blank in enumerate(blank):
+        if is_blank:
+            continue
+        if start is None:
+            start = i
+        elif i - last_ink > min_gap:
+            runs.append((start, last_ink + 1))
+            start = i
+        last_ink = i
+    if start is not None:
+        runs.append((start, last_ink + 1))
+    return runs
+
+
+def _similarity(profile, spans: List[Span]) -> float:
+    """Smallest correlation between the line patterns of the spans"""
+    import numpy as np
+
+    length = min(end - start for start, end in spans)
+    patterns = []
+    for start, end in spans:
+        segment = np.convolve(profile[start:end], np.ones(3) / 3, mode='same')
+        pattern = np.interp(np.linspace(0, len(segment) - 1, length), np.arange(len(segment)), segment)
+        if pattern.std() == 0:
+            return 0.0
+        patterns.append(pattern)
+    return min(float(np.corrcoef(a, b)[0, 1]) for a, b in combinations(patterns, 2))
+
+
+def _split_axis(ink, axis: int) -> Optional[List[Span]]:
+    """
+    Split an ink mask across one axis (0: into rows, 1: into columns)
+
+    Returns:
+        Spans of the blocks, each from the middle of the gap before it to
+        the middle of the gap after it; None when the mask is one block
+    """
+    profile = ink.mean(axis=1 - axis)
+    length = len(profile)
+    runs = _ink_runs(profile <= _BLANK, max(2, int(MIN_GAP * length)))
+    # Cut i falls in the gap between runs i - 1 and i
+    gaps = sorted(range(1, len(runs)), key=lambda i: runs[i][0] - runs[i - 1][1], reverse=True)
+    candidates = sorted(gaps[:MAX_CUT_GAPS])
+    best, best_score = None, MIN_CORRELATION
+    for count in range(min(MAX_BLOCKS, len(candidates) + 1), 1, -1):
+        for cuts in combinations(candidates, count - 1):
+            bounds = (0,) + cuts + (len(runs),)
+            spans = [(runs[a][0], runs[b - 1][1]) for a, b in zip(bounds, bounds[1:])]
+            sizes = [end - start for start, end in spans]
+            if min(sizes) < MIN_BLOCK * length or min(sizes) < MIN_SIZE_RATIO * max(sizes):
+                continue
+            score = _similarity(profile, spans)
+            if score >= best_score:
+                best, best_score = spans, score
+        # More payslips win over fewer: two pairs of payslips also look alike
+        if best is not None:
+            break
+    if best is None:
+        return None
+    edges = [0] + [(end + start) // 2 for (_, end), (start, _) in zip(best, best[1:])] + [length]
+    return list(zip(edges, edges[1:]))
+
+
+def find_blocks(img) -> List[Box]:
+    """
+    Boxes of the payslips on a sheet, in reading order (rows, then left to right)
+
+    Args:
+        img: Grayscale sheet (an analysis copy)
+
+    Returns:
+        (x0, y0, x1, y1) of each payslip in img's pixels; a single box
+        covering the whole sheet when it holds one payslip
+    """
+    import numpy as np
+
+    from preprocess import otsu_threshold
+
+    ink = np.asarray(img) < otsu_threshold(img.histogram())
+    height, width = ink.shape
+    blocks = []
+    rows = _split_axis(ink, 0)
+    if rows is not None:
+        for y0, y1 in rows:
+            columns = _split_axis(ink[y0:y1], 1) or [(0, width)]
+            blocks.extend((x0, y0, x1, y1) for x0, x1 in columns)
+        return blocks
+    for x0, x1 in _split_axis(ink, 1) or [(0, width)]:
+        # Columns first: rows are split within each column
+        for y0, y1 in _split_axis(ink[:, x0:x1], 0) or [(0, height)]:
+            blocks.append((x0, y0, x1, y1))
+    return sorted(blocks, key=lambda box: (box[1], box[0]))
+
+
+def sheet_blocks(image_path: str) -> List[Box]:
+    """Boxes of the payslips on an image or page, in full-size pixels of the upright image"""
+    img, (width, height) = _analysis_image(image_path)
+    scale_x, scale_y = width / img.width, height / img.height
+    boxes = []
+    for x0, y0, x1, y1 in find_blocks(img):
+        boxes.append((round(x0 * scale_x), round(y0 * scale_y),
+                      min(width, round(x1 * scale_x)), min(height, round(y1 * scale_y))))
+    return boxes
+
+
+def split_sheets(image_files: Iterable[str]) -> Iterator[str]:
+    """
+    Yield every payslip of a list of inputs: a block reference for each
+    payslip of a sheet holding several, other inputs as they are
+
+    An input that cannot be read is yielded as it is, so that processing
+    reports the error.
+    """
+    for image_path in image_files:
+        try:
+            boxes = sheet_blocks(image_path)
+        except ImportError:
+            raise
+        except Exception as e:
+            print(f"Cannot analyse the layout of {image_path}: {e}")
+            boxes = []
+        if len(boxes) < 2:
+            yield image_path
+            continue
+        for block, box in enumerate(boxes, 1):
+            yield block_ref(image_path, block, box)
+
+
+if __name__ == '__main__':
+    import argparse
+
+    from payslip_processor import find_images
+
+    parser = argparse.ArgumentParser(description='Show the payslips found on each sheet, without OCR')
+    parser.add_argument('image_dir', help='Directory of payslip images')
+    args = parser.parse_args()
+
+    for image_path in sorted(find_images(args.image_dir)):
+        boxes = sheet_blocks(image_path)
+        if len(boxes) > 1:
+            print(f"{os.path.basename(image_path)}: {len(boxes)} payslips at {boxes}")
+        else:
+            print(f"{os.path.basename(image_path)}: 1 payslip")
@@ -0,0 +1,241 @@
+#!/usr/bin/env python3
+"""
+Streaming record sinks: parsed payslips to CSV, JSONL or Parquet
+
+Payroll reconciliation only needs the records parse_payslip returns, and
+filling the xlsx template is the slowest step after OCR. A sink writes
+each record as soon as it is parsed, so a batch holds no workbook in
+memory and a crash loses nothing that was already written. The template
+can be filled from the records file afterwards in one pass (see
+payslip_processor.fill_from_records).
+
+Formats, chosen by the file extension:
+
+    .jsonl / .ndjson  one JSON object per line, nested fields as they are
+    .csv              one row per payslip; overtime and allowances as JSON text
+    .parquet          overtime as list<struct>, allowances as map<string, double>;
+                      needs pyarrow, and the file is only readable once closed
+
+JSONL and CSV lines are flushed per record. Parquet is written in row
+groups of row_group_size records.
+"""
+
+import csv
+import json
+import os
+from typing import Dict, Iterator, List, Optional
+
+
+SINK_FORMATS = {
+    '.jsonl': 'jsonl',
+    '.ndjson': 'jsonl',
+    '.csv': 'csv',
+    '.parquet': 'parquet',
+}
+
+# Keys of an overtime entry, in column order
+OVERTIME_KEYS = ['type', 'rate', 'hours', 'amount']
+
+
+def sink_format(path: str) -> str:
+    """Record format of a file, from its extension"""
+    extension = os.path.splitext(path)[1].lower()
+    if extension not in SINK_FORMATS:
+        raise ValueError(f"Unsupported records file '{path}', expected one of {', '.join(SINK_FORMATS)}")
+    return SINK_FORMATS[extension]
+
+
+def _import_pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        raise ImportError("Parquet records need pyarrow. Install it with: pip install pyarrow")
+    return pyarrow
+
+
+class RecordSink:
+    """Write parsed payslip records one at a time"""
+
+    def __init__(self, path: str, defaults: Dict[str, any]):
+        """
+        Args:
+            path: Records file to create (replaced if it exists)
+            defaults: Empty record; its keys are the columns and its values give their types
+        """
+        self.path = path
+        self.defaults = defaults
+        self.fields = ['image'] + list(defaults)
+        self.count = 0
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+    def _row(self, data: Dict[str, any], image_path: Optional[str]) -> Dict[str, any]:
+        """Record with every column, missing fields at their default"""
+        row = {'image': image_path}
+        for field, default in self.defaults.items():
+            row[field] = data.get(field, default)
+        return row
+
+    def write(self, data: Dict[str, any], image_path: Optional[str] = None):
+        """Write one parsed payslip"""
+        raise NotImplementedError
+
+    def close(self):
+        """Finish the file"""
+        raise NotImplementedError
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class JSONLSink(RecordSink):
+    """One JSON object per line"""
+
+    def __init__(self, path: str, defaults: Dict[str, any]):
+        super().__init__(path, defaults)
+        self.file = open(path, 'w', encoding='utf-8')
+
+    def write(self, data: Dict[str, any], image_path: Optional[str] = None):
+        self.file.write(json.dumps(self._row(data, image_path)) + '\n')
+        self.file.flush()
+        self.count += 1
+
+    def close(self):
+        self.file.close()
+
+
+class CSVSink(RecordSink):
+    """One row per payslip; list and dict fields are stored as JSON text"""
+
+    def __init__(self, path: str, defaults: Dict[str, any]):
+        super().__init__(path, defaults)
+        # utf-8-sig so Excel detects the encoding of names
+        self.file = open(path, 'w', encoding='utf-8-sig', newline='')
+        self.writer = csv.DictWriter(self.file, fieldnames=self.fields)
+        self.writer.writeheader()
+
+    def write(self, data: Dict[str, any], image_path: Optional[str] = None):
+        row = self._row(data, image_path)
+        for field, value in row.items():
+            if isinstance(value, (list, dict)):
+                row[field] = json.dumps(value)
+        self.writer.writerow(row)
+        self.file.flush()
+        self.count += 1
+
+    def close(self):
+        self.file.close()
+
+
+class ParquetSink(RecordSink):
+    """Columnar Parquet file written in row groups"""
+
+    def __init__(self, path: str, defaults: Dict[str, any], row_group_size: int = 500):
+        super().__init__(path, defaults)
+        pa = _import_pyarrow()
+        self.pa = pa
+        self.schema = pa.schema([(field, self._arrow_type(field)) for field in self.fields])
+        self.writer = pa.parquet.ParquetWriter(path, self.schema)
+        self.row_group_size = row_group_size
+        self.buffer: List[Dict[str, any]] = []
+
+    def _arrow_type(self, field: str):
+        pa = self.pa
+        default = self.defaults.get(field)
+        if isinstance(default, list):
+            return pa.list_(pa.struct([(key, pa.string() if key == 'type' else pa.float64())
+                                       for key in OVERTIME_KEYS]))
+        if isinstance(default, dict):
+            return pa.map_(pa.string(), pa.float64())
+        if isinstance(default, float):
+            return pa.float64()
+        if isinstance(default, int):
+            return pa.int64()
+        return pa.string()
+
+    def write(self, data: Dict[str, any], image_path: Optional[str] = None):
+        row = self._row(data, image_path)
+        for field, value in row.items():
+            if isinstance(value, dict):
+                row[field] = list(value.items())
+        self.buffer.append(row)
+        self.count += 1
+        if len(self.buffer) >= self.row_group_size:
+            self._flush()
+
+    def _flush(self):
+        if self.buffer:
+            self.writer.write_table(self.pa.Table.from_pylist(self.buffer, schema=self.schema))
+            self.buffer = []
+
+    def close(self):
+        self._flush()
+        self.writer.close()
+
+
+def open_sink(path: str, defaults: Dict[str, any]) -> RecordSink:
+    """Record sink for a file, in the format given by its extension"""
+    sinks = {'jsonl': JSONLSink, 'csv': CSVSink, 'parquet': ParquetSink}
+    return sinks[sink_format(path)](path, defaults)
+
+
+def _with_defaults(record: Dict[str, any], defaults: Dict[str, any]) -> Dict[str, any]:
+    """Fill the fields a record lacks (written by an older version) with their defaults"""
+    for field, default in defaults.items():
+        if field not in record:
+            record[field] = type(default)() if isinstance(default, (list, dict)) else default
+    return record
+
+
+def read_records(path: str, defaults: Optional[Dict[str, any]] = None) -> Iterator[Dict[str, any]]:
+    """
+    Read back the records of a sink file, with nested fields restored
+
+    Args:
+        path: JSONL, CSV or Parquet records file
+        defaults: Empty record used to convert CSV text back to numbers and to
+            fill the fields a record lacks
+
+    Yields:
+        One parsed payslip per record (with its 'image')
+    """
+    fmt = sink_format(path)
+    defaults = defaults or {}
+    if fmt == 'jsonl':
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # Blank or half-written last line of a crashed run
+                    continue
+                yield _with_defaults(record, defaults)
+
+    elif fmt == 'csv':
+        with open(path, encoding='utf-8-sig', newline='') as f:
+            for row in csv.DictReader(f):
+                record = {}
+                for field, value in row.items():
+                    default = defaults.get(field)
+                    if isinstance(default, (list, dict)):
+                        value = json.loads(value) if value else type(default)()
+                    elif isinstance(default, float):
+                        value = float(value) if value else 0.0
+                    elif isinstance(default, int):
+                        value = int(value) if value else 0
+                    record[field] = value
+                yield _with_defaults(record, defaults)
+
+    else:
+        pa = _import_pyarrow()
+        for batch in pa.parquet.ParquetFile(path).iter_batches():
+            for record in batch.to_pylist():
+                for field, value in record.items():
+                    # Map columns come back as lists of (key, value) pairs
+                    if isinstance(value, list) and (isinstance(defaults.get(field), dict)
+                                                    or value and isinstance(value[0], tuple)):
+                        record[field] = dict(value)
+                yield _with_defaults(record, defaults)
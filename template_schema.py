@@ -0,0 +1,256 @@
+#!/usr/bin/env python3
+"""
+Column and section layout of the payroll template, cached beside it
+
+Each staff block of the template has a two-row header ("No. / Staff Code /
+... / OT / EPF / SOCSO / EIS ..." above "1.0 Hrs / Amount / Employer /
+Employee ..."). The blocks share most columns, but their allowance
+columns differ: Leader Allw is column U in the foreigner blocks and does
+not exist in the management block. Introspecting the header rows gives
+each section its own column layout instead of hard-coded letters.
+
+The analysis is stored as JSON in a sidecar file beside the template
+(`<template>.schema.json`) together with the template's SHA-256, so later
+runs read it instead of analysing the template again; editing the template
+changes the hash and the schema is rebuilt.
+"""
+
+import json
+import os
+import re
+from typing import Dict, List, Optional
+
+import openpyxl
+from openpyxl.utils import column_index_from_string, get_column_letter
+
+from manifest import file_sha256
+from sheet_index import SheetIndex
+
+
+SCHEMA_VERSION = 1
+
+# Column layout of the template's first staff block, used without a schema
+DEFAULT_COLUMNS = {
+    'fields': {
+        'no': 'A', 'employee_code': 'B', 'employee_name': 'C', 'nric': 'D', 'basic_pay': 'E',
+        'ot_10_hours': 'F', 'ot_10_amount': 'G', 'ot_15_hours': 'H', 'ot_15_amount': 'I',
+        'ot_20_hours': 'J', 'ot_20_amount': 'K', 'ot_30_hours': 'L', 'ot_30_amount': 'M',
+        'rest_day_hours': 'N', 'rest_day_amount': 'O',
+        'public_holiday_hours': 'P', 'public_holiday_amount': 'Q', 'ot_total': 'R',
+        'total_payable': 'X',
+        'epf_employer': 'Y', 'epf_employee': 'Z', 'epf_total': 'AA',
+        'socso_employer': 'AB', 'socso_employee': 'AC', 'socso_total': 'AD',
+        'eis_employer': 'AE', 'eis_employee': 'AF', 'eis_total': 'AG',
+        'staff_loan': 'AH', 'advance': 'AI', 'pcb': 'AJ', 'nett_pay': 'AK',
+    },
+    'allowances': {
+        'CHILD_CARE': 'S', 'INCENTIVE': 'T', 'COND_INCENT': 'U', 'CAR_TRANSP': 'V', 'TRAVELLING_ALLW': 'W',
+    },
+}
+
+# Single-column headings (first header row, or both rows joined) -> field
+_FIELD_LABELS = {
+    'NO.': 'no',
+    'STAFF CODE': 'employee_code',
+    'STAFF NAME': 'employee_name',
+    'NRIC': 'nric',
+    'PASSPORT NO': 'nric',
+    'BASIC PAY': 'basic_pay',
+    'TOTAL PAYABLE': 'total_payable',
+    'STAFF LOAN': 'staff_loan',
+    'ADVANCE': 'advance',
+    'PCB': 'pcb',
+    'NETT PAYABLE': 'nett_pay',
+}
+
+# Second header row under OT -> field prefix (its Amount column follows it)
+_OT_LABELS = {
+    '1.0 HRS': 'ot_10',
+    '1.5 HRS': 'ot_15',
+    '2.0 HRS': 'ot_20',
+    '3.0 HRS': 'ot_30',
+    'REST DAY': 'rest_day',
+    'P. HOLIDAY': 'public_holiday',
+    'P.HOLIDAY': 'public_holiday',
+}
+
+_STATUTORY_GROUPS = {'EPF': 'epf', 'SOCSO': 'socso', 'EIS': 'eis'}
+
+
+def _label(value) -> str:
+    """Header cell text with whitespace collapsed, upper-cased"""
+    return ' '.join(str(value).split()).upper() if value is not None else ''
+
+
+def allowance_key(label: str) -> str:
+    """Allowance key for a column label, e.g. 'Car/ Transp' -> 'CAR_TRANSP' (as used by PAYSLIP_RULES)"""
+    return re.sub(r'[^0-9A-Z]+', '_', label.upper()).strip('_')
+
+
+def schema_cache_path(template_path: str) -> str:
+    """Sidecar file holding the schema of a template"""
+    return f"{template_path}.schema.json"
+
+
+def _header_columns(sheet, header_row: int) -> Dict[str, any]:
+    """Column layout of the staff block whose header starts at header_row"""
+    # A merged heading (OT over F:R) applies to every column under it
+    top = {}
+    for merged in sheet.merged_cells.ranges:
+        if merged.min_row == header_row:
+            value = sheet.cell(row=header_row, column=merged.min_col).value
+            for column in range(merged.min_col, merged.max_col + 1):
+                top[column] = value
+
+    fields = {}
+    allowances = {}
+    unmapped = []
+    ot_prefix = None
+    pending_allowances = []
+    for column in range(1, sheet.max_column + 1):
+        letter = get_column_letter(column)
+        first = _label(top.get(column, sheet.cell(row=header_row, column=column).value))
+        second = _label(sheet.cell(row=header_row + 1, column=column).value)
+        joined = f"{first} {second}".strip()
+
+        if first == 'OT':
+            if second in _OT_LABELS:
+                ot_prefix = _OT_LABELS[second]
+                fields[f'{ot_prefix}_hours'] = letter
+            elif second == 'AMOUNT' and ot_prefix:
+                fields[f'{ot_prefix}_amount'] = letter
+            elif second == 'TOTAL':
+                fields['ot_total'] = letter
+        elif first in _STATUTORY_GROUPS and second in ('EMPLOYER', 'EMPLOYEE', 'TOTAL'):
+            fields[f'{_STATUTORY_GROUPS[first]}_{second.lower()}'] = letter
+        elif joined in _FIELD_LABELS or first in _FIELD_LABELS:
+            fields[_FIELD_LABELS.get(joined) or _FIELD_LABELS[first]] = letter
+        elif joined:
+            # Candidate allowance; only columns between OT and Total Payable are allowances
+            pending_allowances.append((column, letter, joined))
+
+    ot_end = column_index_from_string(fields.get('ot_total', 'A'))
+    payable = column_index_from_string(fields.get('total_payable', get_column_letter(sheet.max_column)))
+    for column, letter, joined in pending_allowances:
+        if ot_end < column < payable:
+            allowances[allowance_key(joined)] = letter
+        else:
+            unmapped.append(f"{letter}: {joined}")
+
+    return {'fields': fields, 'allowances': allowances, 'unmapped': unmapped}
+
+
+def analyse_template(sheet, sha256: Optional[str] = None) -> Dict[str, any]:
+    """
+    Find the staff header rows, their column groups and the sections of a sheet
+
+    Args:
+        sheet: Template worksheet (loaded normally; read-only sheets lack merged cells)
+        sha256: Hash of the template file, stored with the schema
+
+    Returns:
+        JSON-serialisable schema
+    """
+    header_rows = []
+    for row, values in enumerate(sheet.iter_rows(min_col=1, max_col=5, values_only=True), start=1):
+        if any(_label(value) == 'STAFF CODE' for value in values):
+            header_rows.append(row)
+
+    columns = {str(row): _header_columns(sheet, row) for row in header_rows}
+
+    sections = []
+    for section in SheetIndex(sheet).sections:
+        above = [row for row in header_rows if row <= section.first_row]
+        sections.append({
+            'name': section.name,
+            'title_row': section.header_row,
+            'first_row': section.first_row,
+            'total_row': section.total_row,
+            'prefixes': sorted(section.prefixes),
+            'header_row': above[-1] if above else None,
+        })
+
+    return {
+        'version': SCHEMA_VERSION,
+        'sha256': sha256,
+        'sheet': sheet.title,
+        'header_rows': header_rows,
+        'columns': columns,
+        'sections': sections,
+    }
+
+
+class TemplateSchema:
+    """Column layout and sections of a template, as found by analyse_template"""
+
+    def __init__(self, data: Dict[str, any]):
+        self.data = data
+        self.header_rows: List[int] = data['header_rows']
+        self.sections: List[Dict[str, any]] = data['sections']
+        self._by_name = {section['name']: section for section in self.sections if section['name']}
+
+    def columns_for(self, section_name: Optional[str]) -> Dict[str, any]:
+        """Column layout of a section; the first staff block's for unknown sections"""
+        section = self._by_name.get(section_name)
+        if section is not None and section['header_row'] is not None:
+            return self.data['columns'][str(section['header_row'])]
+        if self.header_rows:
+            return self.data['columns'][str(self.header_rows[0])]
+        return DEFAULT_COLUMNS
+
+    def key_columns(self) -> Dict[str, str]:
+        """Columns of the running number, staff code, name, NRIC and basic pay"""
+        fields = self.columns_for(None)['fields']
+        return {field: fields.get(field, DEFAULT_COLUMNS['fields'][field])
+                for field in ('no', 'employee_code', 'employee_name', 'nric', 'basic_pay')}
+
+    def print_report(self):
+        """Print the header rows, column groups and sections"""
+        print(f"Sheet: {self.data['sheet']}")
+        for row in self.header_rows:
+            layout = self.data['columns'][str(row)]
+            print(f"\nStaff header at row {row}:")
+            print("  Fields: " + ', '.join(f"{field}={letter}" for field, letter in layout['fields'].items()))
+            print("  Allowances: " + ', '.join(f"{key}={letter}" for key, letter in layout['allowances'].items()))
+            if layout['unmapped']:
+                print("  Not mapped: " + ', '.join(layout['unmapped']))
+        print("\nSections:")
+        for section in self.sections:
+            print(f"  {section['name'] or '(untitled)'}: rows {section['first_row']}-{section['total_row'] - 1}, "
+                  f"subtotal row {section['total_row']}, codes {'/'.join(section['prefixes'])}, "
+                  f"header row {section['header_row']}")
+
+
+def load_template_schema(template_path: str, wb=None) -> TemplateSchema:
+    """
+    Schema of a template, from its sidecar cache when the template is unchanged
+
+    Args:
+        template_path: Excel template
+        wb: The template already loaded with openpyxl, to avoid loading it again on a cache miss
+    """
+    sha256 = file_sha256(template_path)
+    cache_path = schema_cache_path(template_path)
+    try:
+        with open(cache_path, encoding='utf-8') as f:
+            data = json.load(f)
+        if data.get('version') == SCHEMA_VERSION and data.get('sha256') == sha256:
+            return TemplateSchema(data)
+    except (OSError, ValueError):
+        pass
+
+    loaded = wb is None
+    if loaded:
+        wb = openpyxl.load_workbook(template_path)
+    data = analyse_template(wb.active, sha256)
+    if loaded:
+        wb.close()
+
+    try:
+        tmp_path = f"{cache_path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, indent=2)
+        os.replace(tmp_path, cache_path)
+    except OSError as e:
+        print(f"Warning: could not write template schema cache {cache_path}: {e}")
+    return TemplateSchema(data)
@@ -0,0 +1,59 @@
+import random
+import shutil
+
+import pytest
+
+Image = pytest.importorskip('PIL.Image')
+from PIL import ImageDraw, ImageFilter
+
+from dedup import find_duplicates
+
+
+def payslip(path, seed, blur=0):
+    """A page of black bars standing in for text lines"""
+    rng = random.Random(seed)
+    img = Image.new('L', (800, 1000), 255)
+    draw = ImageDraw.Draw(img)
+    for _ in range(40):
+        x, y = rng.randint(0, 600), rng.randint(0, 970)
+        draw.rectangle([x, y, x + rng.randint(50, 200), y + rng.randint(5, 25)], fill=0)
+    if blur:
+        img = img.filter(ImageFilter.GaussianBlur(blur))
+    img.save(path)
+    return str(path)
+
+
+def test_exact_copies_grouped_and_first_kept(tmp_path):
+    a = payslip(tmp_path / 'a.png', 1)
+    b = payslip(tmp_path / 'b.png', 2)
+    copy = str(tmp_path / 'a_copy.png')
+    shutil.copy(a, copy)
+
+    keep, groups = find_duplicates([a, b, copy])
+
+    assert keep == [a, b]
+    assert groups == [{'keep': a, 'quality': groups[0]['quality'],
+                       'duplicates': [{'path': copy, 'match': 'exact', 'distance': 0,
+                                       'quality': groups[0]['quality']}]}]
+
+
+def test_near_duplicates_only_grouped_with_a_distance(tmp_path):
+    blurred = payslip(tmp_path / 'blurred.png', 1, blur=2)
+    sharp = payslip(tmp_path / 'sharp.png', 1)
+    other = payslip(tmp_path / 'other.png', 2)
+
+    keep, groups = find_duplicates([blurred, sharp, other])
+    assert keep == [blurred, sharp, other] and groups == []
+
+    # The sharper retake is kept, even though it came second
+    keep, groups = find_duplicates([blurred, sharp, other], max_distance=40)
+    assert keep == [sharp, other]
+    assert groups[0]['keep'] == sharp
+    assert [(d['path'], d['match']) for d in groups[0]['duplicates']] == [(blurred, 'similar')]
+
+
+def test_unreadable_files_are_kept(tmp_path):
+    broken = tmp_path / 'broken.jpg'
+    broken.write_bytes(b'not an image')
+    keep, groups = find_duplicates([str(broken), str(broken)])
+    assert keep == [str(broken), str(broken)] and groups == []
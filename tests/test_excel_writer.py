@@ -0,0 +1,52 @@
+import os
+
+import pytest
+
+openpyxl = pytest.importorskip('openpyxl')
+
+from manifest import Manifest
+from metrics import MetricsCollector
+from payslip_processor import (UNMATCHED_SHEET, _empty_payslip_data, _write_consolidated_measured,
+                               write_workbook)
+
+TEMPLATE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'SA - Empty.xlsx')
+
+
+def payslip(code, name, basic_pay=1800.0):
+    data = _empty_payslip_data()
+    data.update(employee_no=code, employee_name=name, basic_pay=basic_pay, source_file=f'{name}.jpg')
+    return data
+
+
+def test_unmatched_payslips_kept_and_recorded_as_failures(tmp_path):
+    output = str(tmp_path / 'all.xlsx')
+    manifest = Manifest(str(tmp_path / 'manifest.jsonl'))
+    metrics = MetricsCollector(track_memory=False)
+    results = [payslip('Y0099', 'MATCHED'), payslip('', 'NO CODE'), payslip('Q0001', 'UNKNOWN PREFIX')]
+    for data in results:
+        image = str(tmp_path / data['source_file'])
+        manifest.record(image, 'done', 1.0, data=data)
+        with metrics.measure(image) as record:
+            pass
+        metrics.add(record)
+
+    _write_consolidated_measured(results, TEMPLATE, output, manifest, metrics)
+    manifest.close()
+
+    wb = openpyxl.load_workbook(output)
+    rows = list(wb[UNMATCHED_SHEET].iter_rows(values_only=True))
+    assert rows[0][-1] == 'Reason'
+    assert [(row[3], row[4], row[6]) for row in rows[1:]] == [(None, 'NO CODE', 1800), ('Q0001', 'UNKNOWN PREFIX', 1800)]
+    assert any(cell.value == 'Y0099' for cells in wb.active.iter_rows() for cell in cells)
+
+    statuses = {os.path.basename(path): entry['status'] for path, entry in manifest.entries.items()}
+    assert statuses == {'MATCHED.jpg': 'done', 'NO CODE.jpg': 'failed', 'UNKNOWN PREFIX.jpg': 'failed'}
+    assert metrics.summary()['failed'] == 2
+    assert metrics.batch_steps['consolidated_write']['unmatched'] == 2
+
+
+def test_single_workbook_saved_before_reporting_unmatched(tmp_path):
+    output = str(tmp_path / 'one.xlsx')
+    with pytest.raises(ValueError, match=UNMATCHED_SHEET):
+        write_workbook(payslip('', 'NO CODE'), TEMPLATE, output)
+    assert openpyxl.load_workbook(output)[UNMATCHED_SHEET].max_row == 2
@@ -0,0 +1,169 @@
+import json
+import sqlite3
+import threading
+
+import pytest
+
+from jobqueue import MAX_ATTEMPTS, JobQueue
+
+
+@pytest.fixture
+def images(tmp_path):
+    paths = []
+    for i in range(3):
+        path = tmp_path / f"slip{i}.jpg"
+        path.write_bytes(b'image %d' % i)
+        paths.append(str(path))
+    return paths
+
+
+@pytest.fixture
+def queues(tmp_path, images):
+    """Two connections to the same queue, as two workers on different machines have"""
+    path = str(tmp_path / 'queue.sqlite')
+    first = JobQueue(path, timeout=5)
+    first.add(images)
+    second = JobQueue(path, timeout=5)
+    yield first, second
+    first.close()
+    second.close()
+
+
+def job(jobs, image):
+    row = jobs.conn.execute('SELECT status, worker, attempts FROM jobs WHERE image = ?', (image,)).fetchone()
+    return dict(zip(('status', 'worker', 'attempts'), row))
+
+
+def test_add_is_idempotent(queues, images):
+    first, second = queues
+    counts = second.add(images)
+    assert counts['added'] == 0 and counts['changed'] == 0 and counts['queued'] == 3
+    assert first.counts()['pending'] == 3
+
+
+def test_changed_file_goes_back_to_pending(queues, images):
+    first, second = queues
+    image = first.claim('a')
+    first.complete(image, 'a', {'employee_no': 'Y0010'}, 1.0)
+    with open(image, 'ab') as f:
+        f.write(b' rescanned')
+    assert second.add(images)['changed'] == 1
+    assert job(first, image)['status'] == 'pending'
+
+
+def test_claimed_job_is_not_claimed_again(queues, images):
+    first, second = queues
+    claimed = [first.claim('a'), second.claim('b'), first.claim('a')]
+    assert sorted(claimed) == sorted(images)
+    assert second.claim('b') is None
+    assert job(first, claimed[1]) == {'status': 'running', 'worker': 'b', 'attempts': 1}
+
+
+def test_expired_lease_is_claimed_by_another_worker(queues, images):
+    first, second = queues
+    image = first.claim('a', lease_seconds=-1)
+    assert second.claim('b') == image
+    assert job(first, image) == {'status': 'running', 'worker': 'b', 'attempts': 2}
+
+
+def test_job_fails_after_max_attempts(queues, images):
+    first, second = queues
+    for attempt in range(MAX_ATTEMPTS):
+        assert first.claim(f'w{attempt}', lease_seconds=-1) == images[0]
+    # The next claim fails the job and moves on to the next one
+    assert second.claim('b') == images[1]
+    assert job(first, images[0])['status'] == 'failed'
+    assert 'lease expired' in second.failures()[0][1]
+
+
+def test_renew_after_the_lease_was_lost(queues, images):
+    first, second = queues
+    image = first.claim('a', lease_seconds=-1)
+    # An expired lease nobody else claimed yet can still be renewed
+    assert first.renew('a', [image], lease_seconds=-1) == [image]
+    assert second.claim('b') == image
+    assert first.renew('a', [image]) == []
+    assert second.renew('b', [image]) == [image]
+    # The worker that lost the job cannot store its result
+    assert not first.complete(image, 'a', {'employee_no': 'Y0010'}, 1.0)
+    assert second.complete(image, 'b', {'employee_no': 'Y0010'}, 1.0)
+    assert first.results() == [(image, {'employee_no': 'Y0010'})]
+
+
+def test_release_puts_the_job_back_without_an_attempt(queues, images):
+    first, second = queues
+    image = first.claim('a')
+    assert not second.release(image, 'b')
+    assert first.release(image, 'a')
+    assert job(first, image) == {'status': 'pending', 'worker': None, 'attempts': 0}
+    assert second.claim('b') == image
+
+
+def test_claim_waits_for_another_write_transaction(tmp_path, images):
+    path = str(tmp_path / 'queue.sqlite')
+    holder = JobQueue(path)
+    holder.add(images)
+    waiter = JobQueue(path, timeout=0.2)
+    holder.conn.execute('BEGIN IMMEDIATE')
+    try:
+        with pytest.raises(sqlite3.OperationalError, match='locked'):
+            waiter.claim('b')
+    finally:
+        holder.conn.execute('ROLLBACK')
+    assert waiter.claim('b') == images[0]
+    holder.close()
+    waiter.close()
+
+
+def test_concurrent_claims_get_distinct_jobs(tmp_path):
+    paths = []
+    for i in range(40):
+        path = tmp_path / f"slip{i}.jpg"
+        path.write_bytes(b'image %d' % i)
+        paths.append(str(path))
+    queue_path = str(tmp_path / 'queue.sqlite')
+    setup = JobQueue(queue_path)
+    setup.add(paths)
+    setup.close()
+
+    claimed = {}
+
+    def work(worker):
+        jobs = JobQueue(queue_path, timeout=30)
+        mine = claimed[worker] = []
+        while True:
+            image = jobs.claim(worker)
+            if image is None:
+                break
+            mine.append(image)
+            jobs.complete(image, worker, {'image': image}, 0.0)
+        jobs.close()
+
+    threads = [threading.Thread(target=work, args=(f'w{i}',)) for i in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    every = [image for mine in claimed.values() for image in mine]
+    assert sorted(every) == sorted(paths)
+    jobs = JobQueue(queue_path)
+    assert jobs.counts()['done'] == 40
+    jobs.close()
+
+
+def test_merge_queue_writes_finished_jobs(queues, images, tmp_path):
+    from payslip_processor import _empty_payslip_data, merge_queue
+
+    first, second = queues
+    for jobs, worker in ((first, 'a'), (second, 'b')):
+        image = jobs.claim(worker)
+        jobs.complete(image, worker, {**_empty_payslip_data(), 'employee_no': worker.upper()}, 1.0)
+    records_path = str(tmp_path / 'merged.jsonl')
+    results = merge_queue(first.path, None, records_path=records_path)
+
+    assert [data['employee_no'] for data in results] == ['A', 'B']
+    with open(records_path) as f:
+        records = [json.loads(line) for line in f]
+    assert [(record['image'], record['employee_no']) for record in records] == [(images[0], 'A'),
+                                                                                 (images[1], 'B')]
@@ -0,0 +1,68 @@
+import pytest
+
+from layout import LayoutProfile, calibrate_layout
+
+WIDTH, HEIGHT = 1000, 800
+
+
+def detection(text, x0, y0, x1, y1):
+    return [[[x0, y0], [x1, y0], [x1, y1], [x0, y1]], text, 0.9]
+
+
+SAMPLE = [
+    detection('ASIA INDUSTRIES SDN BHD', 100, 20, 500, 40),
+    detection('MONTHLY BANK', 600, 20, 760, 40),
+    detection('30/09/2024', 600, 45, 760, 65),
+    detection('LINE NO', 50, 100, 150, 120),
+    detection(':', 160, 100, 170, 120),
+    detection('Y0004', 200, 100, 300, 120),
+    detection('BASIC PAY', 50, 200, 200, 220),
+    detection('1500.00', 400, 200, 500, 220),
+    detection('BASIC PAY DIRECTOR FEE OVERTIME', 50, 600, 410, 620),
+    detection('ALLOWANCE GROSS PAY', 420, 600, 650, 620),
+    detection('1500.00', 50, 630, 130, 650),
+]
+
+
+def test_calibration_locates_values():
+    profile = calibrate_layout(SAMPLE, WIDTH, HEIGHT, 'sample.jpg')
+    fields = profile.fields
+
+    # 'self': the label detection with a margin of 0.4 x its height
+    assert fields['company_name']['box'] == [0.092, 0.015, 0.508, 0.06]
+    # 'below': the detection under the label
+    assert fields['date']['box'] == [0.592, 0.0462, 0.768, 0.0912]
+    # 'right': the first value right of the label, separators skipped, room left for longer amounts
+    assert fields['employee_no']['box'] == [0.15, 0.115, 0.32, 0.16]
+    assert fields['employee_no']['pattern'] == r'[A-Z]+\d+'
+
+    # Summary columns under headings merged into fewer detections; the
+    # summary's basic pay replaces the one in the earnings block
+    summary = {field: spec['box'] for field, spec in fields.items() if spec['region'] == 'summary'}
+    assert sorted(summary) == ['allowance_total', 'basic_pay', 'monthly_gross', 'overtime_total']
+    assert summary['basic_pay'][0] < summary['overtime_total'][0] < summary['allowance_total'][0] \
+        < summary['monthly_gross'][0]
+    assert all(box[1] == 0.775 for box in summary.values())
+
+    assert profile.regions['header'] == [0.092, 0.015, 0.768, 0.16]
+    assert profile.source == 'sample.jpg'
+
+
+def test_profile_save_load_and_pixel_boxes(tmp_path):
+    profile = calibrate_layout(SAMPLE, WIDTH, HEIGHT)
+    path = str(tmp_path / 'layout.json')
+    profile.save(path)
+    loaded = LayoutProfile.load(path)
+    assert loaded.fields == profile.fields and loaded.regions == profile.regions
+
+    boxes = loaded.pixel_boxes(2000, 1600)
+    assert boxes['employee_no'] == [300, 184, 640, 256]
+    # Boxes stay inside the image
+    assert all(0 <= x0 < x1 <= 2000 and 0 <= y0 < y1 <= 1600 for x0, y0, x1, y1 in boxes.values())
+
+
+def test_calibration_needs_boxes():
+    with pytest.raises(ValueError, match='bounding boxes'):
+        calibrate_layout([[None, 'BASIC PAY 1500.00', None]], WIDTH, HEIGHT)
+    with pytest.raises(ValueError, match='No payslip labels'):
+        calibrate_layout([detection('HELLO', 0, 0, 10, 10)], WIDTH, HEIGHT)
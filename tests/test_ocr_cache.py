@@ -0,0 +1,105 @@
+import builtins
+import sqlite3
+
+import pytest
+
+from ocr_cache import OCRCache
+
+DETECTIONS = [[[[0, 0], [10, 0], [10, 5], [0, 5]], 'x' * 100, 0.9]]
+
+
+def sizes(cache):
+    total = cache.conn.execute('SELECT total FROM cache_size').fetchone()[0]
+    summed = cache.conn.execute('SELECT COALESCE(SUM(size), 0) FROM ocr_results').fetchone()[0]
+    return total, summed
+
+
+def test_running_total_follows_puts_replacements_and_evictions(tmp_path):
+    cache = OCRCache(str(tmp_path), max_size_mb=0.002)
+    for i in range(30):
+        cache.put(f'k{i}', DETECTIONS)
+    cache.put('k29', [[None, 'short', None]])
+    total, summed = sizes(cache)
+    assert total == summed <= cache.max_size
+    cache.close()
+
+
+def test_recent_hits_survive_eviction(tmp_path):
+    cache = OCRCache(str(tmp_path), max_size_mb=0.002)
+    for i in range(10):
+        cache.put(f'k{i}', DETECTIONS)
+    # Hits are held back, but written before the oldest entries are picked
+    assert cache.get('k0') is not None
+    assert cache._touched
+    for i in range(10, 20):
+        cache.put(f'k{i}', DETECTIONS)
+    assert cache.get('k0') is not None
+    assert cache.get('k1') is None
+    cache.close()
+
+
+def test_total_is_summed_for_a_cache_without_it(tmp_path):
+    cache = OCRCache(str(tmp_path))
+    cache.put('a', DETECTIONS)
+    cache.put('b', DETECTIONS)
+    cache.close()
+    conn = sqlite3.connect(cache.path)
+    conn.execute('DROP TABLE cache_size')
+    conn.commit()
+    conn.close()
+
+    cache = OCRCache(str(tmp_path))
+    total, summed = sizes(cache)
+    assert total == summed > 0
+    cache.close()
+
+
+def test_hits_are_written_back_on_close(tmp_path):
+    cache = OCRCache(str(tmp_path))
+    cache.put('a', DETECTIONS)
+    before = cache.conn.execute('SELECT last_used FROM ocr_results').fetchone()[0]
+    cache.get('a')
+    cache.close()
+
+    conn = sqlite3.connect(cache.path)
+    assert conn.execute('SELECT last_used FROM ocr_results').fetchone()[0] > before
+    conn.close()
+
+
+def test_cache_miss_reads_the_image_once(tmp_path, monkeypatch):
+    Image = pytest.importorskip('PIL.Image')
+    from payslip_processor import PayslipExtractor
+
+    image_path = str(tmp_path / 'payslip.png')
+    Image.new('L', (40, 20), 255).save(image_path)
+    other_path = str(tmp_path / 'other.png')
+    Image.new('L', (30, 20), 255).save(other_path)
+
+    class Tesseract:
+        @staticmethod
+        def image_to_string(img):
+            return f'{img.size[0]}x{img.size[1]}'
+
+    # A Tesseract extractor without loading an engine
+    extractor = PayslipExtractor.__new__(PayslipExtractor)
+    extractor.__dict__.update(ocr_engine='tesseract', pytesseract=Tesseract, cache=OCRCache(str(tmp_path / 'cache')),
+                              layout=None, preprocessor=None, languages=['en'], engine_version='',
+                              reocr_threshold=None, _prefetched={}, contents={}, _page=(None, None))
+
+    opened = []
+    real_open = builtins.open
+
+    def counting_open(file, *args, **kwargs):
+        opened.append(file)
+        return real_open(file, *args, **kwargs)
+    monkeypatch.setattr(builtins, 'open', counting_open)
+
+    assert extractor.extract_detections(image_path) == [[None, '40x20', None]]
+    assert opened.count(image_path) == 1
+
+    # One cached image and one miss, both read once for their cache key only
+    assert extractor.extract_detections_batch([image_path, other_path]) == [
+        [[None, '40x20', None]], [[None, '30x20', None]]]
+    assert opened.count(image_path) == 2 and opened.count(other_path) == 1
+    assert extractor.contents == {}
+    extractor.cache.close()
@@ -0,0 +1,52 @@
+import io
+
+import pytest
+
+from pages import block_ref, expand_pages, is_reference, page_ref, read_reference, split_block_ref, split_page_ref
+
+
+def test_page_reference_round_trip():
+    ref = page_ref('scans/dept a.pdf', 3)
+    assert ref == 'scans/dept a.pdf#page=3'
+    assert is_reference(ref)
+    assert split_page_ref(ref) == ('scans/dept a.pdf', 3)
+    assert split_block_ref(ref) == (ref, None, None)
+
+
+def test_block_references_of_images_and_pages():
+    ref = block_ref('sheet.jpg', 2, (0, 1200, 1700, 2400))
+    assert ref == 'sheet.jpg#block=2&box=0,1200,1700,2400'
+    assert split_block_ref(ref) == ('sheet.jpg', 2, (0, 1200, 1700, 2400))
+    assert split_page_ref(ref) == ('sheet.jpg', None)
+
+    ref = block_ref(page_ref('scan.tif', 4), 1, (10, 20, 30, 40))
+    assert ref == 'scan.tif#page=4&block=1&box=10,20,30,40'
+    assert split_block_ref(ref) == ('scan.tif#page=4', 1, (10, 20, 30, 40))
+    assert split_page_ref(ref) == ('scan.tif', 4)
+
+
+def test_plain_paths_are_not_references():
+    for path in ['payslip.jpg', 'odd#name.jpg', 'scan.pdf#page=', 'scan.pdf#page=x', 'a.jpg#block=1']:
+        assert not is_reference(path)
+        assert split_page_ref(path) == (path, None)
+        assert split_block_ref(path) == (path, None, None)
+
+
+def test_tiff_pages_expanded_and_read_one_at_a_time(tmp_path):
+    Image = pytest.importorskip('PIL.Image')
+
+    scan = str(tmp_path / 'scan.tif')
+    pages = [Image.new('L', (60, 40), shade) for shade in (0, 100, 200)]
+    pages[0].save(scan, save_all=True, append_images=pages[1:])
+    single = str(tmp_path / 'single.tif')
+    Image.new('L', (60, 40)).save(single)
+    photo = str(tmp_path / 'photo.jpg')
+
+    assert list(expand_pages([scan, single, photo])) == [
+        page_ref(scan, 1), page_ref(scan, 2), page_ref(scan, 3), single, photo]
+
+    page = Image.open(io.BytesIO(read_reference(page_ref(scan, 2))))
+    assert page.size == (60, 40) and page.getpixel((0, 0)) == 100
+
+    block = Image.open(io.BytesIO(read_reference(block_ref(page_ref(scan, 3), 1, (10, 5, 30, 25)))))
+    assert block.size == (20, 20) and block.getpixel((0, 0)) == 200
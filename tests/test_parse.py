@@ -0,0 +1,51 @@
+from payslip_processor import PayslipExtractor
+
+
+def parse(text):
+    return PayslipExtractor.__new__(PayslipExtractor).parse_payslip(text)
+
+
+PAYSLIP = '\n'.join([
+    'APEXJAYA INDUSTRIES SDN BHD',
+    '2ND HALF PAYROLL - SEPTEMBER 2024',
+    'MONTHLY / BANK 30/09/2024',
+    'EMPLOYEE / LINE NO. Y0664',
+    'NAME',
+    'KYAW ZAW MIN',
+    'I/C NO. MD524604',
+    'BASIC RATE 1800.00',
+    'WORKING DAYS 26.00',
+    'LEADER ALLW. 230.00',
+    'BASIC PAY 1800.00',
+    'OVERTIME RATE HRS / DAYS AMOUNT',
+    '1.5 TIMES 12.9808 48.00 HRS 623.08',
+    'MONTHLY GROSS 2653.08',
+    "EPF ' YER 0.00",
+    "SOCSO ' YER 46.43",
+])
+
+
+def test_fields():
+    data = parse(PAYSLIP)
+    assert data['company_name'] == 'APEXJAYA INDUSTRIES SDN BHD'
+    assert data['period'] == '2ND HALF PAYROLL - SEPTEMBER 2024'
+    assert data['date'] == '30/09/2024'
+    assert data['employee_no'] == 'Y0664'
+    assert data['employee_name'] == 'KYAW ZAW MIN'
+    assert data['ic_no'] == 'MD524604'
+    assert (data['basic_rate'], data['working_days'], data['basic_pay']) == (1800.0, 26.0, 1800.0)
+    assert data['allowances'] == {'LEADER_ALLW': 230.0}
+    assert data['overtime'] == [{'type': '1.5 TIMES', 'rate': 12.9808, 'hours': 48.0, 'amount': 623.08}]
+    assert (data['monthly_gross'], data['socso_employer']) == (2653.08, 46.43)
+
+
+def test_glued_keywords_both_count():
+    # BASIC PAY and PAYROLL share "PAY" when OCR drops the space
+    data = parse('2ND HALF BASIC PAYROLL - SEPTEMBER 2024')
+    assert data['period'] == '2ND HALF BASIC PAYROLL - SEPTEMBER 2024'
+    assert data['basic_pay'] == 2.0
+
+
+def test_noise_lines_do_not_change_the_result():
+    noise = '\n'.join(f'{n:05d} ### ~~ ###' for n in range(100))
+    assert parse(noise + '\n' + PAYSLIP) == parse(PAYSLIP)
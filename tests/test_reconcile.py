@@ -0,0 +1,80 @@
+import pytest
+
+pytest.importorskip('numpy')
+
+from reconcile import reconcile
+
+
+def record(code, gross=2000.0, **changes):
+    """A payslip that passes every check: 11% / 13% EPF, SOCSO and EIS inside their bands"""
+    insured = min(gross, 6000.0)
+    data = {
+        'image': f'{code}.jpg', 'employee_no': code,
+        'basic_pay': gross, 'director_fee': 0.0, 'overtime': [], 'allowances': {},
+        'monthly_gross': gross, 'deduction': 0.0,
+        'epf_employee': round(gross * 0.11, 2), 'socso_employee': round(insured * 0.005, 2),
+        'eis_employee': round(insured * 0.002, 2),
+        'epf_employer': round(gross * 0.13, 2), 'socso_employer': round(insured * 0.0175, 2),
+        'eis_employer': round(insured * 0.002, 2),
+    }
+    data['nett_pay'] = round(gross - data['epf_employee'] - data['socso_employee'] - data['eis_employee'], 2)
+    data.update(changes)
+    return data
+
+
+def checks(report):
+    return [(anomaly['employee_no'], anomaly['check']) for anomaly in report['anomalies']]
+
+
+def test_consistent_batch_has_no_anomalies():
+    report = reconcile([record(f'Y{n:04d}', 2000.0 + 10 * n) for n in range(6)])
+    assert report['records'] == 6
+    assert report['anomalies'] == [] and report['counts'] == {}
+
+
+def test_arithmetic_checks():
+    overtime = [{'type': '1.5 TIMES', 'rate': 10.0, 'hours': 3.0, 'amount': 40.0}]
+    report = reconcile([
+        record('Y0001', basic_pay=1900.0),
+        record('Y0002', nett_pay=1000.0),
+        record('Y0003', nett_pay=0.0),
+        record('Y0004', basic_pay=1960.0, overtime=overtime),
+    ])
+    assert checks(report) == [('Y0001', 'gross'), ('Y0002', 'nett'), ('Y0003', 'nett'), ('Y0004', 'overtime')]
+    assert report['anomalies'][0]['detail'] == "earnings add up to 1900.00, gross is 2000.00"
+    assert report['anomalies'][2]['detail'] == "nett pay missing"
+
+
+def test_contribution_outside_its_bands():
+    report = reconcile([record('Y0001', epf_employee=150.0, nett_pay=1836.0),
+                        record('Y0002', epf_employee=0.0, nett_pay=1986.0)])
+    # 7.5% is no EPF rate; 0 (not covered) is allowed
+    assert checks(report) == [('Y0001', 'ratio')]
+    assert report['anomalies'][0]['detail'] == "epf_employee is 7.50% of gross"
+
+
+def test_misread_digit_is_a_section_outlier():
+    batch = [record(f'Y{n:04d}', 2000.0 + 10 * n) for n in range(6)]
+    batch.append(record('Y0099', 20000.0))
+    report = reconcile(batch)
+    assert set(checks(report)) == {('Y0099', 'outlier')}
+    assert report['counts'] == {'outlier': 3}
+
+
+def test_previous_month_change_and_duplicates():
+    previous = [record('Y0001', 2000.0), record('Y0002', 2000.0)]
+    report = reconcile([record('Y0001', 2100.0), record('Y0002', 2500.0), record('Y0002', 2500.0),
+                        record('Y0003', 9000.0)], previous=previous)
+    assert checks(report) == [
+        ('Y0002', 'previous_month'), ('Y0002', 'previous_month'),
+        ('Y0002', 'duplicate'), ('Y0002', 'duplicate'),
+    ]
+    assert report['anomalies'][0]['detail'] == "basic_pay 2500.00 vs 2000.00 last month (+25%)"
+
+
+def test_section_totals_by_code_prefix():
+    report = reconcile([record('Y0001', 2000.0), record('Y0002', 3000.0), record('M0001', 1500.0)])
+    totals = report['section_totals']
+    assert sorted(totals) == ['M', 'Y']
+    assert totals['Y']['employees'] == 2 and totals['Y']['monthly_gross'] == 5000.0
+    assert totals['M']['nett_pay'] == record('M0001', 1500.0)['nett_pay']
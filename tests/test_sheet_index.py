@@ -0,0 +1,104 @@
+import os
+
+import pytest
+
+openpyxl = pytest.importorskip('openpyxl')
+
+from sheet_index import SPARE_ROWS, SheetIndex
+
+TEMPLATE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'SA - Empty.xlsx')
+
+
+@pytest.fixture
+def sheet():
+    return openpyxl.load_workbook(TEMPLATE).active
+
+
+def section(index, name):
+    return next(section for section in index.sections if section.name == name)
+
+
+def test_insert_into_full_section_extends_range_sum(sheet):
+    index = SheetIndex(sheet)
+    foreigner = section(index, 'Factroy Foreigner')
+    assert (foreigner.last_row, foreigner.total_row, foreigner.free_rows) == (92, 93, 0)
+
+    row, number = index.upsert('Y0099')
+
+    # The 20-row section grows by 10 rows, one of them used
+    assert (row, number) == (93, 59)
+    assert (foreigner.total_row, foreigner.free_rows) == (103, 9)
+    assert sheet['E103'].value == '=SUM(E73:E102)'
+    # Totals below the insertion point follow the rows they add up
+    assert sheet['E107'].value == '=E66+E103+E55'
+    # Formulas above it are left alone
+    assert sheet['E44'].value == '=E41+E28+E12+E19'
+
+
+def test_insert_into_one_employee_section_widens_single_cell_sum(sheet):
+    index = SheetIndex(sheet)
+    assert section(index, 'Director').free_rows == 0
+
+    row, _ = index.upsert('A010')
+
+    assert row == 12
+    assert sheet['E17'].value == '=SUM(E11:E16)'
+    assert sheet['F17'].value == '=SUM(F11:F16)'
+    assert sheet['E49'].value == '=E46+E33+E17+E24'
+    # The next section's subtotal moved down with its rows
+    assert sheet['E24'].value == '=SUM(E21:E23)'
+
+
+def test_single_upserts_insert_in_chunks(sheet, monkeypatch):
+    index = SheetIndex(sheet)
+    inserts = []
+    insert = index.insert
+    monkeypatch.setattr(index, 'insert', lambda row, count: (inserts.append(count), insert(row, count)))
+
+    rows = [index.upsert(f'Y{n:04d}')[0] for n in range(100, 160)]
+
+    assert rows == list(range(93, 153))
+    assert inserts == [SPARE_ROWS * 2, 15, 22, 33]
+    assert sheet[f'E{section(index, "Factroy Foreigner").total_row}'].value == \
+        f'=SUM(E73:E{section(index, "Factroy Foreigner").total_row - 1})'
+
+
+def test_reserve_inserts_once_per_section(sheet):
+    index = SheetIndex(sheet)
+    index.reserve([('Y0097', ''), ('Y0098', ''), ('Y0099', ''), ('Y0001', 'MD124665')])
+    assert sheet['E96'].value == '=SUM(E73:E95)'
+
+    rows = [index.upsert(code)[0] for code in ('Y0097', 'Y0098', 'Y0099')]
+    assert rows == [93, 94, 95]
+    assert section(index, 'Factroy Foreigner').total_row == 96
+
+
+def test_free_row_is_used_without_insert(sheet):
+    index = SheetIndex(sheet)
+    row, _ = index.upsert('Z0099')
+    assert row == 124
+    assert sheet['E125'].value == '=SUM(E112:E124)'
+
+
+def test_existing_employee_keeps_row_and_number(sheet):
+    index = SheetIndex(sheet)
+    assert index.upsert('y0004') == (76, 29)
+
+
+def test_nric_fallback_ignores_dashes_and_spaces(sheet):
+    index = SheetIndex(sheet)
+    assert index.find('AE0Z', '860116 56 5039') == 31
+    assert index.find('', '860116-56-5039') == 31
+
+
+def test_duplicate_nric_is_ambiguous(sheet):
+    index = SheetIndex(sheet)
+    # Passport AE5173204 is listed for both Y0010 and Z0010
+    assert index.find('Y0010', 'AE5173204') == 82
+    assert index.find('Z0010', 'AE5173204') == 121
+    assert index.find('', 'AE5173204') is None
+    assert index.find('Y001O', 'AE5173204') is None
+
+    row, _ = index.upsert('Z0099', 'AE5173204')
+    assert row not in (82, 121)
+
@@ -0,0 +1,56 @@
+import random
+
+import pytest
+
+Image = pytest.importorskip('PIL.Image')
+pytest.importorskip('numpy')
+from PIL import ImageDraw
+
+from sheets import sheet_blocks, split_sheets
+
+
+def payslip(seed):
+    """A payslip of black bars: header, earnings lines, summary, footer"""
+    rng = random.Random(seed)
+    img = Image.new('L', (800, 1000), 255)
+    draw = ImageDraw.Draw(img)
+    y = 40
+    # The sections differ in size and line pattern, so one payslip is not split
+    for size, count, gap in [(30, 2, 20), (12, 14, 18), (20, 1, 60), (12, 4, 30)]:
+        for _ in range(count):
+            draw.rectangle([40, y, 40 + rng.randint(300, 700), y + size], fill=0)
+            y += size + gap
+        y += 40
+    return img
+
+
+def test_single_payslip_stays_whole(tmp_path):
+    path = str(tmp_path / 'one.png')
+    payslip(1).save(path)
+    assert sheet_blocks(path) == [(0, 0, 800, 1000)]
+    assert list(split_sheets([path])) == [path]
+
+
+def test_two_up_sheets_split_between_the_payslips(tmp_path):
+    stacked = Image.new('L', (800, 2100), 255)
+    stacked.paste(payslip(1), (0, 0))
+    stacked.paste(payslip(2), (0, 1100))
+    stacked_path = str(tmp_path / 'stacked.png')
+    stacked.save(stacked_path)
+
+    (x0, y0, x1, y1), (x2, y2, x3, y3) = sheet_blocks(stacked_path)
+    assert (x0, y0, x1) == (0, 0, 800) and (x2, x3, y3) == (0, 800, 2100)
+    # The cut falls in the blank band between the two payslips
+    assert y1 == y2 and 950 <= y1 <= 1150
+    assert list(split_sheets([stacked_path])) == [
+        f'{stacked_path}#block=1&box=0,0,800,{y1}', f'{stacked_path}#block=2&box=0,{y1},800,2100']
+
+    side_by_side = Image.new('L', (1700, 1000), 255)
+    side_by_side.paste(payslip(1), (0, 0))
+    side_by_side.paste(payslip(3), (900, 0))
+    side_path = str(tmp_path / 'side.png')
+    side_by_side.save(side_path)
+
+    (x0, y0, x1, y1), (x2, y2, x3, y3) = sheet_blocks(side_path)
+    assert (x0, y0, y1) == (0, 0, 1000) and (y2, x3, y3) == (0, 1700, 1000)
+    assert x1 == x2 and 750 <= x1 <= 950
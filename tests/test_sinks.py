@@ -0,0 +1,45 @@
+import pytest
+
+from sinks import open_sink, read_records, sink_format
+
+DEFAULTS = {'employee_no': '', 'employee_name': '', 'basic_pay': 0.0, 'working_days': 0.0,
+            'overtime': [], 'allowances': {}}
+
+PAYSLIP = {
+    'employee_no': 'Y0004', 'employee_name': 'KYAW MIN HTET', 'basic_pay': 1500.0,
+    'overtime': [{'type': '1.5 TIMES', 'rate': 10.8173, 'hours': 12.0, 'amount': 129.81}],
+    'allowances': {'LEADER_ALLW': 50.0},
+}
+
+
+@pytest.mark.parametrize('name', ['records.jsonl', 'records.csv', 'records.parquet'])
+def test_records_round_trip(tmp_path, name):
+    if name.endswith('.parquet'):
+        pytest.importorskip('pyarrow')
+    path = str(tmp_path / name)
+    with open_sink(path, DEFAULTS) as sink:
+        sink.write(PAYSLIP, 'a.jpg')
+        sink.write({}, 'scan.pdf#page=2')
+    assert sink.count == 2
+
+    first, empty = read_records(path, DEFAULTS)
+    # Fields the payslip lacks are written at their default
+    assert first == {'image': 'a.jpg', 'working_days': 0.0, **PAYSLIP}
+    assert empty == {'image': 'scan.pdf#page=2', **DEFAULTS}
+
+
+def test_older_records_get_new_fields(tmp_path):
+    path = str(tmp_path / 'old.jsonl')
+    with open_sink(path, {'employee_no': ''}) as sink:
+        sink.write({'employee_no': 'Y0001'}, 'a.jpg')
+    with open(path, 'a', encoding='utf-8') as f:
+        # Half-written last line of a crashed run
+        f.write('{"image": "b.jpg", "employ')
+
+    assert list(read_records(path, DEFAULTS)) == [{'image': 'a.jpg', **DEFAULTS, 'employee_no': 'Y0001'}]
+
+
+def test_unknown_extension_rejected():
+    assert sink_format('OUT.NDJSON') == 'jsonl'
+    with pytest.raises(ValueError, match='Unsupported records file'):
+        sink_format('records.xlsx')
@@ -0,0 +1,47 @@
+from validation import validate_payslip
+
+
+def payslip(**changes):
+    """A consistent payslip: 1500 + 0 + 3 x 10.0 + 50 = 1580 gross, 1580 - 184.4 = 1395.6 nett"""
+    data = {
+        'basic_pay': 1500.0, 'director_fee': 0.0, 'monthly_gross': 1580.0,
+        'overtime': [{'type': '1.5 TIMES', 'rate': 10.0, 'hours': 3.0, 'amount': 30.0}],
+        'allowances': {'LEADER_ALLW': 50.0},
+        'deduction': 0.0, 'epf_employee': 174.0, 'socso_employee': 7.25, 'eis_employee': 3.15,
+        'nett_pay': 1395.6,
+    }
+    data.update(changes)
+    return data
+
+
+def test_consistent_payslip_passes():
+    assert validate_payslip(payslip()) == []
+
+
+def test_rounding_within_tolerance_passes():
+    assert validate_payslip(payslip(monthly_gross=1580.04, nett_pay=1395.64)) == []
+
+
+def test_misread_gross_breaks_both_identities():
+    assert validate_payslip(payslip(monthly_gross=1680.0)) == [
+        "earnings add up to 1580.00, gross is 1680.00",
+        "gross less deductions is 1495.60, nett is 1395.60",
+    ]
+
+
+def test_overtime_line_must_multiply_out():
+    overtime = [{'type': '1.5 TIMES', 'rate': 10.0, 'hours': 3.0, 'amount': 80.0}]
+    problems = validate_payslip(payslip(overtime=overtime, monthly_gross=1630.0, nett_pay=1445.6))
+    assert problems == ["overtime 10.0 x 3.0 = 30.00, not 80.00"]
+
+
+def test_summary_line_totals_take_precedence():
+    # The summary line's overtime total is used instead of the overtime lines
+    problems = validate_payslip(payslip(overtime_total=130.0, allowance_total=50.0))
+    assert problems == ["earnings add up to 1680.00, gross is 1580.00"]
+
+
+def test_missing_figures_reported():
+    assert validate_payslip(payslip(basic_pay=0.0, monthly_gross=0.0)) == [
+        "basic pay missing", "monthly gross missing"]
+    assert validate_payslip(payslip(nett_pay=0.0)) == ["nett pay missing"]
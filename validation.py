@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+"""
+Arithmetic consistency checks of a parsed payslip
+
+A payslip's figures depend on each other, so a misread digit almost always
+breaks one of these identities:
+
+    gross    basic pay + director fee + overtime + allowances = monthly gross
+    nett     gross - deduction - EPF - SOCSO - EIS (employee) = nett pay
+    overtime rate x hours = amount, for every overtime line
+
+Overtime and allowance totals come from the summary line when it was
+parsed, otherwise from the individual overtime lines and allowances.
+Amounts are printed to the cent and overtime rates to four decimals, so
+values within `tolerance` are taken as equal.
+"""
+
+from typing import Dict, List
+
+# Largest difference (in RM) still taken as rounding
+TOLERANCE = 0.05
+
+
+def _near(a: float, b: float, tolerance: float) -> bool:
+    return abs(a - b) <= tolerance
+
+
+def validate_payslip(data: Dict[str, any], tolerance: float = TOLERANCE) -> List[str]:
+    """
+    Check that the figures of a parsed payslip add up
+
+    Args:
+        data: Parsed payslip (as parse_payslip / parse_fields return it)
+        tolerance: Largest difference taken as rounding
+
+    Returns:
+        A description of every failed check; empty if the payslip is consistent
+    """
+    problems = []
+    basic_pay = data.get('basic_pay') or 0.0
+    gross = data.get('monthly_gross') or 0.0
+    nett = data.get('nett_pay') or 0.0
+
+    if not basic_pay:
+        problems.append("basic pay missing")
+    if not gross:
+        problems.append("monthly gross missing")
+
+    overtime = data.get('overtime') or []
+    for entry in overtime:
+        expected = entry['rate'] * entry['hours']
+        if not _near(expected, entry['amount'], tolerance):
+            problems.append(f"overtime {entry['rate']} x {entry['hours']} = {expected:.2f}, "
+                            f"not {entry['amount']:.2f}")
+
+    overtime_total = data.get('overtime_total')
+    if overtime_total is None:
+        overtime_total = sum(entry['amount'] for entry in overtime)
+    allowance_total = data.get('allowance_total')
+    if allowance_total is None:
+        allowance_total = sum((data.get('allowances') or {}).values())
+
+    if basic_pay and gross:
+        earnings = basic_pay + (data.get('director_fee') or 0.0) + overtime_total + allowance_total
+        if not _near(earnings, gross, tolerance):
+            problems.append(f"earnings add up to {earnings:.2f}, gross is {gross:.2f}")
+
+    if gross:
+        if not nett:
+            problems.append("nett pay missing")
+        else:
+            deductions = sum(data.get(field) or 0.0 for field in
+                             ('deduction', 'epf_employee', 'socso_employee', 'eis_employee'))
+            if not _near(gross - deductions, nett, tolerance):
+                problems.append(f"gross less deductions is {gross - deductions:.2f}, nett is {nett:.2f}")
+
+    return problems
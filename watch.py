@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+"""
+Incremental detection of new images in a watched folder
+
+Scanners and phones copy files into the shared folder over several
+seconds, so a file is only reported once its size and modification time
+have stayed the same for a settle period. Polling keeps this portable
+(network shares do not always deliver filesystem events).
+"""
+
+import os
+import queue
+import threading
+import time
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+
+class FolderWatcher:
+    """Report image files in a directory once they have finished arriving"""
+
+    def __init__(self, directory: str, extensions, settle_seconds: float = 2.0):
+        """
+        Args:
+            directory: Folder to watch (not recursive)
+            extensions: Lower-case file extensions to report, e.g. {'.jpg', '.png'}
+            settle_seconds: How long size and modification time must stay unchanged
+        """
+        self.directory = directory
+        self.extensions = extensions
+        self.settle_seconds = settle_seconds
+        # path -> ((size, mtime_ns), time the signature was first seen)
+        self.pending: Dict[str, Tuple[Tuple[int, int], float]] = {}
+        # path -> signature when it was reported
+        self.reported: Dict[str, Tuple[int, int]] = {}
+
+    def poll(self) -> List[str]:
+        """Scan the directory once and return the files that became ready, oldest first"""
+        now = time.monotonic()
+        present = set()
+        ready = []
+
+        with os.scandir(self.directory) as entries:
+            for entry in entries:
+                if Path(entry.name).suffix.lower() not in self.extensions or not entry.is_file():
+                    continue
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                path = entry.path
+                signature = (stat.st_size, stat.st_mtime_ns)
+                present.add(path)
+
+                # Already reported and unchanged since; a rewritten file is reported again
+                if self.reported.get(path) == signature:
+                    continue
+
+                seen = self.pending.get(path)
+                if seen is None or seen[0] != signature:
+                    self.pending[path] = (signature, now)
+                elif signature[0] > 0 and now - seen[1] >= self.settle_seconds:
+                    ready.append((stat.st_mtime_ns, path))
+                    self.reported[path] = signature
+                    del self.pending[path]
+
+        # Forget deleted files
+        for path in list(self.pending):
+            if path not in present:
+                del self.pending[path]
+        for path in list(self.reported):
+            if path not in present:
+                del self.reported[path]
+
+        return [path for _, path in sorted(ready)]
+
+    def run(self, ready_queue: queue.Queue, stop: threading.Event, poll_interval: float = 1.0):
+        """
+        Poll until stop is set, putting ready files on ready_queue
+
+        ready_queue should be bounded: when processing falls behind, put()
+        blocks and polling pauses until there is room again.
+        """
+        while not stop.is_set():
+            for path in self.poll():
+                while not stop.is_set():
+                    try:
+                        ready_queue.put(path, timeout=poll_interval)
+                        break
+                    except queue.Full:
+                        continue
+            stop.wait(poll_interval)
+
+    def start(self, ready_queue: queue.Queue, stop: threading.Event,
+              poll_interval: float = 1.0) -> threading.Thread:
+        """Run the watcher in a daemon thread"""
+        thread = threading.Thread(target=self.run, args=(ready_queue, stop, poll_interval),
+                                  name='folder-watcher', daemon=True)
+        thread.start()
+        return thread